@@ -1,7 +1,8 @@
 from mesa import Agent
+from array import array
 from enum import Enum, auto
-import random
-import heapq
+from routing import UNREACHABLE
+from dstarlite import DStarLite
 
 class AgentType(Enum):
     CAR = auto()
@@ -17,82 +18,112 @@ class TrafficAgent(Agent):
         self.agent_type = agent_type
         
 class CarAgent(TrafficAgent):
-    def __init__(self, unique_id, model):
+    def __init__(self, unique_id, model, number):
         super().__init__(unique_id, model, AgentType.CAR)
+        # Marks the car's cell in model.occupancy
+        self.number = number
         self.steps_taken = 0
-        self.agent_type = AgentType.CAR
         self.destination = None
         self.waiting_time = 0
         self.current_direction = None
+        # Kernel cell ids of the route, read from path_cursor on
         self.path = None
-
-    def heuristic(self, pos1, pos2):
-        """Manhattan distance heuristic for A*"""
-        return abs(pos1[0] - pos2[0]) + abs(pos1[1] - pos2[1])
-
-    def get_valid_neighbors(self, pos):
-        """Get valid neighboring positions"""
-        neighbors = []
-        x, y = pos
-        
-        for dx, dy in [(0, 1), (0, -1), (1, 0), (-1, 0)]:
-            next_pos = (x + dx, y + dy)
-            
-            # Basic boundary check
-            if not (0 <= next_pos[0] < self.model.grid.width and 
-                   0 <= next_pos[1] < self.model.grid.height):
-                continue
-            
-            # Check if movement is valid
-            if self.is_valid_move(pos, next_pos):
-                neighbors.append(next_pos)
-        
-        return neighbors
+        self.path_cursor = 0
+        # D* Lite search state kept between replans with routing="dstar"
+        self.planner = None
+        # Trip bookkeeping for model.stats: the step the car spawned after, its last move and its stops
+        self.spawn_step = self.last_move = model.step_count
+        self.stops = 0
 
     def find_path_astar(self):
-        """A* pathfinding implementation"""
+        """A* pathfinding on the model's shared search kernel"""
         if not self.destination:
             return None
-
-        start = self.pos
-        goal = self.destination
-
-        # Initialize data structures
-        open_set = [(self.heuristic(start, goal), start)]
-        came_from = {}
-        g_score = {start: 0}
-        f_score = {start: self.heuristic(start, goal)}
-        closed_set = set()
-
-        while open_set:
-            current = heapq.heappop(open_set)[1]
-
-            if current == goal:
-                # Reconstruct path
-                path = []
-                while current in came_from:
-                    path.append(current)
-                    current = came_from[current]
-                path.append(start)
-                path.reverse()
-                return path[1:] if len(path) > 1 else []
-
-            closed_set.add(current)
-
-            for neighbor in self.get_valid_neighbors(current):
-                if neighbor in closed_set:
+        kernel = self.model.search_kernel
+        blocked = self.model.blocked_ids([self.pos])
+        return kernel.route_ids(kernel.cell_id(self.pos), kernel.cell_id(self.destination), blocked,
+                                self.model.landmarks, self.model.congestion)
+
+    def plan_route(self):
+        """Compute the path to the destination with the model's routing strategy, as cell ids"""
+        if self.model.routing == "fields":
+            path = self.follow_distance_field()
+        elif self.model.routing == "dstar":
+            path = self.replan_incremental()
+        else:
+            return self.find_path_astar()
+        if path is None:
+            return None
+        cell_id = self.model.search_kernel.cell_id
+        return array('i', [cell_id(pos) for pos in path])
+
+    def set_path(self, path):
+        """Follow path, an array of cell ids or None, from its first cell"""
+        self.path = path
+        self.path_cursor = 0
+
+    def has_path(self):
+        """True while the path has cells left to move to"""
+        return self.path is not None and self.path_cursor < len(self.path)
+
+    def sense_blocked_cells(self):
+        """Road cells around the car that a car or a red light blocks right now"""
+        radius = self.model.sense_radius
+        x, y = self.pos
+        blocked = []
+        for cx in range(max(0, x - radius), min(self.model.width, x + radius + 1)):
+            for cy in range(max(0, y - radius), min(self.model.height, y + radius + 1)):
+                pos = (cx, cy)
+                if pos == self.pos or not self.model.road_graph.is_road(pos):
                     continue
+                if self.model.is_occupied(pos):
+                    blocked.append(pos)
+                elif self.model.signals.is_red(pos):
+                    blocked.append(pos)
+        return blocked
+
+    def replan_incremental(self):
+        """D* Lite route that repairs the car's previous search instead of starting over.
+
+        The car only sees the cells within model.sense_radius, so only the
+        blockages there are part of the search and the rest of the map is
+        assumed free.
+        """
+        if not self.destination:
+            return None
 
-                tentative_g_score = g_score[current] + 1
+        blocked = self.sense_blocked_cells()
+        if self.planner is None or self.planner.goal != self.destination:
+            self.planner = DStarLite(self.model.road_graph, self.pos, self.destination, blocked)
+        else:
+            self.planner.move_start(self.pos)
+            # Cells out of sight are assumed free again, cars there have moved on
+            self.planner.update_cells(blocked, self.planner.blocked.difference(blocked))
+        return self.planner.plan(horizon=self.model.sense_radius)
+
+    def follow_distance_field(self):
+        """Pick the next hop by looking at the neighbors' distance to the destination.
+
+        Returns a one cell path, so the car asks again after every move. A
+        free neighbor closer to the destination is preferred; when they are
+        all blocked the car keeps the best one and waits for it to clear.
+        """
+        if not self.destination:
+            return None
 
-                if neighbor not in g_score or tentative_g_score < g_score[neighbor]:
-                    came_from[neighbor] = current
-                    g_score[neighbor] = tentative_g_score
-                    f = tentative_g_score + self.heuristic(neighbor, goal)
-                    f_score[neighbor] = f
-                    heapq.heappush(open_set, (f, neighbor))
+        field = self.model.distance_fields.field(self.destination)
+        candidates = self.model.road_graph.successors(self.pos)
+        if abs(self.destination[0] - self.pos[0]) + abs(self.destination[1] - self.pos[1]) == 1:
+            candidates.append(self.destination)
 
-        return None
+        reachable = sorted((field[pos], pos) for pos in candidates if field[pos] != UNREACHABLE)
+        if not reachable:
+            return None
+
+        for distance, next_pos in reachable:
+            if distance < field[self.pos] and self.is_valid_move(self.pos, next_pos):
+                return [next_pos]
+        return [reachable[0][1]]
 
     def calculate_movement_direction(self, current_pos, next_pos):
         """Calculate the direction of movement between two positions"""
@@ -122,9 +153,13 @@ class CarAgent(TrafficAgent):
             return
 
         # If no path exists or it's empty, calculate a new one
-        if not self.path:
-            self.path = self.find_path_astar()
-            if not self.path:
+        if not self.has_path():
+            # A path followed to its end just needs the next stretch, like every hop of
+            # routing="fields"; it is a replan when the last search failed or the destination changed
+            if self.path is None:
+                self.model.replans += 1
+            self.set_path(self.plan_route())
+            if not self.has_path():
     
                 self.waiting_time += 1
                 if self.waiting_time > 5:
@@ -133,45 +168,61 @@ class CarAgent(TrafficAgent):
                 return
 
         # Try to move to next position in path
-        next_pos = self.path[0]
-        
-        # Get current cell contents to check for traffic light
-        current_cell_contents = self.model.grid.get_cell_list_contents(self.pos)
-        next_cell_contents = self.model.grid.get_cell_list_contents(next_pos)
-        
-        # Check for traffic lights first
-        traffic_lights = [agent for agent in next_cell_contents 
-                        if isinstance(agent, TrafficLightAgent)]
+        next_pos = self.model.search_kernel.position(self.path[self.path_cursor])
         
-        if traffic_lights:
-            traffic_light = traffic_lights[0]
-            dx = next_pos[0] - self.pos[0]
-            dy = next_pos[1] - self.pos[1]
-            
-            # If light is red and moving in the restricted direction, wait
-            if traffic_light.state == "red":
-                if (traffic_light.orientation == "horizontal" and abs(dx) > 0) or \
-                (traffic_light.orientation == "vertical" and abs(dy) > 0):
-        
-                    self.waiting_time += 1
-                    return
+        # Check for traffic lights first: wait if a red light stops moves in this direction
+        if self.model.signals.stops(self.pos, next_pos):
+            self.waiting_time += 1
+            return
         
         # If movement is valid, move the car
         if self.is_valid_move(self.pos, next_pos):
 
-            self.model.grid.move_agent(self, next_pos)
-            self.path.pop(0)
+            self.model.move_car(self, next_pos)
+            self.path_cursor += 1
             self.waiting_time = 0
             self.current_direction = self.calculate_movement_direction(self.pos, next_pos)
         else:
             # If can't move, increment waiting time and recalculate path if waiting too long
+            self.model.failed_moves += 1
             self.waiting_time += 1
 
             if self.waiting_time > 3:
-    
-                self.path = self.find_path_astar()  # Recalculate path
+                self.model.replans += 1
+                self.set_path(self.plan_route())  # Recalculate path
                 self.waiting_time = 0
 
+    def idle_wait(self):
+        """How the next steps leave the car waiting in place, None when it would act.
+
+        Returns (increment, steps, light_cell): waiting_time grows by
+        increment on each step, steps is how many steps the car waits before
+        it replans (-1 while only a red light holds it) and light_cell is
+        the signal cell it waits to enter, None if there is no light there.
+        """
+        if not self.destination or self.pos == self.destination or not self.has_path():
+            return None
+        signals = self.model.signals
+        next_pos = self.model.search_kernel.position(self.path[self.path_cursor])
+        light_cell = next_pos if signals.light_at[next_pos] >= 0 else None
+        if signals.stops(self.pos, next_pos):
+            return 1, -1, light_cell
+
+        # The checks of is_valid_move, which counts a red light as one more step of waiting
+        red = signals.is_red(next_pos)
+        if next_pos == self.destination or (not red and not self.model.is_occupied(next_pos)
+                                            and self.is_valid_turn(self.pos, next_pos)):
+            return None
+        increment = 2 if red else 1
+        steps = (3 - self.waiting_time) // increment
+        if steps <= 0:
+            return None
+        return increment, steps, light_cell
+
+    def wait(self, steps, increment):
+        """Apply steps idle steps, see idle_wait"""
+        self.waiting_time += steps * increment
+
     def is_valid_move(self, current_pos, next_pos):
         """Check if the move is valid considering all constraints"""
         # Check grid boundaries
@@ -183,82 +234,33 @@ class CarAgent(TrafficAgent):
         if next_pos == self.destination:
             return True
 
-        # Get cell contents at next position
-        cell_contents = self.model.grid.get_cell_list_contents(next_pos)
-
-        traffic_lights = [agent for agent in cell_contents 
-                        if isinstance(agent, TrafficLightAgent)]
-
-        if traffic_lights:
-            traffic_light = traffic_lights[0]
-            # Si hay un semáforo y está en rojo, el carro se detiene completamente
-            if traffic_light.state == "red":
-    
-                self.waiting_time += 1
-                return False
-
-        # Check for collisions with other cars or obstacles
-        if any(isinstance(agent, (CarAgent, BuildingAgent)) for agent in cell_contents):
-            return False
-
-        # Check if there's a valid road direction
-        road_exists = False
-        for agent in cell_contents:
-            if isinstance(agent, RoadAgent):
-                road_exists = True
-                break
-        if not road_exists:
+        # Si hay un semáforo y está en rojo, el carro se detiene completamente
+        if self.model.signals.is_red(next_pos):
+            self.waiting_time += 1
             return False
 
-        # Calculate movement direction
-        movement_dir = self.calculate_movement_direction(current_pos, next_pos)
-        if not movement_dir:
+        # Check for collisions with other cars
+        if self.model.is_occupied(next_pos):
             return False
 
-        # Check if this is a valid turn
+        # Roads, buildings and turns are resolved by the compiled road graph
         return self.is_valid_turn(current_pos, next_pos)
 
     def is_valid_turn(self, current_pos, next_pos):
         """Check if a turn is valid based on road directions"""
-        current_directions = self.get_road_directions(current_pos)
-        next_directions = self.get_road_directions(next_pos)
-        
-        if not current_directions or not next_directions:
-            return False
-
-        movement_dir = self.calculate_movement_direction(current_pos, next_pos)
-        if not movement_dir:
-            return False
-
-        valid_turns = {
-            'right': {'up', 'down', 'right'},
-            'left': {'up', 'down', 'left'},
-            'up': {'left', 'right', 'up'},
-            'down': {'left', 'right', 'down'}
-        }
-
-        for current_dir in current_directions:
-            if movement_dir in valid_turns[current_dir]:
-                for next_dir in next_directions:
-                    if next_dir in valid_turns[movement_dir]:
-                        return True
-        return False
+        return self.model.road_graph.can_move(current_pos, next_pos)
 
     def get_road_directions(self, pos):
         """Get all valid road directions at a position"""
-        cell_contents = self.model.grid.get_cell_list_contents(pos)
-        directions = set()
-        for agent in cell_contents:
-            if isinstance(agent, RoadAgent):
-                directions.add(agent.direction)
-        return list(directions)
+        return self.model.road_graph.road_directions(pos)
 
     def find_destination(self):
         """Find a random destination from available destinations"""
         if self.model.available_destinations:
-            self.destination = random.choice(self.model.available_destinations)
+            # The model's random, so a checkpoint carries every draw the cars make
+            self.destination = self.model.random.choice(self.model.available_destinations)
 
-            self.path = None
+            self.set_path(None)
             return True
         return False
 
@@ -266,59 +268,15 @@ class TrafficLightAgent(TrafficAgent):
     def __init__(self, unique_id, model, orientation):
         super().__init__(unique_id, model, AgentType.TRAFFIC_LIGHT)
         self.orientation = orientation
-        # Iniciar los semáforos en estados opuestos según orientación
-        self.state = "green" if orientation == "horizontal" else "red"
-        self.timer = 10
-        self.base_timer = 10
-        self.min_timer = 5
-        self.max_timer = 20
 
-    def step(self):
-        """Update traffic light state"""
-        # Solo el primer semáforo horizontal controla el cambio
-        if self.is_group_leader():
-            cars_waiting = self.count_waiting_cars()
-            
-            if cars_waiting > 0:
-                self.timer -= 2
-            else:
-                self.timer -= 1
-                
-            if self.timer <= 0:
-                # Cambiar estados de todos los semáforos
-                self.switch_all_traffic_lights()
-                
-                # Reiniciar timer
-                self.timer = max(self.min_timer, 
-                               min(self.max_timer, 
-                                   self.base_timer + (cars_waiting * 2)))
-
-    def is_group_leader(self):
-        """Solo el primer semáforo horizontal será el líder"""
-        horizontal_lights = [agent for agent in self.model.traffic_lights 
-                           if agent.orientation == "horizontal"]
-        return self == horizontal_lights[0] if horizontal_lights else False
-
-    def switch_all_traffic_lights(self):
-        """Cambiar estados de todos los semáforos"""
-        for light in self.model.traffic_lights:
-            if light.orientation == "horizontal":
-                light.state = "green" if light.state == "red" else "red"
-            else:  # vertical
-                light.state = "red" if light.state == "green" else "green"
-            light.timer = self.timer
+    @property
+    def state(self):
+        """"red" or "green", read from the model's signal index"""
+        return self.model.signals.state(self.pos)
 
-    
-    def count_waiting_cars(self):
-        """Count cars waiting at this traffic light"""
-        waiting = 0
-        neighbors = self.model.grid.get_neighbors(
-            self.pos, moore=False, include_center=True, radius=1
-        )
-        for neighbor in neighbors:
-            if isinstance(neighbor, CarAgent):
-                waiting += 1
-        return waiting
+    def step(self):
+        """Lights have no behavior of their own, the model's SignalController switches them"""
+        pass
 
 class RoadAgent(TrafficAgent):
     """Road agent with direction information"""
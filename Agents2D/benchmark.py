@@ -0,0 +1,587 @@
+# benchmark.py
+# Headless benchmarks for TrafficModel.
+#   python benchmark.py steps --steps 1000
+#   python benchmark.py scale --sizes 100 250 500 1000 --cars 1000 10000 --engine vector
+#   python benchmark.py alt --sizes 250 500 --pairs 100
+#   python benchmark.py replan --size 100 --cars 2000 --steps 50
+#   python benchmark.py batch --size 250 --cars 1000 4000 --workers 0 1 2 4
+#   python benchmark.py kernel --sizes 100 250 500 --routes 200
+#   python benchmark.py congestion --size 60 --cars 300 --steps 1000 --refresh 1 5 20
+#   python benchmark.py checkpoint --size 250 --cars 1000 10000 --engine vector
+#   python benchmark.py tiles --size 500 --cars 20000 --tiles 1 2 4 8
+#   python benchmark.py profile --steps 1000 --engine vector --cprofile 200
+import argparse
+import contextlib
+import glob
+import heapq
+import io
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from agent import CarAgent
+from checkpoint import fork, load_checkpoint, save_checkpoint
+from model import TrafficModel
+from profiler import StepProfiler, format_report
+from mapgen import generate_grid_city, read_map, tile_map, write_map
+
+DEFAULT_MAPS = sorted(glob.glob("public/*_base.txt"))
+DEFAULT_DICT = "public/mapDictionary.json"
+
+
+def build_model(map_file, map_dict=DEFAULT_DICT, seed=0, **model_kwargs):
+    """Create a seeded TrafficModel without its console output"""
+    random.seed(seed)
+    with contextlib.redirect_stdout(io.StringIO()):
+        model = TrafficModel(map_file, map_dict, **model_kwargs)
+    model.reset_randomizer(seed)
+    return model
+
+
+def run_steps(model, steps):
+    """Step the model and return the elapsed wall time in seconds"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        model.advance(steps)
+        return time.perf_counter() - start
+
+
+def populate(model, cars):
+    """Spawn cars on random free lane cells, each one routed on creation"""
+    lanes = [pos for pos in model.layers.positions((model.layers.road_mask != 0) & ~model.layers.signal_mask)
+             if not model.is_occupied(pos)]
+    for pos in model.random.sample(lanes, min(cars, len(lanes))):
+        model.spawn_car(pos)
+
+
+def time_routing(model, samples=50):
+    """Average seconds per route computation over a sample of the active cars"""
+    if model.vector_cars:
+        # Replans the sampled cars from where they are
+        cars = model.vector_cars.cars()[:samples]
+        start = time.perf_counter()
+        model.vector_cars.plan(cars)
+        return (time.perf_counter() - start) / len(cars) if len(cars) else 0
+
+    cars = list(model.active_cars.values())[:samples]
+    if not cars:
+        return 0
+    start = time.perf_counter()
+    for car in cars:
+        car.plan_route()
+    return (time.perf_counter() - start) / len(cars)
+
+
+def bench_steps(map_files, steps, seed, **model_kwargs):
+    """Report steps/sec for each map"""
+    print(f"{'map':<16}{'steps':>8}{'seconds':>10}{'steps/s':>10}{'cars':>8}{'scheduled':>11}")
+    for map_file in map_files:
+        model = build_model(map_file, seed=seed, **model_kwargs)
+        elapsed = run_steps(model, steps)
+        print(f"{os.path.basename(map_file):<16}{steps:>8}{elapsed:>10.3f}{steps / elapsed:>10.1f}"
+              f"{model.active_car_count():>8}{len(model.schedule):>11}")
+
+
+def bench_profile(map_files, steps, seed, cprofile_steps=0, cprofile_dir=None, **model_kwargs):
+    """Time per phase of a step and hot path counters for each map, against a run without the profiler"""
+    for map_file in map_files:
+        name = os.path.splitext(os.path.basename(map_file))[0]
+        model = build_model(map_file, seed=seed, **model_kwargs)
+        plain = run_steps(model, steps)
+        model.close()
+
+        cprofile_path = None
+        if cprofile_steps and cprofile_dir:
+            os.makedirs(cprofile_dir, exist_ok=True)
+            cprofile_path = os.path.join(cprofile_dir, f"{name}.prof")
+        model = build_model(map_file, seed=seed, **model_kwargs)
+        model.profiler = StepProfiler(model, cprofile_steps, cprofile_path)
+        run_steps(model, steps)
+        model.close()
+
+        report = model.profiler.report()
+        print(f"{name}: {plain / steps * 1000:.3f} ms/step without the profiler")
+        print(format_report(report))
+        if cprofile_steps:
+            print(model.profiler.cprofile_text())
+            if cprofile_path:
+                print(f"cProfile of the first {report['cprofile']['steps']} steps in {cprofile_path}")
+
+
+def bench_scale(sizes, car_counts, steps, seed, block, routing, engine="agents"):
+    """Report build time, memory, pathfinding and step time on generated maps"""
+    print(f"{'size':>11}{'cars':>8}{'build s':>9}{'MiB':>8}{'B/car':>8}{'spawn s':>9}{'route ms':>9}{'ms/step':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            rows = generate_grid_city(size, size, block=block, seed=seed)
+            map_file = os.path.join(tmp, f"city_{size}.txt")
+            write_map(rows, map_file)
+
+            for cars in car_counts:
+                tracemalloc.start()
+                start = time.perf_counter()
+                model = build_model(map_file, seed=seed, static_layers=True, routing=routing, engine=engine)
+                build = time.perf_counter() - start
+                built = tracemalloc.get_traced_memory()[0]
+
+                start = time.perf_counter()
+                populate(model, cars)
+                spawn = time.perf_counter() - start
+                current, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                memory = peak / 2 ** 20
+                # Everything a car adds: agent, route, grid and scheduler entries
+                per_car = (current - built) / max(1, model.active_car_count())
+
+                route = time_routing(model)
+                elapsed = run_steps(model, steps)
+                print(f"{len(rows[0]):>5}x{len(rows):<5}{model.active_car_count():>8}{build:>9.2f}"
+                      f"{memory:>8.1f}{per_car:>8.0f}{spawn:>9.2f}{route * 1000:>9.3f}{elapsed / steps * 1000:>9.1f}")
+
+
+def bench_alt(sizes, pairs, seed, block, landmark_count):
+    """Compare node expansions and wall time of Manhattan and ALT A* on generated maps"""
+    print(f"{'map':<14}{'size':>11}{'prep s':>8}{'heuristic':>11}{'expanded':>10}"
+          f"{'route ms':>10}{'table ms':>10}{'length':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            maps = {
+                "one-way grid": generate_grid_city(size, size, block=block, seed=seed, one_way=True),
+                "two-way grid": generate_grid_city(size, size, block=block, seed=seed),
+            }
+            base = read_map(DEFAULT_MAPS[-1])
+            maps["tiled base"] = tile_map(base, max(1, size // len(base[0])), max(1, size // len(base)))
+
+            for name, rows in maps.items():
+                map_file = os.path.join(tmp, f"{name.replace(' ', '_')}_{size}.txt")
+                write_map(rows, map_file)
+                model = build_model(map_file, seed=seed, static_layers=True)
+
+                start = time.perf_counter()
+                landmarks = model.compiled_map.get_landmarks(landmark_count)
+                prep = time.perf_counter() - start
+
+                # One probe car walks A* between random lane cells and destinations
+                lanes = model.layers.positions((model.layers.road_mask != 0) & ~model.layers.signal_mask)
+                rng = random.Random(seed)
+                trips = [(rng.choice(lanes), rng.choice(model.available_destinations))
+                         for _ in range(pairs)]
+                car = model.spawn_car(trips[0][0])
+                kernel = model.search_kernel
+
+                # The bound table of each goal is built on its first search, timed apart
+                goals = {destination for _, destination in trips}
+                start = time.perf_counter()
+                for destination in goals:
+                    landmarks.flat_bounds(destination)
+                table = (time.perf_counter() - start) / len(goals)
+
+                lengths = {}
+                for heuristic, model.landmarks in (("manhattan", None), ("alt", landmarks)):
+                    expanded = kernel.expanded
+                    elapsed = 0
+                    lengths[heuristic] = []
+                    for origin, destination in trips:
+                        model.grid.move_agent(car, origin)
+                        car.destination = destination
+                        start = time.perf_counter()
+                        path = car.find_path_astar()
+                        elapsed += time.perf_counter() - start
+                        lengths[heuristic].append(len(path) if path is not None else -1)
+                    print(f"{name:<14}{len(rows[0]):>5}x{len(rows):<5}{prep:>8.2f}{heuristic:>11}"
+                          f"{(kernel.expanded - expanded) / pairs:>10.0f}{elapsed / pairs * 1000:>10.2f}"
+                          f"{table * 1000 if model.landmarks else 0:>10.2f}"
+                          f"{sum(lengths[heuristic]) / pairs:>8.1f}")
+
+                if lengths["manhattan"] != lengths["alt"]:
+                    print(f"{name}: ALT and Manhattan routes differ in length")
+
+
+@contextlib.contextmanager
+def timed_plan_route(calls):
+    """Count and time every CarAgent.plan_route call into calls while active"""
+    plan_route = CarAgent.plan_route
+
+    def timed(car):
+        start = time.perf_counter()
+        path = plan_route(car)
+        calls["seconds"] += time.perf_counter() - start
+        calls["count"] += 1
+        return path
+
+    calls["count"] = calls["seconds"] = 0
+    CarAgent.plan_route = timed
+    try:
+        yield calls
+    finally:
+        CarAgent.plan_route = plan_route
+
+
+def bench_replan(size, car_counts, steps, seed, block):
+    """Replans/sec of full A* against D* Lite repairs on a congested grid city"""
+    print(f"{'routing':<9}{'cars':>7}{'replans':>9}{'replans/s':>11}{'ms/step':>9}{'finished':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        map_file = os.path.join(tmp, f"city_{size}.txt")
+        write_map(generate_grid_city(size, size, block=block, seed=seed), map_file)
+
+        for cars in car_counts:
+            for routing in ("astar", "dstar"):
+                model = build_model(map_file, seed=seed, static_layers=True, routing=routing)
+                populate(model, cars)
+                created = model.cars_created
+
+                # Only the route computations made while stepping count
+                with timed_plan_route({}) as calls:
+                    elapsed = run_steps(model, steps)
+
+                finished = model.cars_created - len(model.active_cars)
+                rate = calls["count"] / calls["seconds"] if calls["seconds"] else 0
+                print(f"{routing:<9}{created:>7}{calls['count']:>9}{rate:>11.0f}"
+                      f"{elapsed / steps * 1000:>9.1f}{finished:>10}")
+
+
+def bench_congestion(size, cars, steps, refreshes, weights, seed, block):
+    """Throughput of unit cost A* against congestion priced routes.
+
+    The city is topped up to the same number of cars every 10 steps, so
+    every run sees the same demand. Refresh 0 is plain A*, weight 0 only
+    blocks the cars near each car without pricing the rest.
+    """
+    print(f"{'refresh':>8}{'weight':>8}{'finished/1000':>15}{'replans/step':>14}{'ms/step':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        map_file = os.path.join(tmp, f"city_{size}.txt")
+        write_map(generate_grid_city(size, size, block=block, seed=seed), map_file)
+
+        runs = [(0, 0)] + [(refresh, weight) for refresh in refreshes if refresh for weight in weights]
+        for refresh, weight in runs:
+            model = build_model(map_file, seed=seed, static_layers=True, congestion_refresh=refresh)
+            if model.congestion:
+                model.congestion.weight = weight
+            populate(model, cars)
+            elapsed = 0
+
+            with timed_plan_route({}) as calls:
+                for done in range(0, steps, 10):
+                    elapsed += run_steps(model, min(10, steps - done))
+                    # Cars routed on creation are not replans
+                    count = calls["count"]
+                    populate(model, max(0, cars - len(model.active_cars)))
+                    calls["count"] = count
+
+            finished = model.cars_created - len(model.active_cars)
+            print(f"{refresh:>8}{weight:>8.1f}{finished / steps * 1000:>15.1f}"
+                  f"{calls['count'] / steps:>14.2f}{elapsed / steps * 1000:>9.1f}")
+
+
+def bench_batch(size, car_counts, worker_counts, seed, block):
+    """Time routing a burst of new cars one by one against batches on a process pool"""
+    print(f"{'cars':>7}{'workers':>9}{'cold s':>9}{'warm s':>9}{'routes/s':>10}{'routed':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        map_file = os.path.join(tmp, f"city_{size}.txt")
+        write_map(generate_grid_city(size, size, block=block, seed=seed), map_file)
+
+        for cars in car_counts:
+            for workers in worker_counts:
+                model = build_model(map_file, seed=seed, static_layers=True, route_workers=workers,
+                                    map_cache_dir=os.path.join(tmp, "cache"))
+                start = time.perf_counter()
+                populate(model, cars)
+                model.solve_pending_routes()
+                cold = time.perf_counter() - start
+
+                # The same burst again, without the spawn and the pool start-up
+                start = time.perf_counter()
+                if workers:
+                    model.pending_routes = list(model.active_cars.values())
+                    model.solve_pending_routes()
+                else:
+                    for car in model.active_cars.values():
+                        car.set_path(car.plan_route())
+                warm = time.perf_counter() - start
+                model.close()
+
+                routed = sum(1 for car in model.active_cars.values() if car.has_path())
+                print(f"{len(model.active_cars):>7}{workers:>9}{cold:>9.2f}{warm:>9.2f}"
+                      f"{len(model.active_cars) / warm:>10.0f}{routed:>8}")
+
+
+def dict_heuristic(model, pos, goal):
+    """Manhattan distance, tightened by the landmark bound when the model has landmarks"""
+    distance = abs(pos[0] - goal[0]) + abs(pos[1] - goal[1])
+    if model.landmarks is not None:
+        return max(distance, model.landmarks.lower_bound(pos, goal))
+    return distance
+
+
+def dict_neighbors(car, pos):
+    """Cells the car can move to from pos right now, its destination from any adjacent cell"""
+    neighbors = [next_pos for next_pos in car.model.road_graph.successors(pos) if car.is_valid_move(pos, next_pos)]
+    goal = car.destination
+    if goal not in neighbors and abs(goal[0] - pos[0]) + abs(goal[1] - pos[1]) == 1:
+        neighbors.append(goal)
+    return neighbors
+
+
+def dict_astar(car):
+    """The A* CarAgent used before the search kernel, dicts keyed by position tuples"""
+    start = car.pos
+    goal = car.destination
+    open_set = [(dict_heuristic(car.model, start, goal), start)]
+    came_from = {}
+    g_score = {start: 0}
+    f_score = {start: dict_heuristic(car.model, start, goal)}
+    closed_set = set()
+
+    while open_set:
+        current = heapq.heappop(open_set)[1]
+        if current == goal:
+            path = []
+            while current in came_from:
+                path.append(current)
+                current = came_from[current]
+            path.append(start)
+            path.reverse()
+            return path[1:] if len(path) > 1 else []
+
+        closed_set.add(current)
+        for neighbor in dict_neighbors(car, current):
+            if neighbor in closed_set:
+                continue
+            tentative_g_score = g_score[current] + 1
+            if neighbor not in g_score or tentative_g_score < g_score[neighbor]:
+                came_from[neighbor] = current
+                g_score[neighbor] = tentative_g_score
+                f = tentative_g_score + dict_heuristic(car.model, neighbor, goal)
+                f_score[neighbor] = f
+                heapq.heappush(open_set, (f, neighbor))
+
+    return None
+
+
+def bench_kernel(sizes, routes, cars, seed, block):
+    """Microbenchmark of the search kernel against the dict based A*"""
+    print(f"{'size':>11}{'routes':>8}{'dict ms':>9}{'kernel ms':>11}{'speedup':>9}{'same':>6}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            map_file = os.path.join(tmp, f"city_{size}.txt")
+            rows = generate_grid_city(size, size, block=block, seed=seed)
+            write_map(rows, map_file)
+            model = build_model(map_file, seed=seed, static_layers=True)
+            populate(model, cars)
+
+            # Random origins for a probe car, on free lane cells
+            lanes = model.layers.positions((model.layers.road_mask != 0) & ~model.layers.signal_mask)
+            occupied = model.blocked_cells()
+            rng = random.Random(seed)
+            trips = [(origin, rng.choice(model.available_destinations))
+                     for origin in rng.sample([pos for pos in lanes if pos not in occupied], routes)]
+            car = model.spawn_car(trips[0][0])
+
+            timings = {}
+            paths = {}
+            for name in ("dict", "kernel"):
+                paths[name] = []
+                elapsed = 0
+                for origin, destination in trips:
+                    model.grid.move_agent(car, origin)
+                    car.destination = destination
+                    start = time.perf_counter()
+                    path = dict_astar(car) if name == "dict" else car.find_path_astar()
+                    elapsed += time.perf_counter() - start
+                    if name == "kernel" and path is not None:
+                        path = model.search_kernel.positions(path)
+                    paths[name].append(path)
+                timings[name] = elapsed / routes * 1000
+
+            print(f"{len(rows[0]):>5}x{len(rows):<5}{routes:>8}{timings['dict']:>9.2f}"
+                  f"{timings['kernel']:>11.2f}{timings['dict'] / timings['kernel']:>8.1f}x"
+                  f"{str(paths['dict'] == paths['kernel']):>6}")
+
+
+def bench_checkpoint(size, car_counts, steps, seed, block, engine):
+    """Snapshot size and save, load and fork times against building the same state from scratch"""
+    print(f"{'cars':>7}{'KiB':>9}{'B/car':>7}{'build s':>9}{'save ms':>9}{'load ms':>9}{'fork ms':>9}{'same':>6}")
+    with tempfile.TemporaryDirectory() as tmp:
+        map_file = os.path.join(tmp, f"city_{size}.txt")
+        write_map(generate_grid_city(size, size, block=block, seed=seed), map_file)
+        cache_dir = os.path.join(tmp, "mapcache")
+
+        for cars in car_counts:
+            start = time.perf_counter()
+            model = build_model(map_file, seed=seed, static_layers=True, engine=engine, map_cache_dir=cache_dir)
+            populate(model, cars)
+            run_steps(model, steps)
+            build = time.perf_counter() - start
+
+            start = time.perf_counter()
+            data = save_checkpoint(model)
+            save = time.perf_counter() - start
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                loaded = load_checkpoint(data, map_cache_dir=cache_dir)
+                load = time.perf_counter() - start
+                start = time.perf_counter()
+                forked = fork(model)
+                fork_time = time.perf_counter() - start
+
+            # The copies must go on exactly like the original
+            for copy in (model, loaded, forked):
+                run_steps(copy, steps)
+            same = all((copy.occupancy == model.occupancy).all() and copy.random.getstate() == model.random.getstate()
+                       for copy in (loaded, forked))
+            print(f"{cars:>7}{len(data) / 1024:>9.1f}{len(data) / max(1, cars):>7.0f}{build:>9.2f}"
+                  f"{save * 1000:>9.1f}{load * 1000:>9.1f}{fork_time * 1000:>9.1f}{str(same):>6}")
+            for copy in (model, loaded, forked):
+                copy.close()
+
+
+def bench_tiles(size, cars, steps, tile_counts, seed, block, routing):
+    """Step time of the vector engine split in tiles across worker processes, against one process"""
+    print(f"{'tiles':>6}{'ms/step':>9}{'speedup':>9}{'moves':>9}{'same':>6}")
+    with tempfile.TemporaryDirectory() as tmp:
+        map_file = os.path.join(tmp, f"city_{size}.txt")
+        write_map(generate_grid_city(size, size, block=block, seed=seed), map_file)
+        # The workers memory-map the compiled map from the cache
+        cache_dir = os.path.join(tmp, "mapcache")
+
+        reference = None
+        for tiles in [0] + tile_counts:
+            model = build_model(map_file, seed=seed, static_layers=True, routing=routing, engine="vector",
+                                map_cache_dir=cache_dir, tiles=tiles)
+            populate(model, cars)
+            elapsed = run_steps(model, steps)
+            model.close()
+
+            cars_state = model.vector_cars
+            state = (model.occupancy.tobytes(), cars_state.pos.tobytes(), cars_state.waiting.tobytes(),
+                     model.random.getstate(), model.stats.state())
+            if reference is None:
+                reference = (elapsed, state)
+            print(f"{tiles or '-':>6}{elapsed / steps * 1000:>9.1f}{reference[0] / elapsed:>8.2f}x"
+                  f"{model.cars_moved:>9}{str(state == reference[1]):>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TrafficModel benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    steps = subparsers.add_parser("steps", help="steps/sec on the base maps")
+    steps.add_argument("--maps", nargs="+", default=DEFAULT_MAPS)
+    steps.add_argument("--steps", type=int, default=500)
+    steps.add_argument("--static-layers", action="store_true",
+                       help="run the models with static layers instead of static agents")
+    steps.add_argument("--event-driven", action="store_true",
+                       help="jump over the steps in which every car waits")
+
+    scale = subparsers.add_parser("scale", help="scaling on generated grid cities")
+    scale.add_argument("--sizes", type=int, nargs="+", default=[100, 250, 500])
+    scale.add_argument("--cars", type=int, nargs="+", default=[1000])
+    scale.add_argument("--steps", type=int, default=20)
+    scale.add_argument("--block", type=int, default=6)
+
+    alt = subparsers.add_parser("alt", help="ALT landmarks against Manhattan A* on generated maps")
+    alt.add_argument("--sizes", type=int, nargs="+", default=[250, 500])
+    alt.add_argument("--pairs", type=int, default=100, help="random origin/destination pairs")
+    alt.add_argument("--block", type=int, default=6)
+    alt.add_argument("--landmarks", type=int, default=8)
+    alt.add_argument("--seed", type=int, default=0)
+
+    replan = subparsers.add_parser("replan", help="replans/sec under congestion, A* against D* Lite")
+    replan.add_argument("--size", type=int, default=100)
+    replan.add_argument("--cars", type=int, nargs="+", default=[1000, 2000])
+    replan.add_argument("--steps", type=int, default=50)
+    replan.add_argument("--block", type=int, default=6)
+    replan.add_argument("--seed", type=int, default=0)
+
+    batch = subparsers.add_parser("batch", help="routing bursts of new cars on a process pool")
+    batch.add_argument("--size", type=int, default=250)
+    batch.add_argument("--cars", type=int, nargs="+", default=[1000, 4000])
+    batch.add_argument("--workers", type=int, nargs="+", default=[0, 1, 2, 4],
+                       help="route worker processes, 0 routes each car on spawn")
+    batch.add_argument("--block", type=int, default=6)
+    batch.add_argument("--seed", type=int, default=0)
+
+    kernel = subparsers.add_parser("kernel", help="search kernel against the dict based A*")
+    kernel.add_argument("--sizes", type=int, nargs="+", default=[100, 250, 500])
+    kernel.add_argument("--routes", type=int, default=200)
+    kernel.add_argument("--cars", type=int, default=200, help="cars on the map that block cells")
+    kernel.add_argument("--block", type=int, default=6)
+    kernel.add_argument("--seed", type=int, default=0)
+
+    congestion = subparsers.add_parser("congestion", help="cars finished and replans with congestion costs")
+    congestion.add_argument("--size", type=int, default=60)
+    congestion.add_argument("--cars", type=int, default=300)
+    congestion.add_argument("--steps", type=int, default=1000)
+    congestion.add_argument("--refresh", type=int, nargs="+", default=[1, 5, 20],
+                            help="steps between congestion cost refreshes, plain A* always runs first")
+    congestion.add_argument("--weights", type=float, nargs="+", default=[0, 2],
+                            help="extra moves a cell costs per car sampled there")
+    congestion.add_argument("--block", type=int, default=6)
+    congestion.add_argument("--seed", type=int, default=0)
+
+    snapshot = subparsers.add_parser("checkpoint", help="checkpoint size and save, load and fork times")
+    snapshot.add_argument("--size", type=int, default=250)
+    snapshot.add_argument("--cars", type=int, nargs="+", default=[1000, 10000])
+    snapshot.add_argument("--steps", type=int, default=10, help="steps run before the snapshot and after it")
+    snapshot.add_argument("--block", type=int, default=6)
+    snapshot.add_argument("--seed", type=int, default=0)
+    snapshot.add_argument("--engine", default="agents", choices=["agents", "vector"])
+
+    tiles = subparsers.add_parser("tiles", help="vector engine split in tiles across worker processes")
+    tiles.add_argument("--size", type=int, default=500)
+    tiles.add_argument("--cars", type=int, default=20000)
+    tiles.add_argument("--steps", type=int, default=20)
+    tiles.add_argument("--tiles", type=int, nargs="+", default=[1, 2, 4, 8], help="worker processes, one tile each")
+    tiles.add_argument("--block", type=int, default=6)
+    tiles.add_argument("--seed", type=int, default=0)
+    tiles.add_argument("--routing", default="astar", choices=["astar", "alt"])
+
+    profile = subparsers.add_parser("profile", help="time per step phase and hot path counters")
+    profile.add_argument("--maps", nargs="+", default=DEFAULT_MAPS)
+    profile.add_argument("--steps", type=int, default=500)
+    profile.add_argument("--event-driven", action="store_true")
+    profile.add_argument("--cprofile", type=int, default=0, metavar="STEPS",
+                         help="also run the first STEPS steps under cProfile")
+    profile.add_argument("--cprofile-dir", default=".profiles", help="where the .prof dumps go, one per map")
+
+    for subparser in (steps, scale, profile):
+        subparser.add_argument("--seed", type=int, default=0)
+        subparser.add_argument("--routing", default="astar", choices=["astar", "alt", "fields", "dstar"])
+        subparser.add_argument("--engine", default="agents", choices=["agents", "vector"],
+                               help="step CarAgents one by one or every car at once as arrays")
+
+    args = parser.parse_args()
+
+    if args.benchmark == "steps":
+        model_kwargs = {"routing": args.routing, "engine": args.engine}
+        if args.static_layers:
+            model_kwargs["static_layers"] = True
+        if args.event_driven:
+            model_kwargs["event_driven"] = True
+        bench_steps(args.maps, args.steps, args.seed, **model_kwargs)
+    elif args.benchmark == "profile":
+        bench_profile(args.maps, args.steps, args.seed, args.cprofile, args.cprofile_dir, routing=args.routing,
+                      engine=args.engine, static_layers=True, event_driven=args.event_driven)
+    elif args.benchmark == "scale":
+        bench_scale(args.sizes, args.cars, args.steps, args.seed, args.block, args.routing, args.engine)
+    elif args.benchmark == "alt":
+        bench_alt(args.sizes, args.pairs, args.seed, args.block, args.landmarks)
+    elif args.benchmark == "replan":
+        bench_replan(args.size, args.cars, args.steps, args.seed, args.block)
+    elif args.benchmark == "batch":
+        bench_batch(args.size, args.cars, args.workers, args.seed, args.block)
+    elif args.benchmark == "checkpoint":
+        bench_checkpoint(args.size, args.cars, args.steps, args.seed, args.block, args.engine)
+    elif args.benchmark == "tiles":
+        bench_tiles(args.size, args.cars, args.steps, args.tiles, args.seed, args.block, args.routing)
+    elif args.benchmark == "kernel":
+        bench_kernel(args.sizes, args.routes, args.cars, args.seed, args.block)
+    else:
+        bench_congestion(args.size, args.cars, args.steps, args.refresh, args.weights, args.seed,
+                         args.block)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+# compiledmap.py
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from roadgraph import RoadGraph
+from searchkernel import SearchKernel
+from routing import DistanceFields, Landmarks
+from staticlayers import StaticLayers
+
+# Bump when the compiled artifact or the rules that build it change
+CACHE_VERSION = "agents2d-1"
+
+
+class CompiledMap:
+    """Everything derived from a map file that stays fixed during a simulation.
+
+    Holds the static layers, the compiled road graph, the spawn,
+    destination and signal positions and, once requested, the routing
+    distance fields. It can be saved to a cache directory as plain .npy
+    files and loaded back memory-mapped.
+    """
+    ARRAYS = ("road_mask", "signal_mask", "building_mask", "destination_mask", "moves",
+              "spawn_points", "destinations", "signals")
+
+    def __init__(self, layers, road_graph, spawn_points, destinations, signals):
+        self.layers = layers
+        self.road_graph = road_graph
+        self.spawn_points = spawn_points
+        self.destinations = destinations
+        self.signals = signals
+        self.distance_fields = None
+        self.landmarks = None
+        self.search_kernel = None
+        # Cache entry this map was saved to or loaded from
+        self.cache_path = None
+
+    @classmethod
+    def compile(cls, map_data):
+        """Compile map rows already indexed as map_data[y][x]"""
+        layers = StaticLayers.from_map_data(map_data)
+        road_graph = RoadGraph(layers.road_mask, layers.signal_mask)
+
+        # Spawn points are the road cells with a single direction on the edges
+        lanes = (layers.road_mask != 0) & ~layers.signal_mask
+        spawn_points = layers.positions(lanes & layers.edge_mask())
+
+        return cls(layers, road_graph, spawn_points,
+                   layers.positions(layers.destination_mask),
+                   layers.positions(layers.signal_mask))
+
+    def save(self, path):
+        """Write the compiled map as a directory of .npy files"""
+        arrays = {
+            "road_mask": self.layers.road_mask,
+            "signal_mask": self.layers.signal_mask,
+            "building_mask": self.layers.building_mask,
+            "destination_mask": self.layers.destination_mask,
+            "moves": self.road_graph.moves,
+            "spawn_points": positions_array(self.spawn_points),
+            "destinations": positions_array(self.destinations),
+            "signals": positions_array(self.signals)
+        }
+        for name, array in arrays.items():
+            np.save(os.path.join(path, f"{name}.npy"), array)
+
+        with open(os.path.join(path, "meta.json"), 'w') as f:
+            json.dump({"version": CACHE_VERSION,
+                       "road_cell_count": self.layers.road_cell_count}, f)
+
+    @classmethod
+    def load(cls, path):
+        """Load a compiled map saved with save(), memory-mapping the grids"""
+        with open(os.path.join(path, "meta.json"), 'r') as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r')
+                  for name in cls.ARRAYS}
+
+        layers = StaticLayers(arrays["road_mask"], arrays["signal_mask"],
+                              arrays["building_mask"], arrays["destination_mask"],
+                              road_cell_count=meta["road_cell_count"])
+        road_graph = RoadGraph(layers.road_mask, layers.signal_mask, moves=arrays["moves"])
+
+        compiled = cls(layers, road_graph,
+                       positions_list(arrays["spawn_points"]),
+                       positions_list(arrays["destinations"]),
+                       positions_list(arrays["signals"]))
+        compiled.cache_path = path
+
+        fields_path = os.path.join(path, "distance_fields.npy")
+        if os.path.exists(fields_path):
+            compiled.distance_fields = DistanceFields(compiled.destinations,
+                                                      np.load(fields_path, mmap_mode='r'))
+
+        landmarks_path = os.path.join(path, "landmarks.npy")
+        if os.path.exists(landmarks_path):
+            compiled.landmarks = Landmarks(
+                positions_list(np.load(landmarks_path)),
+                np.load(os.path.join(path, "landmarks_forward.npy"), mmap_mode='r'),
+                np.load(os.path.join(path, "landmarks_backward.npy"), mmap_mode='r'),
+                road_graph)
+        return compiled
+
+    def get_distance_fields(self):
+        """Distance fields for every destination, computed once and stored with the cache entry"""
+        if self.distance_fields is None:
+            self.distance_fields = DistanceFields.compute(self.road_graph, self.destinations)
+
+            if self.cache_path:
+                tmp_path = os.path.join(self.cache_path, f"distance_fields.{os.getpid()}.npy")
+                np.save(tmp_path, self.distance_fields.fields)
+                os.replace(tmp_path, os.path.join(self.cache_path, "distance_fields.npy"))
+
+        return self.distance_fields
+
+    def get_landmarks(self, count=8):
+        """ALT landmark tables, computed once and stored with the cache entry"""
+        if self.landmarks is None:
+            self.landmarks = Landmarks.select(self.road_graph, count)
+
+            if self.cache_path:
+                # The positions go last, they are what load() looks for
+                for name, array in (("landmarks_forward", self.landmarks.forward),
+                                    ("landmarks_backward", self.landmarks.backward),
+                                    ("landmarks", positions_array(self.landmarks.landmarks))):
+                    tmp_path = os.path.join(self.cache_path, f"{name}.{os.getpid()}.npy")
+                    np.save(tmp_path, array)
+                    os.replace(tmp_path, os.path.join(self.cache_path, f"{name}.npy"))
+
+        return self.landmarks
+
+    def get_search_kernel(self):
+        """A* kernel of the road graph, built once and shared by every model on this map"""
+        if self.search_kernel is None:
+            self.search_kernel = SearchKernel(self.road_graph)
+        return self.search_kernel
+
+
+def positions_array(positions):
+    return np.array(positions, dtype=np.int32).reshape(-1, 2)
+
+
+def positions_list(array):
+    return [tuple(pos) for pos in array.tolist()]
+
+
+def map_cache_key(map_file_path, map_dict_path):
+    """Content hash of the map file and its dictionary"""
+    digest = hashlib.sha256(CACHE_VERSION.encode())
+    for path in (map_file_path, map_dict_path):
+        with open(path, 'rb') as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+
+def load_or_compile(cache_dir, map_file_path, map_dict_path, map_data):
+    """Load the compiled map from cache_dir, compiling and saving it on a miss"""
+    path = os.path.join(cache_dir, map_cache_key(map_file_path, map_dict_path))
+    if os.path.isdir(path):
+        return CompiledMap.load(path)
+
+    compiled = CompiledMap.compile(map_data)
+
+    # Write into a temporary directory first so readers never see a partial entry
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(dir=cache_dir)
+    try:
+        compiled.save(tmp_path)
+        os.rename(tmp_path, path)
+        compiled.cache_path = path
+    except OSError:
+        # Another process stored the same map first
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+    return compiled
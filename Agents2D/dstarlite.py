@@ -0,0 +1,174 @@
+# dstarlite.py
+import heapq
+
+INFINITY = float('inf')
+
+
+class DStarLite:
+    """Incremental shortest path to a fixed goal (Koenig and Likhachev's D* Lite).
+
+    The search runs backwards from the goal, so g[s] is the number of moves
+    from s to the goal. Moving the start and blocking or freeing cells only
+    repairs the part of the search those changes reach, instead of starting
+    over like A*. Cars enter the goal from any adjacent road cell.
+    """
+    def __init__(self, road_graph, start, goal, blocked=()):
+        self.road_graph = road_graph
+        self.start = start
+        self.goal = goal
+        self.blocked = set(blocked)
+        self.blocked.discard(goal)
+
+        self.g = {}
+        self.rhs = {goal: 0}
+        self.km = 0
+        self.last_start = start
+
+        # Priority queue with lazy deletion, open_keys holds the live key of each cell
+        self.open_set = []
+        self.open_keys = {}
+        self.push(goal, (self.heuristic(start, goal), 0))
+
+        # Cells popped by compute_shortest_path, for benchmarks
+        self.expanded = 0
+
+    def heuristic(self, a, b):
+        return abs(a[0] - b[0]) + abs(a[1] - b[1])
+
+    def push(self, pos, key):
+        self.open_keys[pos] = key
+        heapq.heappush(self.open_set, (key, pos))
+
+    def top(self):
+        """Drop stale entries and return the smallest live (key, pos)"""
+        while self.open_set:
+            key, pos = self.open_set[0]
+            if self.open_keys.get(pos) == key:
+                return key, pos
+            heapq.heappop(self.open_set)
+        return None
+
+    def calculate_key(self, pos):
+        best = min(self.g.get(pos, INFINITY), self.rhs.get(pos, INFINITY))
+        return (best + self.heuristic(self.start, pos) + self.km, best)
+
+    def successors(self, pos):
+        cells = self.road_graph.successors(pos)
+        if self.heuristic(pos, self.goal) == 1 and self.goal not in cells:
+            cells.append(self.goal)
+        return cells
+
+    def predecessors(self, pos):
+        if pos != self.goal:
+            return self.road_graph.predecessors(pos)
+        # The goal is not a road, it is entered from every adjacent road cell
+        x, y = pos
+        return [cell for cell in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1))
+                if self.road_graph.in_bounds(cell) and self.road_graph.is_road(cell)]
+
+    def cost(self, pos, next_pos):
+        return INFINITY if next_pos in self.blocked else 1
+
+    def update_vertex(self, pos):
+        if pos != self.goal:
+            self.rhs[pos] = min((self.cost(pos, nxt) + self.g.get(nxt, INFINITY)
+                                 for nxt in self.successors(pos)), default=INFINITY)
+        self.open_keys.pop(pos, None)
+        if self.g.get(pos, INFINITY) != self.rhs.get(pos, INFINITY):
+            self.push(pos, self.calculate_key(pos))
+
+    def compute_shortest_path(self):
+        while True:
+            entry = self.top()
+            if entry is None:
+                return
+            start_g = self.g.get(self.start, INFINITY)
+            if entry[0] >= self.calculate_key(self.start) and self.rhs.get(self.start, INFINITY) == start_g:
+                return
+
+            old_key, pos = entry
+            heapq.heappop(self.open_set)
+            del self.open_keys[pos]
+            self.expanded += 1
+
+            new_key = self.calculate_key(pos)
+            if old_key < new_key:
+                self.push(pos, new_key)
+            elif self.g.get(pos, INFINITY) > self.rhs.get(pos, INFINITY):
+                self.g[pos] = self.rhs[pos]
+                for prev in self.predecessors(pos):
+                    self.update_vertex(prev)
+            else:
+                self.g[pos] = INFINITY
+                self.update_vertex(pos)
+                for prev in self.predecessors(pos):
+                    self.update_vertex(prev)
+
+    def move_start(self, start):
+        """Account for the car having moved since the last plan"""
+        if start != self.start:
+            self.start = start
+            self.km += self.heuristic(self.last_start, start)
+            self.last_start = start
+
+    def update_cells(self, blocked, freed):
+        """Repair the search for cells that became blocked or free"""
+        changed = []
+        for pos in blocked:
+            if pos != self.goal and pos not in self.blocked:
+                self.blocked.add(pos)
+                changed.append(pos)
+        for pos in freed:
+            if pos in self.blocked:
+                self.blocked.remove(pos)
+                changed.append(pos)
+
+        # Only the moves into a changed cell change cost
+        for pos in changed:
+            for prev in self.predecessors(pos):
+                self.update_vertex(prev)
+
+    def boxed_in(self, horizon):
+        """True when no unblocked path leaves the cells within horizon of start"""
+        x, y = self.start
+        seen = {self.start}
+        frontier = [self.start]
+        while frontier:
+            pos = frontier.pop()
+            for nxt in self.successors(pos):
+                if nxt == self.goal or max(abs(nxt[0] - x), abs(nxt[1] - y)) > horizon:
+                    return False
+                if nxt not in seen and nxt not in self.blocked:
+                    seen.add(nxt)
+                    frontier.append(nxt)
+        return True
+
+    def plan(self, horizon=1):
+        """Current shortest path from start as a list of cells, or None.
+
+        Proving a boxed in start unreachable would expand everything the
+        goal reaches, so that is checked first within horizon cells and the
+        search is left for a later plan.
+        """
+        if self.boxed_in(horizon):
+            return None
+
+        self.compute_shortest_path()
+        if self.g.get(self.start, INFINITY) == INFINITY:
+            return None
+
+        path = []
+        pos = self.start
+        while pos != self.goal:
+            best = None
+            best_cost = INFINITY
+            for nxt in self.successors(pos):
+                cost = self.cost(pos, nxt) + self.g.get(nxt, INFINITY)
+                if cost < best_cost:
+                    best, best_cost = nxt, cost
+            # Stop on dead ends or cycles through cells the search left inconsistent
+            if best is None or len(path) > len(self.g):
+                return path or None
+            path.append(best)
+            pos = best
+        return path
@@ -0,0 +1,245 @@
+# ensemble.py
+# Headless batch of simulations over every combination of maps, parameters and seeds.
+#   python ensemble.py public/*_base.txt --seeds 0-9 --steps 2000 --workers 4 -o runs.jsonl
+#   python ensemble.py public/2024_base.txt --seeds 0-99 --param spawn_frequency=5,10,20 --param engine=vector
+#   python ensemble.py public/2021_base.txt --seeds 0-4 --profile -o profiled.jsonl
+import argparse
+import hashlib
+import inspect
+import itertools
+import json
+import os
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from benchmark import DEFAULT_DICT, build_model, run_steps
+from model import TrafficModel
+from profiler import StepProfiler
+from signaltuning import file_digest
+from tripstats import STATS_VERSION
+
+DEFAULT_OUTPUT = "ensemble.jsonl"
+# Parameters that go to TrafficModel(), the rest are model attributes set once it is built
+MODEL_ARGUMENTS = set(inspect.signature(TrafficModel.__init__).parameters) - {"self", "map_file_path",
+                                                                                "map_dict_path"}
+
+
+def parse_value(text):
+    """JSON value of text, or the text itself for words like vector or astar"""
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def parse_param(text):
+    """(name, values) of a name=value[,value...] option"""
+    name, _, values = text.partition("=")
+    if not name or not values:
+        raise argparse.ArgumentTypeError(f"expected name=value[,value...], got '{text}'")
+    return name, [parse_value(value) for value in values.split(",")]
+
+
+def parse_seeds(values):
+    """Seeds from numbers and inclusive ranges such as 0-99"""
+    seeds = []
+    for value in values:
+        first, _, last = value.partition("-")
+        seeds.extend(range(int(first), int(last or first) + 1))
+    return seeds
+
+
+def run_key(map_digest, params, seed, steps):
+    """Hash of everything that decides the result of one run"""
+    blob = json.dumps({"map": map_digest, "params": params, "seed": seed, "steps": steps, "stats": STATS_VERSION},
+                      sort_keys=True)
+    return hashlib.sha1(blob.encode()).hexdigest()[:16]
+
+
+def simulate(map_file, map_dict, params, seed, steps, map_cache_dir=None, profile=False):
+    """Run one seeded simulation and return its metrics, with the time of each step phase if profile"""
+    model = build_model(map_file, map_dict, seed=seed, map_cache_dir=map_cache_dir,
+                        **{name: value for name, value in params.items() if name in MODEL_ARGUMENTS})
+    try:
+        for name, value in params.items():
+            if name not in MODEL_ARGUMENTS:
+                setattr(model, name, value)
+        # The profiler reports how much the counters grow from here, a kernel can come with searches done
+        profiler = model.profiler = StepProfiler(model) if profile else None
+        kernel = model.search_kernel
+        searches, expanded = kernel.searches, kernel.expanded
+        elapsed = run_steps(model, steps)
+    finally:
+        model.close()
+    active = model.active_car_count()
+    stats = model.stats
+    record = {"created": model.cars_created, "finished": model.cars_created - active, "active": active,
+              "moved": model.cars_moved, "mean_wait": round(stats.wait.mean, 4),
+              "p90_wait": stats.wait.quantile(0.9), "mean_trip": round(stats.trip_time.mean, 4),
+              "p90_trip": stats.trip_time.quantile(0.9), "mean_stops": round(stats.stops.mean, 4),
+              "searches": kernel.searches - searches, "expanded": kernel.expanded - expanded,
+              "replans": model.replans, "failed_moves": model.failed_moves, "seconds": round(elapsed, 3)}
+    if profiler:
+        report = profiler.report()
+        record["profile"] = {"ms_per_step": report["ms_per_step"], "phases": report["phases"]}
+    return record
+
+
+def read_results(path):
+    """Records of a results file; a line cut short by a crash is skipped"""
+    records = []
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    return records
+
+
+class Ensemble:
+    """Every (map, parameters, seed) run of a grid, with the results in a JSON Lines file.
+
+    Each run is a task for the process pool. Its metrics are appended to
+    the file as one compact line as soon as it finishes, so an interrupted
+    ensemble only loses the runs in flight. Started again on the same file
+    it skips the runs already there, by the hash of the map contents, the
+    parameters, the seed and the steps, and retries the ones that failed.
+    With profile every run it does also records the time of each phase of
+    its steps; profiling leaves the results alone, so it is not in the hash.
+    """
+    def __init__(self, map_files, seeds, steps, params=None, map_dict=DEFAULT_DICT, output=DEFAULT_OUTPUT,
+                 map_cache_dir=None, profile=False):
+        self.map_files = list(map_files)
+        self.seeds = list(seeds)
+        self.steps = steps
+        self.map_dict = map_dict
+        self.output = output
+        self.map_cache_dir = map_cache_dir
+        self.profile = profile
+        # Every parameter is a list of values to try, the combinations make the grid
+        self.params = {"static_layers": [True], **(params or {})}
+
+        model = build_model(self.map_files[0], map_dict, map_cache_dir=map_cache_dir)
+        model.close()
+        unknown = [name for name in self.params if name not in MODEL_ARGUMENTS and not hasattr(model, name)]
+        if unknown:
+            raise ValueError(f"TrafficModel has no argument or attribute {', '.join(unknown)}")
+
+    def runs(self):
+        """Every run of the grid, in map, parameters, seed order"""
+        dict_digest = file_digest(self.map_dict)
+        names = list(self.params)
+        runs = []
+        for map_file in self.map_files:
+            map_digest = [file_digest(map_file), dict_digest]
+            for values in itertools.product(*(self.params[name] for name in names)):
+                params = dict(zip(names, values))
+                for seed in self.seeds:
+                    runs.append({"key": run_key(map_digest, params, seed, self.steps), "map": map_file,
+                                 "params": params, "seed": seed, "steps": self.steps})
+        return runs
+
+    def run(self, workers=0, verbose=True):
+        """Run what the results file is missing and return the records of the whole grid"""
+        runs = self.runs()
+        done = {record["key"] for record in read_results(self.output) if "error" not in record}
+        pending = [run for run in runs if run["key"] not in done]
+        if verbose:
+            print(f"{len(runs)} runs, {len(runs) - len(pending)} already in {self.output}, {len(pending)} to go")
+
+        started = time.perf_counter()
+        executor = ProcessPoolExecutor(max_workers=workers) if workers else None
+        try:
+            with open(self.output, "a") as results:
+                for count, (run, outcome) in enumerate(self.outcomes(pending, executor), 1):
+                    record = {**run, **outcome}
+                    results.write(json.dumps(record, separators=(",", ":")) + "\n")
+                    results.flush()
+                    if verbose:
+                        report_run(count, len(pending), record, time.perf_counter() - started)
+        finally:
+            if executor:
+                # An interrupted ensemble drops the runs that did not start
+                executor.shutdown(cancel_futures=True)
+
+        keys = {run["key"] for run in runs}
+        latest = {record["key"]: record for record in read_results(self.output) if record["key"] in keys}
+        return list(latest.values())
+
+    def outcomes(self, runs, executor=None):
+        """(run, metrics) as every run finishes, with an "error" instead when it raised"""
+        jobs = [(run["map"], self.map_dict, run["params"], run["seed"], run["steps"], self.map_cache_dir,
+                 self.profile) for run in runs]
+        if executor:
+            futures = {executor.submit(simulate, *job): run for run, job in zip(runs, jobs)}
+            for future in as_completed(futures):
+                try:
+                    yield futures[future], future.result()
+                except Exception as e:
+                    yield futures[future], {"error": f"{type(e).__name__}: {e}"}
+        else:
+            for run, job in zip(runs, jobs):
+                try:
+                    yield run, simulate(*job)
+                except Exception as e:
+                    yield run, {"error": f"{type(e).__name__}: {e}"}
+
+
+def report_run(count, total, record, elapsed):
+    remaining = elapsed / count * (total - count)
+    params = " ".join(f"{name}={value}" for name, value in record["params"].items() if name != "static_layers")
+    if "error" in record:
+        outcome = record["error"]
+    else:
+        outcome = (f"finished {record['finished']} wait {record['mean_wait']:.2f} trip {record['mean_trip']:.1f}"
+                   f" {record['seconds']:.1f}s")
+    print(f"[{count}/{total}] {os.path.basename(record['map'])} seed {record['seed']} {params} {outcome}"
+          f" | eta {time.strftime('%H:%M:%S', time.gmtime(remaining))}", flush=True)
+
+
+def summarize(records):
+    """Mean and spread over the seeds of each map and parameters"""
+    groups = {}
+    for record in records:
+        if "error" not in record:
+            key = (record["map"], json.dumps(record["params"], sort_keys=True))
+            groups.setdefault(key, []).append(record)
+
+    print(f"{'map':<18}{'runs':>5}{'finished':>10}{'sd':>7}{'wait':>8}{'sd':>7}{'trip':>8}{'sd':>7}  params")
+    for (map_file, params), group in groups.items():
+        spread = statistics.stdev if len(group) > 1 else lambda values: 0.0
+        finished, waits, trips = ([record[name] for record in group] for name in ("finished", "mean_wait", "mean_trip"))
+        params = " ".join(f"{name}={value}" for name, value in json.loads(params).items() if name != "static_layers")
+        print(f"{os.path.basename(map_file):<18}{len(group):>5}{statistics.mean(finished):>10.1f}"
+              f"{spread(finished):>7.1f}{statistics.mean(waits):>8.2f}{spread(waits):>7.2f}"
+              f"{statistics.mean(trips):>8.1f}{spread(trips):>7.1f}  {params}")
+    failed = sum("error" in record for record in records)
+    if failed:
+        print(f"{failed} runs failed, run again to retry them")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a headless ensemble of simulations")
+    parser.add_argument("map_files", nargs="+")
+    parser.add_argument("--map-dict", default=DEFAULT_DICT)
+    parser.add_argument("--seeds", nargs="+", default=["0"], help="seeds and ranges like 0-99")
+    parser.add_argument("--steps", type=int, default=1000)
+    parser.add_argument("--param", type=parse_param, action="append", default=[], metavar="NAME=V1,V2",
+                        help="values of a TrafficModel argument or attribute, e.g. spawn_frequency=5,10")
+    parser.add_argument("--workers", type=int, default=0, help="simulation processes, 0 runs them here")
+    parser.add_argument("--map-cache", help="directory of compiled maps shared by the runs")
+    parser.add_argument("-o", "--output", default=DEFAULT_OUTPUT, help="JSON Lines results, resumed if it exists")
+    parser.add_argument("--profile", action="store_true", help="record the time of each step phase of every run")
+    parser.add_argument("-q", "--quiet", action="store_true", help="no per run progress")
+    args = parser.parse_args()
+
+    ensemble = Ensemble(args.map_files, parse_seeds(args.seeds), args.steps, dict(args.param), args.map_dict,
+                        args.output, args.map_cache, args.profile)
+    summarize(ensemble.run(args.workers, verbose=not args.quiet))
+
+
+if __name__ == "__main__":
+    main()
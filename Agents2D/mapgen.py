@@ -0,0 +1,146 @@
+# mapgen.py
+# Procedural maps in the same character format as public/*_base.txt.
+#   python mapgen.py grid --width 500 --height 500 --seed 1 -o city_500.txt
+#   python mapgen.py tile public/2024_base.txt --nx 10 --ny 10 -o tiled_10x10.txt
+import argparse
+import random
+
+LANE_WIDTH = 2
+
+
+def tile_map(rows, nx, ny):
+    """Repeat a base map nx times horizontally and ny times vertically.
+
+    The base maps are wrapped by a two lane ring road, so neighbouring tiles
+    meet lane against lane and cars can cross from one tile to the next.
+    """
+    return [row * nx for row in rows] * ny
+
+
+def fit_size(size, period):
+    """Closest size that makes the road bands end exactly on the map border"""
+    blocks = max(1, round((size - LANE_WIDTH) / period))
+    return blocks * period + LANE_WIDTH
+
+
+def generate_grid_city(width, height, block=6, signal_ratio=0.5, destinations=16, seed=None,
+                        one_way=False):
+    """Synthesize a grid of two-way streets around building blocks.
+
+    Horizontal streets have a westbound ('<') lane on top of an eastbound
+    ('>') one and vertical streets a southbound ('v') lane left of a
+    northbound ('^') one, so the network is strongly connected and the
+    border is a ring road with spawn points on every corner. A share of
+    the inner intersections get traffic lights on their four approaches
+    ('S' on horizontal lanes, 's' on vertical ones) and a handful of
+    destinations ('D'), like the base maps, are placed on block cells next
+    to a street. The size is rounded so the streets end on the border.
+
+    With one_way both lanes of a street run the same way and neighbouring
+    streets alternate, around a counterclockwise ring road on the border.
+    """
+    rng = random.Random(seed)
+    period = block + LANE_WIDTH
+    width = fit_size(width, period)
+    height = fit_size(height, period)
+
+    cells = [['#'] * width for _ in range(height)]
+    columns = range(0, width, period)
+    rows = range(0, height, period)
+
+    # Lane characters of every street, (first lane, second lane)
+    if one_way:
+        vertical = {x: ('v', 'v') if i % 2 == 0 else ('^', '^') for i, x in enumerate(columns)}
+        horizontal = {y: ('<', '<') if i % 2 == 0 else ('>', '>') for i, y in enumerate(rows)}
+        # Close the ring on the right and bottom borders whatever the parity
+        vertical[columns[-1]] = ('^', '^')
+        horizontal[rows[-1]] = ('>', '>')
+    else:
+        vertical = {x: ('v', '^') for x in columns}
+        horizontal = {y: ('<', '>') for y in rows}
+
+    # Vertical streets first, horizontal lanes win at the intersections
+    for x in columns:
+        for y in range(height):
+            cells[y][x], cells[y][x + 1] = vertical[x]
+    for y in rows:
+        for x in range(width):
+            cells[y][x], cells[y + 1][x] = horizontal[y]
+
+    # Traffic lights on the approaches of the inner intersections
+    for y in rows[1:-1]:
+        for x in columns[1:-1]:
+            if rng.random() >= signal_ratio:
+                continue
+            for lane, char in enumerate(horizontal[y]):
+                if char == '<':
+                    cells[y + lane][x + 2] = 'S'  # westbound, arriving from the east
+                else:
+                    cells[y + lane][x - 1] = 'S'  # eastbound, arriving from the west
+            for lane, char in enumerate(vertical[x]):
+                if char == 'v':
+                    cells[y - 1][x + lane] = 's'  # southbound, arriving from the north
+                else:
+                    cells[y + 2][x + lane] = 's'  # northbound, arriving from the south
+
+    # Destinations on block cells that touch a street
+    candidates = [
+        (x, y)
+        for y in range(height)
+        for x in range(width)
+        if cells[y][x] == '#' and (y % period in (LANE_WIDTH, period - 1) or
+                                   x % period in (LANE_WIDTH, period - 1))
+    ]
+    for x, y in rng.sample(candidates, min(destinations, len(candidates))):
+        cells[y][x] = 'D'
+
+    return [''.join(row) for row in cells]
+
+
+def read_map(path):
+    with open(path, 'r') as f:
+        return f.read().strip().split('\n')
+
+
+def write_map(rows, path):
+    with open(path, 'w') as f:
+        f.write('\n'.join(rows))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate large maps for scaling tests")
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+
+    grid = subparsers.add_parser("grid", help="synthesize a grid street network")
+    grid.add_argument("--width", type=int, default=100)
+    grid.add_argument("--height", type=int, default=100)
+    grid.add_argument("--block", type=int, default=6, help="building block size in cells")
+    grid.add_argument("--signals", type=float, default=0.5,
+                      help="share of inner intersections with traffic lights")
+    grid.add_argument("--destinations", type=int, default=16)
+    grid.add_argument("--seed", type=int, default=None)
+    grid.add_argument("--one-way", action="store_true",
+                      help="one-way streets alternating in direction")
+
+    tile = subparsers.add_parser("tile", help="tile an existing base map")
+    tile.add_argument("base_map")
+    tile.add_argument("--nx", type=int, default=2)
+    tile.add_argument("--ny", type=int, default=2)
+
+    for subparser in (grid, tile):
+        subparser.add_argument("-o", "--output", required=True)
+
+    args = parser.parse_args()
+
+    if args.mode == "grid":
+        rows = generate_grid_city(args.width, args.height, args.block, args.signals,
+                                  args.destinations, args.seed, args.one_way)
+    else:
+        rows = tile_map(read_map(args.base_map), args.nx, args.ny)
+
+    write_map(rows, args.output)
+    print(f"Wrote {len(rows[0])}x{len(rows)} map to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
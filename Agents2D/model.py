@@ -1,15 +1,77 @@
 # model.py
 from mesa import Model
-from mesa.time import RandomActivation
+from mesa.agent import AgentSet
 from mesa.space import MultiGrid  # Cambiado de SingleGrid a MultiGrid
 from agent import (CarAgent, RoadAgent, TrafficLightAgent, 
                  BuildingAgent, DestinationAgent)
+from roadgraph import BIT_DIRECTIONS, LEFT, RIGHT
+from compiledmap import CompiledMap, load_or_compile
+from routebatch import RouteBatcher
+from routing import CongestionCosts
+from signals import SignalController, SignalIndex
+from timeskip import TimeSkipper
+from tilecars import TileCars
+from tripstats import TripStats
+from vectorcars import VectorCars
 import json
-import random
+import numpy as np
 
 class TrafficModel(Model):
-    def __init__(self, map_file_path: str, map_dict_path: str):
+    def __init__(self, map_file_path: str, map_dict_path: str, static_layers: bool = False,
+                 map_cache_dir: str = None, routing: str = "astar", route_workers: int = 0,
+                 congestion_refresh: int = 0, engine: str = "agents", signal_groups: str = "map",
+                 approach_length: int = 3, signal_timing: dict = None, event_driven: bool = False,
+                 compiled_map: CompiledMap = None, tiles: int = 0):
         super().__init__()
+        # With static_layers roads, buildings and destinations only live in
+        # compact arrays instead of one agent per cell in the grid
+        self.static_layers = static_layers
+        self.map_file_path = map_file_path
+        self.map_dict_path = map_dict_path
+        # Compiled maps are stored here keyed by content hash, None disables the cache
+        self.map_cache_dir = map_cache_dir
+        # A compiled map of this same map file to share instead of loading one (forks pass their source's)
+        self.compiled_map = compiled_map
+        # "astar" searches every route, "alt" searches with landmark bounds,
+        # "fields" follows per-destination distance fields, "dstar" repairs
+        # each car's previous search
+        if routing not in ("astar", "alt", "fields", "dstar"):
+            raise ValueError(f"Unknown routing: {routing}")
+        self.routing = routing
+        # Cells around a car that the "dstar" planner checks for blockages
+        self.sense_radius = 3
+        # With route_workers the A* routes of new cars are solved once per step
+        # as a batch, on a process pool when there are at least min_route_batch
+        self.route_workers = route_workers
+        self.min_route_batch = 16
+        self.pending_routes = []
+        self.route_batcher = None
+        # With congestion_refresh the A* routes price every cell by how congested
+        # it has been, sampled every congestion_refresh steps; 0 keeps unit costs
+        self.congestion_refresh = congestion_refresh
+        self.congestion = None
+        # "agents" steps one CarAgent per car, "vector" keeps every car in the
+        # arrays of VectorCars and moves them all at once after the lights
+        if engine not in ("agents", "vector"):
+            raise ValueError(f"Unknown engine: {engine}")
+        if engine == "vector" and routing not in ("astar", "alt"):
+            raise ValueError(f"engine 'vector' routes with A*, not with routing '{routing}'")
+        self.engine = engine
+        self.vector_cars = None
+        # With tiles the "vector" cars are stepped by that many worker processes,
+        # each owning one tile of the grid (see TileCars)
+        if tiles and (engine != "vector" or congestion_refresh or route_workers or event_driven):
+            raise ValueError("tiles only step the 'vector' engine, "
+                             "without congestion_refresh, route_workers or event_driven")
+        self.tiles = tiles
+        # "map" switches every traffic light together, "intersection" gives
+        # each intersection its own timer driven by its own queues
+        self.signal_groups = signal_groups
+        # Road cells upstream of a sensing light whose cars count as its queue
+        self.approach_length = approach_length
+        # SignalController timing overrides: base_timer, min_timer, max_timer,
+        # wait_increment and per group offsets (see signaltuning.py)
+        self.signal_timing = dict(signal_timing or {})
         
         # Load map data and flip it vertically to match visualization
         with open(map_file_path, 'r') as f:
@@ -24,17 +86,30 @@ class TrafficModel(Model):
         self.width = len(self.map_data[0])
         
         self.grid = MultiGrid(self.width, self.height, False)
-        self.schedule = RandomActivation(self)
+        # Number of the car in every cell, -1 where there is none. place_car,
+        # move_car and remove_agent keep it in step with the grid, so
+        # collision checks never list cell contents
+        self.occupancy = np.full((self.width, self.height), -1, dtype=np.int32)
+        # The agents stepped every step, reshuffled with self.random before each
+        # step as RandomActivation would, see shuffle_schedule
+        self.schedule = AgentSet([], self)
         
         # Tracking variables
         self.step_count = 0
         self.cars_created = 0
         self.spawn_frequency = 10
-        self.total_wait_time = 0
-        self.wait_time_counts = 0
+        # Wait, trip time and stops of the cars, counted as they move and arrive
+        self.stats = TripStats()
+        # Moves made by every car so far, moves a car could not make and routes planned again
+        self.cars_moved = 0
+        self.failed_moves = 0
+        self.replans = 0
+        # StepProfiler timing the phases of step(), None skips the timing
+        self.profiler = None
         
+        # Cars on the map by car number, removal is a single dict pop
+        self.active_cars = {}
         # Lists for tracking
-        self.active_cars = []
         self.available_destinations = []
         self.spawn_points = []
         self.traffic_lights = []
@@ -48,10 +123,66 @@ class TrafficModel(Model):
 
         # Initialize the map
         self.initialize_map()
+        if route_workers and routing in ("astar", "alt"):
+            self.route_batcher = RouteBatcher(self.compiled_map, self.search_kernel, self.landmarks,
+                                              route_workers, self.min_route_batch)
+        if engine == "vector":
+            self.vector_cars = TileCars(self, tiles) if tiles else VectorCars(self)
+        # With event_driven, advance() jumps over the steps in which every car just waits
+        self.time_skipper = TimeSkipper(self) if event_driven else None
         self.running = True
 
     def initialize_map(self):
         """Initialize the map with all static agents"""
+        # Compile the static road network once so cars never scan cells for it
+        if self.compiled_map is None:
+            if self.map_cache_dir:
+                self.compiled_map = load_or_compile(self.map_cache_dir, self.map_file_path,
+                                                    self.map_dict_path, self.map_data)
+            else:
+                self.compiled_map = CompiledMap.compile(self.map_data)
+
+        self.layers = self.compiled_map.layers
+        self.road_graph = self.compiled_map.road_graph
+        self.spawn_points = list(self.compiled_map.spawn_points)
+        self.available_destinations = list(self.compiled_map.destinations)
+        # A* buffers shared by every car, and by the forks of this model
+        self.search_kernel = self.compiled_map.get_search_kernel()
+
+        self.distance_fields = None
+        if self.routing == "fields":
+            self.distance_fields = self.compiled_map.get_distance_fields()
+
+        self.landmarks = None
+        if self.routing == "alt":
+            self.landmarks = self.compiled_map.get_landmarks()
+
+        if self.congestion_refresh and self.routing in ("astar", "alt"):
+            self.congestion = CongestionCosts(self.width, self.height)
+
+        if self.static_layers:
+            self.initialize_static_layers()
+        else:
+            self.initialize_static_agents()
+
+        # Light of every signal cell and the approaches the current phase stops
+        self.signals = SignalIndex(self.width, self.height, self.traffic_lights)
+        self.signal_controller = SignalController(self.signals, self.road_graph, self.signal_groups,
+                                                  self.approach_length, **self.signal_timing)
+        # Queue counters of the signal approaches, updated wherever occupancy is
+        self.queues = self.signal_controller.queues
+
+    def initialize_static_layers(self):
+        """Initialize the map from the static layers, only traffic lights become agents"""
+        for x, y in self.compiled_map.signals:
+            orientation = "horizontal" if self.layers.road_mask[x, y] & (RIGHT | LEFT) else "vertical"
+            traffic_light = TrafficLightAgent(f"light_{x}_{y}", self, orientation)
+            self.traffic_lights.append(traffic_light)
+            self.traffic_light_groups[orientation].append(traffic_light)
+            self.place_static_agent(traffic_light, x, y)
+
+    def initialize_static_agents(self):
+        """Create one agent per road, building and destination cell"""
         agent_id = 0
         
         for y in range(self.height):
@@ -67,17 +198,13 @@ class TrafficModel(Model):
                         'v': 'down'
                     }
                     road_agent = RoadAgent(f"road_{agent_id}", self, direction_map[char])
-                    self.place_agent(road_agent, x, y)
+                    self.place_static_agent(road_agent, x, y)
                     self.road_cells[(x, y)] = direction_map[char]
                     agent_id += 1
-                    
-                    # Add spawn points at the edges
-                    if x in [0, self.width-1] or y in [0, self.height-1]:
-                        self.spawn_points.append((x, y))
                 
                 elif char == '#':
                     building = BuildingAgent(f"building_{agent_id}", self)
-                    self.place_agent(building, x, y)
+                    self.place_static_agent(building, x, y)
                     agent_id += 1
                 
                 elif char in ['S', 's']:
@@ -86,13 +213,13 @@ class TrafficModel(Model):
                         road_directions = ['right', 'left']
                         for direction in road_directions:
                             road_agent = RoadAgent(f"road_{agent_id}", self, direction)
-                            self.place_agent(road_agent, x, y)
+                            self.place_static_agent(road_agent, x, y)
                             agent_id += 1
                     else:  # Vertical traffic light
                         road_directions = ['up', 'down']
                         for direction in road_directions:
                             road_agent = RoadAgent(f"road_{agent_id}", self, direction)
-                            self.place_agent(road_agent, x, y)
+                            self.place_static_agent(road_agent, x, y)
                             agent_id += 1
                     
                     # Then place the traffic light
@@ -101,13 +228,12 @@ class TrafficModel(Model):
                     self.traffic_lights.append(traffic_light)
                     # Agregar al grupo correspondiente
                     self.traffic_light_groups[orientation].append(traffic_light)
-                    self.place_agent(traffic_light, x, y)
+                    self.place_static_agent(traffic_light, x, y)
                     agent_id += 1
                 
                 elif char == 'D':
                     destination = DestinationAgent(f"dest_{agent_id}", self)
-                    self.available_destinations.append((x, y))
-                    self.place_agent(destination, x, y)
+                    self.place_static_agent(destination, x, y)
                     agent_id += 1
 
     def create_border(self):
@@ -117,37 +243,70 @@ class TrafficModel(Model):
             # Top border
             building = BuildingAgent(f"border_top_{x}", self)
             self.grid.place_agent(building, (x, 0))
-            self.schedule.add(building)
             
             # Bottom border
             building = BuildingAgent(f"border_bottom_{x}", self)
             self.grid.place_agent(building, (x, self.height - 1))
-            self.schedule.add(building)
 
         # Create left and right borders (excluding corners already placed)
         for y in range(1, self.height - 1):
             # Left border
             building = BuildingAgent(f"border_left_{y}", self)
             self.grid.place_agent(building, (0, y))
-            self.schedule.add(building)
             
             # Right border
             building = BuildingAgent(f"border_right_{y}", self)
             self.grid.place_agent(building, (self.width - 1, y))
-            self.schedule.add(building)
 
     def place_agent(self, agent, x, y):
         """Helper method to place agent and add to scheduler"""
         self.grid.place_agent(agent, (x, y))
         self.schedule.add(agent)
 
+    def shuffle_schedule(self, steps=1):
+        """Reshuffle the order of the scheduled agents once for each of steps steps"""
+        if len(self.schedule):
+            for _ in range(steps):
+                self.schedule.shuffle(inplace=True)
+
+    def place_static_agent(self, agent, x, y):
+        """Place an agent without behavior in the grid only, the scheduler never activates it"""
+        self.grid.place_agent(agent, (x, y))
+
+    def place_car(self, car, pos):
+        """Put a car in the grid and the scheduler and mark its cell occupied"""
+        self.grid.place_agent(car, pos)
+        self.schedule.add(car)
+        self.occupancy[pos] = car.number
+        self.queues.enter(pos)
+
+    def move_car(self, car, pos):
+        """Move a car in the grid and in the occupancy array"""
+        self.vacate(car)
+        self.grid.move_agent(car, pos)
+        self.occupancy[pos] = car.number
+        self.queues.enter(pos)
+        self.cars_moved += 1
+        # The steps since the car's last move, if any, were a stop
+        if self.step_count - car.last_move > 1:
+            self.stats.record_stops([self.step_count - car.last_move - 1])
+            car.stops += 1
+        car.last_move = self.step_count
+
+    def vacate(self, car):
+        """Clear the car's cell, unless a later car took it (destinations take several)"""
+        if self.occupancy[car.pos] == car.number:
+            self.occupancy[car.pos] = -1
+            self.queues.leave(car.pos)
+
+    def is_occupied(self, pos):
+        """True when a car is in pos"""
+        return self.occupancy[pos] != -1
+
     def get_road_direction(self, pos):
         """Get the direction of the road at a given position"""
-        cell_contents = self.grid.get_cell_list_contents(pos)
-        for agent in cell_contents:
-            if isinstance(agent, RoadAgent):
-                return agent.direction
-        return None
+        directions = self.road_graph.road_directions(pos)
+        return directions[0] if directions else None
 
     def is_valid_spawn_point(self, pos):
         """Check if a position is a valid spawn point"""
@@ -155,8 +314,7 @@ class TrafficModel(Model):
             return False
         
         # Check if position is already occupied by a car
-        cell_contents = self.grid.get_cell_list_contents(pos)
-        return not any(isinstance(agent, CarAgent) for agent in cell_contents)
+        return not self.is_occupied(pos)
     
     def add_car(self):
         """Try to add a new car at a valid spawn point"""
@@ -174,50 +332,177 @@ class TrafficModel(Model):
         # Intentar agregar un carro en cada esquina
         for spawn_point in corner_spawns:
             if self.is_valid_spawn_point(spawn_point):
-                car = CarAgent(f"car_{self.cars_created}", self)
-                self.grid.place_agent(car, spawn_point)
-                self.schedule.add(car)
-                if car.find_destination():
-                    car.path = car.find_path_astar()
-                self.active_cars.append(car)
-                self.cars_created += 1
+                self.spawn_car(spawn_point)
                 cars_added += 1
                 print(f"Added car at corner {spawn_point}")
         
         return cars_added > 0
 
+    def spawn_car(self, pos):
+        """Place a new car at pos with a random destination and its initial path"""
+        if self.vector_cars:
+            car = self.vector_cars.spawn(pos, self.cars_created)
+            self.cars_created += 1
+            return car
+        car = CarAgent(f"car_{self.cars_created}", self, self.cars_created)
+        self.place_car(car, pos)
+        if car.find_destination():
+            if self.route_batcher:
+                self.pending_routes.append(car)
+            else:
+                car.set_path(car.plan_route())
+        self.active_cars[car.number] = car
+        self.cars_created += 1
+        return car
+
+    def blocked_ids(self, near=None):
+        """Kernel cell ids a car cannot enter right now: other cars and red traffic lights.
+
+        With congestion costs and a list of near positions, only the cars
+        within sense_radius of one of them block; the ones farther away are
+        priced into the route instead.
+        """
+        if self.congestion and near is not None:
+            radius = self.sense_radius
+            blocked = set()
+            for x, y in near:
+                x0, y0 = max(0, x - radius), max(0, y - radius)
+                xs, ys = np.nonzero(self.occupancy[x0:x + radius + 1, y0:y + radius + 1] != -1)
+                blocked.update(((xs + x0) * self.height + ys + y0).tolist())
+        else:
+            blocked = set(np.flatnonzero(self.occupancy != -1).tolist())
+        blocked.update(self.signals.red_ids().tolist())
+        return blocked
+
+    def blocked_cells(self, near=None):
+        """blocked_ids() as positions"""
+        return set(self.search_kernel.positions(self.blocked_ids(near)))
+
+    def solve_pending_routes(self):
+        """Route every car queued by spawn_car in one batch"""
+        if self.vector_cars:
+            self.vector_cars.route_spawned()
+            return
+        if not self.pending_routes:
+            return
+        cell_id = self.search_kernel.cell_id
+        paths = self.route_batcher.solve([(cell_id(car.pos), cell_id(car.destination))
+                                          for car in self.pending_routes],
+                                         self.blocked_ids([car.pos for car in self.pending_routes]),
+                                         self.congestion)
+        for car, path in zip(self.pending_routes, paths):
+            car.set_path(path)
+        self.pending_routes = []
+
+    def refresh_congestion(self):
+        """Sample car positions and queues into the congestion costs"""
+        if self.vector_cars:
+            cars = self.vector_cars.cars()
+            occupied = self.vector_cars.positions(cars)
+            queued = self.vector_cars.positions(cars[self.vector_cars.waiting[cars] > 0])
+        else:
+            occupied = [car.pos for car in self.active_cars.values()]
+            queued = [car.pos for car in self.active_cars.values() if car.waiting_time > 0]
+        self.congestion.refresh(occupied, queued)
+
+    def close(self):
+        """Shut down the route and tile worker processes, if any"""
+        if self.route_batcher:
+            self.route_batcher.close()
+        if self.tiles and self.vector_cars:
+            self.vector_cars.close()
+
     def get_traffic_density(self):
         """Calculate current traffic density"""
-        if not self.road_cells:
+        if not self.layers.road_cell_count:
             return 0
-        return (len(self.active_cars) / len(self.road_cells)) * 100
+        return (self.active_car_count() / self.layers.road_cell_count) * 100
 
-    def update_wait_times(self):
-        """Update waiting time statistics"""
-        for car in self.active_cars:
-            if car.waiting_time > 0:
-                self.total_wait_time += car.waiting_time
-                self.wait_time_counts += 1
+    def active_car_count(self):
+        """Cars on the map, with either engine"""
+        return self.vector_cars.count if self.vector_cars else len(self.active_cars)
+
+    def iter_cars(self):
+        """Yield (unique_id, (x, y), direction) for every car on the map, with either engine"""
+        if self.vector_cars:
+            cars = self.vector_cars.cars()
+            for number, pos, bit in zip(self.vector_cars.number[cars].tolist(), self.vector_cars.positions(cars),
+                                        self.vector_cars.direction[cars].tolist()):
+                yield f"car_{number}", pos, BIT_DIRECTIONS.get(bit)
+        else:
+            for car in self.active_cars.values():
+                yield car.unique_id, car.pos, car.current_direction
+
+    def iter_lights(self):
+        """Yield (unique_id, (x, y), orientation, state) for every traffic light"""
+        for light, pos, state in self.signals.iter_lights():
+            yield light.unique_id, pos, light.orientation, state
+
+    def iter_static_cells(self):
+        """Yield (unique_id, kind, (x, y), direction) for roads, buildings and destinations"""
+        return self.layers.iter_cells()
 
     def remove_agent(self, agent):
         """Remove an agent from the model"""
-        if agent in self.active_cars:
-            self.active_cars.remove(agent)
+        if isinstance(agent, CarAgent):
+            self.active_cars.pop(agent.number, None)
+            self.vacate(agent)
+            self.stats.record_trips([agent.last_move - agent.spawn_step], [agent.stops])
         self.grid.remove_agent(agent)
         self.schedule.remove(agent)
+        # Mesa's model registry would otherwise keep every finished car alive
+        agent.remove()
 
     def step(self):
         """Advance the model by one step"""
+        profiler = self.profiler
+        if profiler:
+            profiler.begin()
+
         if self.step_count == 0:
             self.add_car()
 
-        self.step_count += 1
-        
-        # Try to spawn new cars every 10 steps
-        if self.step_count % self.spawn_frequency == 0:
+        # Try to spawn new cars every 10 steps. They spawn before the step
+        # count moves on, like cars placed between steps
+        if (self.step_count + 1) % self.spawn_frequency == 0:
             self.add_car()
+
+        self.step_count += 1
+        if profiler:
+            profiler.lap("spawn")
+
+        if self.congestion and self.step_count % self.congestion_refresh == 0:
+            self.refresh_congestion()
+
+        # New cars get their routes before their first move
+        self.solve_pending_routes()
+        if profiler:
+            profiler.lap("routes")
+
+        # The lights switch before any car moves
+        self.signal_controller.step()
+        if profiler:
+            profiler.lap("signals")
         
-        self.schedule.step()
-        
-        # Update statistics
-        self.update_wait_times()
\ No newline at end of file
+        self.shuffle_schedule()
+        self.schedule.do("step")
+        if self.vector_cars:
+            self.vector_cars.step()
+        if profiler:
+            profiler.end("cars")
+
+    def advance(self, steps):
+        """Advance the model by steps steps, skipping idle ones in bulk when event driven"""
+        done = 0
+        while done < steps:
+            if self.time_skipper:
+                if self.profiler:
+                    self.profiler.begin()
+                skipped = self.time_skipper.skip(steps - done)
+                if self.profiler:
+                    self.profiler.end("skip", skipped)
+                done += skipped
+                if done == steps:
+                    break
+            self.step()
+            done += 1
@@ -0,0 +1,125 @@
+# roadgraph.py
+import numpy as np
+
+# Direction bits, shared by road cells (allowed directions) and moves
+RIGHT = 1
+LEFT = 2
+UP = 4
+DOWN = 8
+
+DIRECTION_BITS = {
+    'right': RIGHT,
+    'left': LEFT,
+    'up': UP,
+    'down': DOWN
+}
+
+BIT_DIRECTIONS = {bit: name for name, bit in DIRECTION_BITS.items()}
+
+OPPOSITE = {
+    RIGHT: LEFT,
+    LEFT: RIGHT,
+    UP: DOWN,
+    DOWN: UP
+}
+
+# The map is flipped vertically on load, so "up" means increasing y
+DIRECTION_DELTAS = {
+    RIGHT: (1, 0),
+    LEFT: (-1, 0),
+    UP: (0, 1),
+    DOWN: (0, -1)
+}
+
+# Road directions encoded by each map character
+CHAR_DIRECTIONS = {
+    '>': RIGHT,
+    '<': LEFT,
+    '^': UP,
+    'v': DOWN,
+    'S': RIGHT | LEFT,
+    's': UP | DOWN
+}
+
+SIGNAL_CHARS = ('S', 's')
+
+
+class RoadGraph:
+    """Immutable directed adjacency compiled once from the map.
+
+    Cells are indexed as [x, y] like the Mesa grid. ``road_mask`` holds the
+    direction bits of each road cell and ``moves`` holds, for every cell, the
+    bits of the moves that leave it legally (road on both ends and the turn
+    allowed), so a move check is a single array read. A ``moves`` array
+    loaded from the map cache skips the compilation.
+    """
+    def __init__(self, road_mask, signal_mask, moves=None):
+        self.width, self.height = road_mask.shape
+        self.road_mask = road_mask
+        self.signal_mask = signal_mask
+        self.moves = self._compile_moves() if moves is None else moves
+
+        for array in (self.road_mask, self.signal_mask, self.moves):
+            array.flags.writeable = False
+
+        # Successor offsets for each of the 16 possible move masks
+        self._offsets = tuple(
+            tuple(DIRECTION_DELTAS[bit] for bit in (RIGHT, LEFT, UP, DOWN) if mask & bit)
+            for mask in range(16)
+        )
+
+    def _compile_moves(self):
+        """Resolve turn legality for every cell and move direction"""
+        moves = np.zeros((self.width, self.height), dtype=np.uint8)
+
+        for bit, (dx, dy) in DIRECTION_DELTAS.items():
+            # A road can be left or entered in any direction but its opposite
+            allowed = (self.road_mask & ~np.uint8(OPPOSITE[bit])) != 0
+
+            src_x = slice(max(0, -dx), self.width - max(0, dx))
+            src_y = slice(max(0, -dy), self.height - max(0, dy))
+            dst_x = slice(max(0, dx), self.width - max(0, -dx))
+            dst_y = slice(max(0, dy), self.height - max(0, -dy))
+
+            legal = allowed[src_x, src_y] & allowed[dst_x, dst_y]
+            moves[src_x, src_y] |= np.where(legal, bit, 0).astype(np.uint8)
+
+        return moves
+
+    def in_bounds(self, pos):
+        return 0 <= pos[0] < self.width and 0 <= pos[1] < self.height
+
+    def is_road(self, pos):
+        return self.road_mask[pos] != 0
+
+    def is_signal(self, pos):
+        return bool(self.signal_mask[pos])
+
+    def road_directions(self, pos):
+        """Direction names of the road at a position"""
+        mask = self.road_mask[pos]
+        return [name for name, bit in DIRECTION_BITS.items() if mask & bit]
+
+    def can_move(self, current_pos, next_pos):
+        """Check a move between adjacent cells against the static rules"""
+        dx = next_pos[0] - current_pos[0]
+        dy = next_pos[1] - current_pos[1]
+        for bit, delta in DIRECTION_DELTAS.items():
+            if delta == (dx, dy):
+                return bool(self.moves[current_pos] & bit)
+        return False
+
+    def successors(self, pos):
+        """Cells reachable from pos in one legal move"""
+        x, y = pos
+        return [(x + dx, y + dy) for dx, dy in self._offsets[self.moves[pos]]]
+
+    def predecessors(self, pos):
+        """Cells that reach pos in one legal move"""
+        x, y = pos
+        cells = []
+        for bit, (dx, dy) in DIRECTION_DELTAS.items():
+            prev = (x - dx, y - dy)
+            if self.in_bounds(prev) and self.moves[prev] & bit:
+                cells.append(prev)
+        return cells
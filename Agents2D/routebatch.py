@@ -0,0 +1,103 @@
+# routebatch.py
+import math
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from compiledmap import CompiledMap
+from roadgraph import RoadGraph
+from routing import Landmarks
+from searchkernel import SearchKernel
+
+# Search kernel and landmarks of a pool worker, set once by _init_worker
+_worker = {}
+
+
+def load_routing(cache_path, arrays, use_landmarks):
+    """Road graph, search kernel and landmarks of a worker process.
+
+    A compiled map stored in the map cache is memory-mapped from disk, so
+    every worker shares the same pages; otherwise the arrays come pickled.
+    """
+    if cache_path:
+        compiled = CompiledMap.load(cache_path)
+        road_graph = compiled.road_graph
+        landmarks = compiled.landmarks if use_landmarks else None
+    else:
+        road_mask, signal_mask, moves, landmark_arrays = arrays
+        road_graph = RoadGraph(road_mask, signal_mask, moves=moves)
+        landmarks = Landmarks(*landmark_arrays, road_graph) if use_landmarks else None
+    return road_graph, SearchKernel(road_graph), landmarks
+
+
+def routing_initargs(compiled_map, landmarks=None):
+    """load_routing() arguments that rebuild the routing of compiled_map in another process"""
+    use_landmarks = landmarks is not None
+    # get_landmarks() stores the tables with the cache entry, next to the road graph
+    if compiled_map.cache_path:
+        return compiled_map.cache_path, None, use_landmarks
+
+    landmark_arrays = None
+    if use_landmarks:
+        landmark_arrays = (landmarks.landmarks, landmarks.forward, landmarks.backward)
+    road_graph = compiled_map.road_graph
+    arrays = (road_graph.road_mask, road_graph.signal_mask, road_graph.moves, landmark_arrays)
+    return None, arrays, use_landmarks
+
+
+def _init_worker(cache_path, arrays, use_landmarks):
+    """Load the read-only road graph once per worker process"""
+    _, _worker["kernel"], _worker["landmarks"] = load_routing(cache_path, arrays, use_landmarks)
+
+
+def _solve_chunk(requests, blocked, congestion):
+    """Paths of the requests, and the nodes the worker's kernel expanded for them"""
+    kernel = _worker["kernel"]
+    expanded = kernel.expanded
+    paths = [kernel.route_ids(start, goal, blocked, _worker["landmarks"], congestion) for start, goal in requests]
+    return paths, kernel.expanded - expanded
+
+
+class RouteBatcher:
+    """Solve the route requests collected during a step in one batch.
+
+    Batches of at least min_batch requests are split across a process pool;
+    smaller ones are solved in process with the same search, so a request
+    gets the same route either way.
+    """
+    def __init__(self, compiled_map, kernel, landmarks=None, workers=2, min_batch=16):
+        self.compiled_map = compiled_map
+        self.road_graph = compiled_map.road_graph
+        self.kernel = kernel
+        self.landmarks = landmarks
+        self.workers = workers
+        self.min_batch = min_batch
+        self.executor = None
+
+    def solve(self, requests, blocked, congestion=None):
+        """Cell id arrays routing a list of (start, goal) cell id requests, in the same order.
+
+        blocked holds the kernel cell ids no route may enter; congestion,
+        when given, is sent along with every chunk so the workers price
+        cells with the current costs.
+        """
+        blocked = frozenset(blocked)
+        if self.workers < 1 or len(requests) < self.min_batch:
+            return [self.kernel.route_ids(start, goal, blocked, self.landmarks, congestion)
+                    for start, goal in requests]
+
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                                initargs=routing_initargs(self.compiled_map, self.landmarks))
+
+        size = math.ceil(len(requests) / self.workers)
+        chunks = [requests[i:i + size] for i in range(0, len(requests), size)]
+        results = list(self.executor.map(_solve_chunk, chunks, repeat(blocked), repeat(congestion)))
+        # The workers' searches count with the ones made here
+        self.kernel.searches += len(requests)
+        self.kernel.expanded += sum(expanded for _, expanded in results)
+        return [path for paths, _ in results for path in paths]
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
@@ -0,0 +1,145 @@
+# searchkernel.py
+import heapq
+from array import array
+
+import numpy as np
+
+
+class SearchKernel:
+    """Reusable A* over flat integer cell ids.
+
+    A cell (x, y) has id x * height + y, the flat index of the [x, y]
+    arrays, so ids order like the position tuples and ties break the same
+    way as a search over tuples. The g, parent and closed buffers are
+    allocated once; every search bumps a generation number and an entry
+    only counts when its stamp matches it, so nothing is cleared between
+    searches.
+    """
+    def __init__(self, road_graph):
+        self.width = road_graph.width
+        self.height = road_graph.height
+        cells = self.width * self.height
+
+        # Successor ids of every cell, from the compiled legal moves
+        empty = ()
+        self.successors = [empty] * cells
+        xs, ys = np.nonzero(np.asarray(road_graph.moves))
+        for x, y in zip(xs.tolist(), ys.tolist()):
+            self.successors[x * self.height + y] = tuple(
+                nx * self.height + ny for nx, ny in road_graph.successors((x, y)))
+
+        # Every move costs 1 unless search() gets a cost table
+        self.unit_costs = array('i', [1]) * cells
+
+        self.g = array('i', bytes(4 * cells))
+        self.parent = array('i', bytes(4 * cells))
+        self.seen = array('I', bytes(4 * cells))
+        self.closed = array('I', bytes(4 * cells))
+        self.generation = 0
+
+        # Search statistics, for benchmarks and the StepProfiler
+        self.searches = 0
+        self.expanded = 0
+
+    def cell_id(self, pos):
+        return pos[0] * self.height + pos[1]
+
+    def position(self, cell_id):
+        return divmod(cell_id, self.height)
+
+    def positions(self, cell_ids):
+        height = self.height
+        return [divmod(cell_id, height) for cell_id in cell_ids]
+
+    def _next_generation(self):
+        self.generation += 1
+        if self.generation >= 2 ** 32 - 1:
+            # Stamps would wrap around, start over from clean buffers
+            cells = self.width * self.height
+            self.seen = array('I', bytes(4 * cells))
+            self.closed = array('I', bytes(4 * cells))
+            self.generation = 1
+        return self.generation
+
+    def search(self, start, goal, blocked=(), bounds=None, costs=None, scale=1):
+        """Cheapest path between two cell ids as an array of ids, or None.
+
+        The path leaves out start. Cells in blocked cannot be entered, the
+        goal always can, from any adjacent cell. bounds, when given, holds a
+        lower bound on the moves to goal for every cell id and tightens the
+        Manhattan heuristic. costs holds the cost of entering each cell id,
+        none below scale, which the heuristic is multiplied by.
+        """
+        generation = self._next_generation()
+        self.searches += 1
+        height = self.height
+        successors = self.successors
+        g = self.g
+        parent = self.parent
+        seen = self.seen
+        closed = self.closed
+        if costs is None:
+            costs = self.unit_costs
+
+        goal_x, goal_y = divmod(goal, height)
+        goal_adjacent = set()
+        for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1)):
+            x, y = goal_x + dx, goal_y + dy
+            if 0 <= x < self.width and 0 <= y < height:
+                goal_adjacent.add(x * height + y)
+
+        start_x, start_y = divmod(start, height)
+        h = abs(start_x - goal_x) + abs(start_y - goal_y)
+        if bounds is not None:
+            h = max(h, bounds[start])
+        open_set = [(h * scale, start)]
+        g[start] = 0
+        seen[start] = generation
+
+        while open_set:
+            current = heapq.heappop(open_set)[1]
+
+            if current == goal:
+                path = array('i')
+                while current != start:
+                    path.append(current)
+                    current = parent[current]
+                path.reverse()
+                return path
+
+            if closed[current] == generation:
+                continue
+            closed[current] = generation
+            self.expanded += 1
+
+            neighbors = [cell for cell in successors[current] if cell == goal or cell not in blocked]
+            if current in goal_adjacent and goal not in neighbors:
+                neighbors.append(goal)
+
+            g_current = g[current]
+            for neighbor in neighbors:
+                if closed[neighbor] == generation:
+                    continue
+                tentative = g_current + costs[neighbor]
+                if seen[neighbor] != generation or tentative < g[neighbor]:
+                    seen[neighbor] = generation
+                    g[neighbor] = tentative
+                    parent[neighbor] = current
+                    x, y = divmod(neighbor, height)
+                    h = abs(x - goal_x) + abs(y - goal_y)
+                    if bounds is not None and bounds[neighbor] > h:
+                        h = bounds[neighbor]
+                    heapq.heappush(open_set, (tentative + h * scale, neighbor))
+
+        return None
+
+    def route_ids(self, start, goal, blocked_ids=(), landmarks=None, congestion=None):
+        """search() with the bounds of landmarks and the cell costs of congestion"""
+        bounds = landmarks.flat_bounds(self.position(goal)) if landmarks is not None else None
+        costs, scale = (congestion.costs, congestion.scale) if congestion is not None else (None, 1)
+        return self.search(start, goal, blocked_ids, bounds, costs, scale)
+
+    def route(self, start, goal, blocked_ids=(), landmarks=None, congestion=None):
+        """route_ids() between positions, returning a list of positions or None"""
+        path = self.route_ids(self.cell_id(start), self.cell_id(goal), blocked_ids, landmarks, congestion)
+        return self.positions(path) if path is not None else None
@@ -11,7 +11,9 @@ class SimulationStats(TextElement):
         stats = {
             "Active Cars": len(model.active_cars),
             "Total Cars Created": model.cars_created,
-            "Traffic Density": f"{model.get_traffic_density():.2f}%"
+            "Traffic Density": f"{model.get_traffic_density():.2f}%",
+            "Mean Wait per Stop": f"{model.stats.wait.mean:.2f}",
+            "Mean Trip Time": f"{model.stats.trip_time.mean:.1f}"
         }
         return "<br>".join(f"{k}: {v}" for k, v in stats.items())
 
@@ -37,15 +39,9 @@ def agent_portrayal(agent):
         })
 
     elif isinstance(agent, BuildingAgent):
-        portrayal.update({
-            "Color": "#404040",
-            "text": "⬛"
-        })
+        return static_portrayal("building")
     elif isinstance(agent, DestinationAgent):
-        portrayal.update({
-            "Color": "#90EE90",
-            "text": "🎯"
-        })
+        return static_portrayal("destination")
     elif isinstance(agent, TrafficLightAgent):
         color = "#50C878" if agent.state == "green" else "#FF4433"
         portrayal.update({
@@ -54,6 +50,33 @@ def agent_portrayal(agent):
             "text": "🚦"
         })
     elif isinstance(agent, RoadAgent):
+        return static_portrayal("road", agent.direction)
+    
+    return portrayal
+
+def static_portrayal(kind, direction=None):
+    """Define how to portray a road, building or destination cell"""
+    portrayal = {
+        "Shape": "rect",
+        "Filled": True,
+        "Layer": 0,
+        "w": 0.9,
+        "h": 0.9,
+        "text": "",
+        "text_color": "black"
+    }
+
+    if kind == "building":
+        portrayal.update({
+            "Color": "#404040",
+            "text": "⬛"
+        })
+    elif kind == "destination":
+        portrayal.update({
+            "Color": "#90EE90",
+            "text": "🎯"
+        })
+    elif kind == "road":
         direction_arrows = {
             "right": "→",
             "left": "←",
@@ -62,13 +85,26 @@ def agent_portrayal(agent):
         }
         portrayal.update({
             "Color": "#D3D3D3",
-            "text": direction_arrows.get(agent.direction, ""),
+            "text": direction_arrows.get(direction, ""),
             "text_color": "black"
         })
-    
+
     return portrayal
 
-def create_server(map_file="public/2024_base.txt", map_dict="public/mapDictionary.json"):
+class StaticLayerCanvasGrid(CanvasGrid):
+    """Canvas grid that also draws the static layers when they are not agents"""
+    def render(self, model):
+        grid_state = super().render(model)
+        if model.static_layers:
+            for _, kind, (x, y), direction in model.iter_static_cells():
+                portrayal = static_portrayal(kind, direction)
+                portrayal["x"] = x
+                portrayal["y"] = y
+                grid_state[portrayal["Layer"]].append(portrayal)
+        return grid_state
+
+def create_server(map_file="public/2024_base.txt", map_dict="public/mapDictionary.json",
+                  static_layers=False):
     # Calculate grid size from map file
     with open(map_file, 'r') as f:
         map_data = f.read().strip().split('\n')
@@ -76,7 +112,7 @@ def create_server(map_file="public/2024_base.txt", map_dict="public/mapDictionar
     width = len(map_data[0]) + 1
     
     # Create visualization elements
-    grid = CanvasGrid(agent_portrayal, width, height, width * 25, height * 25)
+    grid = StaticLayerCanvasGrid(agent_portrayal, width, height, width * 25, height * 25)
     stats = SimulationStats()
     
     # Create server
@@ -86,7 +122,8 @@ def create_server(map_file="public/2024_base.txt", map_dict="public/mapDictionar
         "Traffic Simulation",
         {
             "map_file_path": map_file, 
-            "map_dict_path": map_dict
+            "map_dict_path": map_dict,
+            "static_layers": static_layers
         }
     )
     
@@ -0,0 +1,252 @@
+# signals.py
+import numpy as np
+from roadgraph import DIRECTION_DELTAS, DOWN, LEFT, RIGHT, UP
+
+# Direction bit of a move between adjacent cells
+MOVE_BITS = {delta: bit for bit, delta in DIRECTION_DELTAS.items()}
+
+# Phase 0 lets horizontal traffic through, phase 1 vertical traffic
+HORIZONTAL_GREEN = 0
+VERTICAL_GREEN = 1
+
+# Signal cells at most this far apart (in both x and y) belong to one intersection
+INTERSECTION_REACH = 2
+
+
+class SignalIndex:
+    """Traffic lights by cell and the approaches each signal phase stops.
+
+    ``light_at[x, y]`` is the index in ``lights`` of the light on a cell, -1
+    where there is none. ``phase_blocked[p]`` holds, for every light, the
+    direction bits of the moves into its cell that it stops in phase p: a red
+    horizontal light stops RIGHT and LEFT, a red vertical one UP and DOWN.
+    ``blocked`` holds those bits for every cell in the lights' current
+    phases, so a red light check is a single array read, and the lights read
+    their state from it too.
+    """
+    def __init__(self, width, height, lights):
+        self.lights = list(lights)
+        self.light_at = np.full((width, height), -1, dtype=np.int32)
+        self.cells = np.zeros(len(self.lights), dtype=np.int64)
+        self.phase_blocked = np.zeros((2, len(self.lights)), dtype=np.uint8)
+        for i, light in enumerate(self.lights):
+            self.light_at[light.pos] = i
+            self.cells[i] = light.pos[0] * height + light.pos[1]
+            if light.orientation == "horizontal":
+                self.phase_blocked[VERTICAL_GREEN, i] = RIGHT | LEFT
+            else:
+                self.phase_blocked[HORIZONTAL_GREEN, i] = UP | DOWN
+        self.phase_blocked.flags.writeable = False
+
+        self.blocked = np.zeros((width, height), dtype=np.uint8)
+        self.set_phase(np.arange(len(self.lights)), HORIZONTAL_GREEN)
+
+    def set_phase(self, lights, phase):
+        """Switch the lights with the given indices to phase, one value or one per light"""
+        self.blocked.ravel()[self.cells[lights]] = self.phase_blocked[phase, lights]
+
+    def detached(self):
+        """Copy without the light agents, for a process that only reads and sets the phases"""
+        copy = object.__new__(SignalIndex)
+        copy.__dict__.update(self.__dict__, lights=[], blocked=self.blocked.copy())
+        return copy
+
+    def is_red(self, pos):
+        """True when pos holds a red light"""
+        return self.blocked[pos] != 0
+
+    def stops(self, current_pos, next_pos):
+        """True when a red light on next_pos stops the move from current_pos"""
+        blocked = self.blocked[next_pos]
+        if not blocked:
+            return False
+        move = MOVE_BITS.get((next_pos[0] - current_pos[0], next_pos[1] - current_pos[1]), 0)
+        return bool(blocked & move)
+
+    def state(self, pos):
+        return "red" if self.blocked[pos] else "green"
+
+    def red_ids(self):
+        """Cell ids of the red lights, the search kernel's x * height + y"""
+        return self.cells[self.blocked.ravel()[self.cells] != 0]
+
+    def iter_lights(self):
+        """Yield every light with its state, ordered by cell"""
+        for x, y in zip(*np.nonzero(self.light_at >= 0)):
+            pos = (int(x), int(y))
+            yield self.lights[self.light_at[pos]], pos, self.state(pos)
+
+
+def intersection_groups(signals):
+    """Group number of every light, lights whose cells are within INTERSECTION_REACH share one"""
+    positions = [light.pos for light in signals.lights]
+    group = list(range(len(positions)))
+
+    def root(i):
+        while group[i] != i:
+            group[i] = group[group[i]]
+            i = group[i]
+        return i
+
+    index = {pos: i for i, pos in enumerate(positions)}
+    reach = range(-INTERSECTION_REACH, INTERSECTION_REACH + 1)
+    for i, (x, y) in enumerate(positions):
+        for dx in reach:
+            for dy in reach:
+                j = index.get((x + dx, y + dy))
+                if j is not None:
+                    group[root(j)] = root(i)
+
+    roots = [root(i) for i in range(len(positions))]
+    _, numbers = np.unique(roots, return_inverse=True)
+    return numbers
+
+
+class ApproachQueues:
+    """Number of cars on the approach of every sensing light, kept up to date as cars move.
+
+    An approach is the light's cell and the road cells that lead into it, up
+    to ``length`` moves upstream, stopping at other signal cells. A cell
+    belongs to the first approach that reaches it. The model calls enter and
+    leave whenever a car takes or frees a cell, so reading the counters costs
+    the same however long the approaches are.
+    """
+    def __init__(self, signals, road_graph, sensors, length=3):
+        width, height = signals.light_at.shape
+        self.approach_at = np.full((width, height), -1, dtype=np.int32)
+        self.approach_ids = self.approach_at.ravel()
+        self.light = np.array(sensors, dtype=np.int64)
+        self.counts = np.zeros(len(self.light), dtype=np.int32)
+
+        for approach, i in enumerate(self.light):
+            root = signals.lights[i].pos
+            frontier = [root]
+            for _ in range(length + 1):
+                upstream = []
+                for pos in frontier:
+                    if self.approach_at[pos] != -1:
+                        continue
+                    self.approach_at[pos] = approach
+                    upstream.extend(prev for prev in road_graph.predecessors(pos)
+                                    if road_graph.is_road(prev) and signals.light_at[prev] == -1)
+                frontier = upstream
+        self.approach_at.flags.writeable = False
+        # Cell ids of every approach cell
+        self.cells = np.flatnonzero(self.approach_ids != -1)
+
+    def enter(self, pos):
+        """A car took the cell pos"""
+        approach = self.approach_at[pos]
+        if approach != -1:
+            self.counts[approach] += 1
+
+    def leave(self, pos):
+        """A car freed the cell pos"""
+        approach = self.approach_at[pos]
+        if approach != -1:
+            self.counts[approach] -= 1
+
+    def enter_ids(self, cells):
+        """Cars took the cells with these ids"""
+        approaches = self.approach_ids[cells]
+        approaches = approaches[approaches != -1]
+        if approaches.size:
+            self.counts += np.bincount(approaches, minlength=self.counts.size).astype(np.int32)
+
+    def leave_ids(self, cells):
+        """Cars freed the cells with these ids"""
+        approaches = self.approach_ids[cells]
+        approaches = approaches[approaches != -1]
+        if approaches.size:
+            self.counts -= np.bincount(approaches, minlength=self.counts.size).astype(np.int32)
+
+    def recount(self, occupancy):
+        """Counts rebuilt from an occupancy grid, for cars moved where enter and leave were not called"""
+        occupied = self.cells[occupancy.ravel()[self.cells] != -1]
+        self.counts[:] = np.bincount(self.approach_ids[occupied], minlength=self.counts.size)
+
+
+class SignalController:
+    """Timers and phases of every signal group, advanced once per model step.
+
+    The lights of a group switch together. With groups="map" every light is
+    in one group and the queue at the first horizontal light sets its pace,
+    the plan the lights followed on their own before. With
+    groups="intersection" the signal cells of each intersection form a group
+    that counts the cars waiting on all of its approaches.
+
+    A group's timer runs down by 2 while a car waits on its approaches
+    (see ApproachQueues) and by 1 otherwise. When it runs out the group
+    switches phase and the timer restarts at base_timer plus wait_increment
+    per waiting car, within min_timer and max_timer. offsets, one per group,
+    delay each group's first switch so neighbouring groups can be staggered.
+    """
+    def __init__(self, signals, road_graph, groups="map", approach_length=3,
+                 base_timer=10, min_timer=5, max_timer=20, wait_increment=2, offsets=None):
+        if groups not in ("map", "intersection"):
+            raise ValueError(f"Unknown signal grouping: {groups}")
+        if not 0 < min_timer <= max_timer:
+            raise ValueError(f"Signal timers need 0 < min_timer <= max_timer, got {min_timer} and {max_timer}")
+        self.signals = signals
+        self.base_timer = base_timer
+        self.min_timer = min_timer
+        self.max_timer = max_timer
+        self.wait_increment = wait_increment
+
+        lights = signals.lights
+        if groups == "intersection":
+            self.light_group = intersection_groups(signals)
+            sensors = range(len(lights))
+        else:
+            self.light_group = np.zeros(len(lights), dtype=np.int64)
+            first = next((i for i, light in enumerate(lights) if light.orientation == "horizontal"), 0)
+            sensors = [first] if lights else []
+        self.group_count = int(self.light_group.max()) + 1 if len(lights) else 0
+
+        self.queues = ApproachQueues(signals, road_graph, sensors, approach_length)
+        self.approach_group = self.light_group[self.queues.light]
+
+        self.phase = np.full(self.group_count, HORIZONTAL_GREEN, dtype=np.int8)
+        self.timer = np.full(self.group_count, base_timer, dtype=np.int32)
+        if offsets is not None:
+            if len(offsets) != self.group_count:
+                raise ValueError(f"Expected {self.group_count} signal offsets, got {len(offsets)}")
+            self.timer += np.asarray(offsets, dtype=np.int32)
+
+    def waiting_cars(self):
+        """Cars on the approaches of every group"""
+        return np.bincount(self.approach_group, weights=self.queues.counts,
+                           minlength=self.group_count).astype(np.int32)
+
+    def steps_to_switch(self):
+        """Steps until every group switches, if the queues stay as they are"""
+        rate = np.where(self.waiting_cars() > 0, 2, 1)
+        return np.maximum(1, -(-self.timer // rate))
+
+    def step(self):
+        """Run the group timers down one step and switch the groups whose timer ran out"""
+        waiting = self.waiting_cars()
+        self.timer -= np.where(waiting > 0, 2, 1).astype(np.int32)
+        self.switch(self.timer <= 0, waiting)
+
+    def advance(self, steps):
+        """Same as steps calls to step() while no car moves, one pass per switch instead of per step"""
+        waiting = self.waiting_cars()
+        rate = np.where(waiting > 0, 2, 1).astype(np.int32)
+        while steps > 0:
+            due = int(np.maximum(1, -(-self.timer // rate)).min())
+            run = min(due, steps)
+            self.timer -= rate * run
+            steps -= run
+            if run == due:
+                self.switch(self.timer <= 0, waiting)
+
+    def switch(self, expired, waiting):
+        """Flip the phase of the expired groups and restart their timers"""
+        if not expired.any():
+            return
+        self.phase[expired] ^= 1
+        self.timer[expired] = np.clip(self.base_timer + self.wait_increment * waiting[expired],
+                                      self.min_timer, self.max_timer)
+        lights = np.flatnonzero(expired[self.light_group])
+        self.signals.set_phase(lights, self.phase[self.light_group[lights]])
@@ -0,0 +1,189 @@
+# signaltuning.py
+# Headless search for the traffic light timing that gets the most cars through a map.
+#   python signaltuning.py public/2024_base.txt --candidates 32 --steps 1000 --workers 4
+#   python signaltuning.py public/2022_base.txt --groups intersection --seeds 0 1 2 -o best.json
+import argparse
+import hashlib
+import json
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmark import DEFAULT_DICT, build_model, run_steps
+from tripstats import STATS_VERSION
+
+# The timing SignalController uses when the model gets no signal_timing
+DEFAULT_TIMING = {"base_timer": 10, "min_timer": 5, "max_timer": 20, "wait_increment": 2}
+DEFAULT_CACHE = ".signaltuning_cache.json"
+
+
+def file_digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def run_key(settings, timing, seed, steps):
+    """Hash of everything that decides the result of one simulation run"""
+    blob = json.dumps({"settings": settings, "timing": timing, "seed": seed, "steps": steps}, sort_keys=True)
+    return hashlib.sha1(blob.encode()).hexdigest()
+
+
+def load_cache(path):
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+
+def save_cache(path, cache):
+    if path:
+        with open(path, 'w') as f:
+            json.dump(cache, f)
+
+
+def simulate(map_file, map_dict, model_kwargs, timing, seed, steps):
+    """Run one seeded simulation and return its cars finished and mean wait per stop"""
+    model = build_model(map_file, map_dict, seed=seed, signal_timing=timing, **model_kwargs)
+    try:
+        run_steps(model, steps)
+    finally:
+        model.close()
+    return {"finished": model.cars_created - model.active_car_count(),
+            "mean_wait": model.stats.wait.mean}
+
+
+def score(result):
+    """Sort key of a result: more cars finished first, then the shorter mean wait"""
+    return (-result["finished"], result["mean_wait"])
+
+
+def sample_timing(rng, group_count):
+    """Random timing within the ranges the search explores"""
+    min_timer = rng.randint(2, 10)
+    max_timer = rng.randint(max(min_timer, 10), 40)
+    base_timer = rng.randint(min_timer, max_timer)
+    return {"base_timer": base_timer, "min_timer": min_timer, "max_timer": max_timer,
+            "wait_increment": rng.randint(0, 4),
+            "offsets": [rng.randint(0, base_timer) for _ in range(group_count)]}
+
+
+class TimingSearch:
+    """Successive halving over random signal timings on one map.
+
+    Every candidate runs for a short horizon first. Only the best 1/keep
+    of them go on to a horizon keep times longer, until the survivors run
+    for the full number of steps. Each (timing, seed, steps) run is a task
+    for the process pool and its result is cached under the hash of the
+    map, the model settings and the run, so repeated or resumed searches
+    skip the runs they already did.
+    """
+    def __init__(self, map_file, map_dict=DEFAULT_DICT, seeds=(0,), workers=0, cache_path=DEFAULT_CACHE,
+                 **model_kwargs):
+        self.map_file = map_file
+        self.map_dict = map_dict
+        self.seeds = list(seeds)
+        self.workers = workers
+        self.cache_path = cache_path
+        self.model_kwargs = {"static_layers": True, **model_kwargs}
+        self.settings = {"map": file_digest(map_file), "dict": file_digest(map_dict), "stats": STATS_VERSION,
+                         **self.model_kwargs}
+        self.cache = load_cache(cache_path)
+
+        model = build_model(map_file, map_dict, **self.model_kwargs)
+        self.group_count = model.signal_controller.group_count
+        model.close()
+
+    def baseline(self):
+        return {**DEFAULT_TIMING, "offsets": [0] * self.group_count}
+
+    def evaluate(self, timings, steps, executor=None):
+        """Mean result over the seeds of every timing, running only the uncached runs"""
+        jobs = {}
+        for timing in timings:
+            for seed in self.seeds:
+                key = run_key(self.settings, timing, seed, steps)
+                if key not in self.cache:
+                    jobs[key] = (self.map_file, self.map_dict, self.model_kwargs, timing, seed, steps)
+
+        if executor:
+            futures = {key: executor.submit(simulate, *job) for key, job in jobs.items()}
+            for key, future in futures.items():
+                self.cache[key] = future.result()
+        else:
+            for key, job in jobs.items():
+                self.cache[key] = simulate(*job)
+        if jobs:
+            save_cache(self.cache_path, self.cache)
+
+        results = []
+        for timing in timings:
+            runs = [self.cache[run_key(self.settings, timing, seed, steps)] for seed in self.seeds]
+            results.append({"finished": sum(run["finished"] for run in runs) / len(runs),
+                            "mean_wait": sum(run["mean_wait"] for run in runs) / len(runs)})
+        return results, len(jobs)
+
+    def run(self, candidates, steps, rounds=3, keep=2, seed=0, verbose=True):
+        """Search candidates timings, the defaults among them, and return (timing, result) of the best"""
+        rng = random.Random(seed)
+        timings = [self.baseline()] + [sample_timing(rng, self.group_count) for _ in range(candidates - 1)]
+        alive = list(range(len(timings)))
+
+        executor = ProcessPoolExecutor(max_workers=self.workers) if self.workers else None
+        try:
+            for round_number in range(rounds):
+                horizon = max(1, steps // keep ** (rounds - 1 - round_number))
+                results, ran = self.evaluate([timings[i] for i in alive], horizon, executor)
+                ranked = sorted(zip(alive, results), key=lambda item: score(item[1]))
+                if verbose:
+                    report_round(round_number, horizon, ranked, ran, len(alive) * len(self.seeds))
+                if round_number < rounds - 1:
+                    # Candidates that fell behind on the short horizon stop here
+                    alive = [i for i, _ in ranked[:max(1, len(ranked) // keep)]]
+        finally:
+            if executor:
+                executor.shutdown()
+
+        best, result = ranked[0]
+        return timings[best], result
+
+
+def report_round(round_number, horizon, ranked, ran, runs, rows=5):
+    print(f"round {round_number}: {len(ranked)} candidates x {horizon} steps, {ran}/{runs} runs simulated")
+    print(f"{'cand':>6}{'finished':>10}{'wait':>8}")
+    for index, result in ranked[:rows]:
+        print(f"{index:>6}{result['finished']:>10.1f}{result['mean_wait']:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search traffic light timings on a map")
+    parser.add_argument("map_file")
+    parser.add_argument("--map-dict", default=DEFAULT_DICT)
+    parser.add_argument("--candidates", type=int, default=16, help="timings to try, the defaults included")
+    parser.add_argument("--steps", type=int, default=1000, help="steps the finalists run")
+    parser.add_argument("--rounds", type=int, default=3, help="halving rounds, each one keep times longer")
+    parser.add_argument("--keep", type=int, default=2, help="1/keep of the candidates survive each round")
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0], help="simulation seeds averaged per run")
+    parser.add_argument("--workers", type=int, default=0, help="simulation processes, 0 runs them here")
+    parser.add_argument("--groups", default="map", choices=["map", "intersection"])
+    parser.add_argument("--approach-length", type=int, default=3)
+    parser.add_argument("--engine", default="agents", choices=["agents", "vector"])
+    parser.add_argument("--search-seed", type=int, default=0, help="seed of the candidate sampling")
+    parser.add_argument("--cache", default=DEFAULT_CACHE, help="result cache file, '' to disable")
+    parser.add_argument("-o", "--output", help="write the best timing and its result as JSON")
+    args = parser.parse_args()
+
+    search = TimingSearch(args.map_file, args.map_dict, args.seeds, args.workers, args.cache or None,
+                          signal_groups=args.groups, approach_length=args.approach_length, engine=args.engine)
+    timing, result = search.run(args.candidates, args.steps, args.rounds, args.keep, args.search_seed)
+    baseline, _ = search.evaluate([search.baseline()], args.steps)
+
+    print(f"default: finished {baseline[0]['finished']:.1f}, mean wait {baseline[0]['mean_wait']:.2f}")
+    print(f"best:    finished {result['finished']:.1f}, mean wait {result['mean_wait']:.2f}")
+    print(json.dumps(timing))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"signal_groups": args.groups, "signal_timing": timing, **result}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
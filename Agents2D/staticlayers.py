@@ -0,0 +1,75 @@
+# staticlayers.py
+import numpy as np
+from roadgraph import CHAR_DIRECTIONS, SIGNAL_CHARS, DIRECTION_BITS
+
+
+class StaticLayers:
+    """Compact array layers for everything on the map that never moves.
+
+    Every layer is indexed as [x, y] like the Mesa grid: ``road_mask`` holds
+    the road direction bits, and ``signal_mask``, ``building_mask`` and
+    ``destination_mask`` flag the corresponding cells.
+    """
+    def __init__(self, road_mask, signal_mask, building_mask, destination_mask,
+                 road_cell_count=None):
+        self.width, self.height = road_mask.shape
+        self.road_mask = road_mask
+        self.signal_mask = signal_mask
+        self.building_mask = building_mask
+        self.destination_mask = destination_mask
+
+        for array in (road_mask, signal_mask, building_mask, destination_mask):
+            array.flags.writeable = False
+
+        # Cells with a single road direction, the same ones kept in road_cells
+        if road_cell_count is None:
+            road_cell_count = int(np.count_nonzero((road_mask != 0) & ~signal_mask))
+        self.road_cell_count = road_cell_count
+
+    @classmethod
+    def from_map_data(cls, map_data):
+        """Build the layers from map rows already indexed as map_data[y][x]"""
+        width = len(map_data[0])
+        chars = np.array([list(row[:width]) for row in map_data], dtype='U1').T
+
+        road_mask = np.zeros(chars.shape, dtype=np.uint8)
+        for char, bits in CHAR_DIRECTIONS.items():
+            road_mask[chars == char] = bits
+
+        signal_mask = np.isin(chars, SIGNAL_CHARS)
+        building_mask = chars == '#'
+        destination_mask = chars == 'D'
+
+        return cls(road_mask, signal_mask, building_mask, destination_mask)
+
+    @staticmethod
+    def positions(mask):
+        """(x, y) positions set in a mask, in the same row order as the map scan"""
+        ys, xs = np.nonzero(mask.T)
+        return list(zip(xs.tolist(), ys.tolist()))
+
+    def edge_mask(self):
+        """Mask of the cells on the border of the map"""
+        edges = np.zeros((self.width, self.height), dtype=bool)
+        edges[[0, -1], :] = True
+        edges[:, [0, -1]] = True
+        return edges
+
+    def iter_cells(self):
+        """Yield (unique_id, kind, (x, y), direction) for every static cell.
+
+        This is the compatibility view of the RoadAgent, BuildingAgent and
+        DestinationAgent objects the agent mode places in the grid; signal
+        cells yield one road per direction, just like those agents.
+        """
+        for x, y in self.positions(self.road_mask != 0):
+            mask = self.road_mask[x, y]
+            for direction, bit in DIRECTION_BITS.items():
+                if mask & bit:
+                    yield f"road_{x}_{y}_{direction}", "road", (x, y), direction
+
+        for x, y in self.positions(self.building_mask):
+            yield f"building_{x}_{y}", "building", (x, y), None
+
+        for x, y in self.positions(self.destination_mask):
+            yield f"dest_{x}_{y}", "destination", (x, y), None
@@ -0,0 +1,14 @@
+# conftest.py
+import os
+import sys
+
+import pytest
+
+AGENTS2D = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, AGENTS2D)
+
+
+@pytest.fixture(autouse=True)
+def in_agents2d(monkeypatch):
+    """Run every test from Agents2D, where the map paths start"""
+    monkeypatch.chdir(AGENTS2D)
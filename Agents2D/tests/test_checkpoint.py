@@ -0,0 +1,36 @@
+# test_checkpoint.py
+import pytest
+
+from benchmark import build_model
+from checkpoint import fork, load_checkpoint, save_checkpoint
+
+
+def state(model):
+    """Everything a restored model has to carry on from"""
+    cars = model.vector_cars
+    if cars:
+        alive = cars.cars()
+        fleet = [getattr(cars, name)[alive].tolist() for name in ("number", "pos", "waiting", "direction", "dest")]
+    else:
+        fleet = [(car.number, car.pos, car.waiting_time, car.destination, car.current_direction)
+                 for car in model.active_cars.values()]
+    return (model.step_count, model.cars_created, model.cars_moved, model.failed_moves, model.replans,
+            model.stats.state(), fleet, [agent.unique_id for agent in model.schedule], model.occupancy.tobytes(),
+            model.queues.counts.tobytes(), model.signals.blocked.tobytes(), model.signal_controller.timer.tobytes(),
+            model.random.getstate())
+
+
+@pytest.mark.parametrize("engine", ["agents", "vector"])
+def test_restored_models_run_in_lockstep(engine):
+    model = build_model("public/2024_base.txt", seed=1, engine=engine)
+    model.advance(150)
+    restored = load_checkpoint(save_checkpoint(model))
+    forked = fork(model)
+    assert state(restored) == state(forked) == state(model)
+
+    for step in range(100):
+        model.step()
+        expected = state(model)
+        for copy in (restored, forked):
+            copy.step()
+            assert state(copy) == expected, f"step {step}"
@@ -0,0 +1,44 @@
+# test_dstarlite.py
+import random
+
+import numpy as np
+import pytest
+
+from benchmark import build_model
+from dstarlite import DStarLite
+
+
+def assert_legal(planner, path):
+    """Every move of path is a legal one into a free cell, the last into the goal"""
+    pos = planner.start
+    for next_pos in path:
+        assert next_pos in planner.successors(pos) and next_pos not in planner.blocked
+        pos = next_pos
+    assert pos == planner.goal
+
+
+@pytest.mark.parametrize("map_file", ["public/2021_base.txt", "public/2024_base.txt"])
+def test_repairs_match_fresh_searches(map_file):
+    model = build_model(map_file, seed=0)
+    graph, kernel = model.road_graph, model.search_kernel
+    roads = [(int(x), int(y)) for x, y in zip(*np.nonzero(graph.road_mask))]
+    # A horizon over the whole map, so a boxed in start is only ever an unreachable goal
+    horizon = max(graph.width, graph.height)
+    rng = random.Random(0)
+
+    for _ in range(20):
+        start, goal = rng.choice(roads), rng.choice(model.available_destinations)
+        planner = DStarLite(graph, start, goal, set(rng.sample(roads, len(roads) // 10)) - {start})
+        for _ in range(15):
+            path = planner.plan(horizon)
+            fresh = kernel.route(planner.start, goal, {kernel.cell_id(pos) for pos in planner.blocked})
+            assert (path is None) == (fresh is None)
+            if path is not None:
+                assert len(path) == len(fresh)
+                assert_legal(planner, path)
+                # Drive part of the way before the map changes, never into the goal
+                planner.move_start(([planner.start] + path)[rng.randrange(len(path))])
+
+            blocked = set(rng.sample(roads, 8)) - {planner.start}
+            freed = rng.sample(sorted(planner.blocked), min(8, len(planner.blocked)))
+            planner.update_cells(blocked, freed)
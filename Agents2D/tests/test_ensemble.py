@@ -0,0 +1,22 @@
+# test_ensemble.py
+from benchmark import DEFAULT_DICT
+from ensemble import Ensemble, read_results, simulate
+
+MAP = "public/2021_base.txt"
+COUNTERS = ("moved", "searches", "expanded", "replans", "failed_moves")
+
+
+def test_records_carry_the_counters(tmp_path):
+    output = str(tmp_path / "runs.jsonl")
+    records = Ensemble([MAP], [0, 1], 100, output=output, profile=True).run(verbose=False)
+    assert [record["seed"] for record in records] == [0, 1]
+    for record in records:
+        assert all(record[name] > 0 for name in COUNTERS)
+        assert list(record["profile"]["phases"]) == ["spawn", "routes", "signals", "cars"]
+        again = simulate(MAP, DEFAULT_DICT, record["params"], record["seed"], 100)
+        assert "profile" not in again
+        assert [again[name] for name in COUNTERS] == [record[name] for name in COUNTERS]
+
+    # Started again on the same file every run is already there
+    assert Ensemble([MAP], [0, 1], 100, output=output).run(verbose=False) == records
+    assert len(read_results(output)) == 2
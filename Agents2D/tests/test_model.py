@@ -0,0 +1,20 @@
+# test_model.py
+import pytest
+
+from benchmark import build_model
+
+
+@pytest.mark.parametrize("model_kwargs", [{"routing": "A*"}, {"engine": "vectorized"},
+                                          {"engine": "vector", "routing": "fields"}])
+def test_unknown_options_are_rejected(model_kwargs):
+    with pytest.raises(ValueError):
+        build_model("public/2021_base.txt", **model_kwargs)
+
+
+@pytest.mark.parametrize("routing", ["astar", "fields", "dstar"])
+def test_replans_leave_out_the_next_hops(routing):
+    model = build_model("public/2024_base.txt", seed=1, static_layers=True, routing=routing)
+    model.spawn_frequency = 3
+    model.advance(300)
+    # Every hop of routing="fields" is a move, not a replan
+    assert 0 < model.replans < model.cars_moved / 4
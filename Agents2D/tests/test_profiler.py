@@ -0,0 +1,52 @@
+# test_profiler.py
+import os
+
+import pytest
+
+from benchmark import build_model
+from profiler import StepProfiler, format_report
+
+
+def profiled(map_file="public/2022_base.txt", spawn_frequency=3, steps=150, **model_kwargs):
+    model = build_model(map_file, seed=3, static_layers=True, **model_kwargs)
+    model.spawn_frequency = spawn_frequency
+    model.profiler = StepProfiler(model)
+    try:
+        model.advance(steps)
+    finally:
+        model.close()
+    return model, model.profiler.report()
+
+
+def test_counters_are_the_same_however_the_cars_step():
+    vector = profiled(engine="vector")[1]
+    assert vector["steps"] == 150
+    assert all(count > 0 for count in vector["counters"].values())
+    assert profiled(engine="vector", tiles=2)[1]["counters"] == vector["counters"]
+
+
+@pytest.mark.parametrize("engine", ["agents", "vector"])
+def test_counters_are_the_same_with_skipped_steps(engine):
+    # Rare spawns leave long stretches in which every car waits, as in test_timeskip
+    scenario = {"map_file": "public/2021_base.txt", "spawn_frequency": 200, "steps": 600, "engine": engine}
+    stepped = profiled(**scenario)[1]
+    skipping, event_driven = profiled(event_driven=True, **scenario)
+    assert skipping.time_skipper.steps_skipped > 0
+    assert event_driven["steps"] == 600
+    assert stepped["counters"]["failed_moves"] > 0
+    assert event_driven["counters"] == stepped["counters"]
+
+
+def test_report_of_the_phases(tmp_path):
+    path = str(tmp_path / "steps.prof")
+    model = build_model("public/2021_base.txt", seed=1)
+    model.profiler = StepProfiler(model, cprofile_steps=10, cprofile_path=path)
+    model.advance(30)
+    report = model.profiler.report()
+
+    assert list(report["phases"]) == ["spawn", "routes", "signals", "cars"]
+    assert abs(sum(phase["share"] for phase in report["phases"].values()) - 1) < 0.01
+    assert report["counters"]["cars_moved"] == model.cars_moved
+    assert report["cprofile"] == {"steps": 10, "of": 10, "path": path}
+    assert os.path.exists(path) and "step" in model.profiler.cprofile_text()
+    assert "ms/step" in format_report(report)
@@ -0,0 +1,33 @@
+# test_searchkernel.py
+import random
+
+import pytest
+
+from benchmark import build_model, dict_astar, populate
+
+
+@pytest.mark.parametrize("map_file", ["public/2021_base.txt", "public/2022_base.txt", "public/2024_base.txt"])
+def test_routes_cost_the_same_as_the_dict_astar(map_file):
+    model = build_model(map_file, seed=0, static_layers=True)
+    # Cars and red lights on the way, which both searches must go around
+    populate(model, 10)
+    model.spawn_frequency = 10 ** 6
+    model.advance(15)
+
+    lanes = model.layers.positions((model.layers.road_mask != 0) & ~model.layers.signal_mask)
+    rng = random.Random(0)
+    trips = [(origin, rng.choice(model.available_destinations))
+             for origin in rng.sample([pos for pos in lanes if not model.is_occupied(pos)], 60)]
+    landmarks = model.compiled_map.get_landmarks(8)
+    for model.landmarks in (None, landmarks):
+        routed = 0
+        for origin, destination in trips:
+            car = model.spawn_car(origin)
+            car.destination = destination
+            reference, path = dict_astar(car), car.find_path_astar()
+            assert (path is None) == (reference is None), (origin, destination)
+            if path is not None:
+                assert len(path) == len(reference), (origin, destination)
+                routed += 1
+            model.remove_agent(car)
+        assert routed > len(trips) // 3
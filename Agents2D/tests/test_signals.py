@@ -0,0 +1,26 @@
+# test_signals.py
+import numpy as np
+import pytest
+
+from benchmark import build_model, populate
+
+
+@pytest.mark.parametrize("model_kwargs", [{"engine": "agents"}, {"engine": "vector"},
+                                          {"engine": "vector", "tiles": 2}])
+def test_queue_counters_match_a_recount(model_kwargs):
+    model = build_model("public/2024_base.txt", seed=1, static_layers=True, signal_groups="intersection",
+                        **model_kwargs)
+    populate(model, 100)
+    model.spawn_frequency = 2
+    queues = model.queues
+    try:
+        waiting = 0
+        for step in range(200):
+            model.step()
+            occupied = queues.cells[model.occupancy.ravel()[queues.cells] != -1]
+            recount = np.bincount(queues.approach_ids[occupied], minlength=queues.counts.size)
+            assert queues.counts.tolist() == recount.tolist(), f"step {step}"
+            waiting += int(recount.sum())
+    finally:
+        model.close()
+    assert waiting > 0
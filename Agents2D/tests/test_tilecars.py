@@ -0,0 +1,35 @@
+# test_tilecars.py
+import pytest
+
+from benchmark import build_model, populate
+
+
+def state(model):
+    """The cars, cells, lights and stats a step leaves behind"""
+    cars = model.vector_cars
+    alive = cars.cars()
+    return ([getattr(cars, name)[alive].tolist() for name in ("number", "pos", "waiting", "direction", "dest")],
+            model.occupancy.tobytes(), model.queues.counts.tobytes(), model.signals.blocked.tobytes(),
+            model.cars_created, model.cars_moved, model.stats.state(), cars.free_slots[-5:], model.random.getstate())
+
+
+def run(tiles, steps=60):
+    model = build_model("public/2024_base.txt", seed=3, engine="vector", static_layers=True, tiles=tiles)
+    model.spawn_frequency = 3
+    try:
+        # Cars all over the map, so plenty of them cross between tiles
+        populate(model, 150)
+        states = []
+        for _ in range(steps):
+            model.step()
+            states.append(state(model))
+        return states
+    finally:
+        model.close()
+
+
+@pytest.mark.parametrize("tiles", [1, 3])
+def test_tiles_match_in_process_cars(tiles):
+    expected = run(0)
+    for step, (tiled, single) in enumerate(zip(run(tiles), expected)):
+        assert tiled == single, f"step {step}"
@@ -0,0 +1,103 @@
+# test_timeskip.py
+import random
+
+import numpy as np
+import pytest
+
+from benchmark import build_model
+from signals import MOVE_BITS
+
+MAP = "public/2021_base.txt"
+CHUNKS = [1, 7, 13, 50] * 12
+
+
+def state(model):
+    """Everything a skipped step could leave different from a stepped one"""
+    cars = model.vector_cars
+    if cars:
+        alive = cars.cars()
+        fleet = [getattr(cars, name)[alive].tolist() for name in ("number", "pos", "waiting", "direction", "dest")]
+    else:
+        fleet = [(car.number, car.pos, car.waiting_time, car.destination, car.current_direction)
+                 for car in model.active_cars.values()]
+    return (model.step_count, model.cars_created, model.cars_moved, model.failed_moves, model.replans,
+            model.stats.state(), fleet,
+            [agent.unique_id for agent in model.schedule], model.occupancy.tobytes(),
+            model.signals.blocked.tobytes(), model.signal_controller.timer.tobytes(),
+            model.random.getstate(), random.getstate())
+
+
+def build(engine, **model_kwargs):
+    model = build_model(MAP, seed=3, engine=engine, **model_kwargs)
+    # Rare spawns leave long stretches in which every car waits at a light
+    model.spawn_frequency = 200
+    return model
+
+
+def held_at_lights(**model_kwargs):
+    """A model whose cars all wait at lights that turned red after they planned to cross them"""
+    model = build_model(MAP, seed=0, **model_kwargs)
+    model.spawn_frequency = 10 ** 6
+    model.advance(120)
+    signals = model.signals
+
+    def stopped(car):
+        return signals.stops(car.pos, model.search_kernel.position(car.path[car.path_cursor]))
+
+    cars = []
+    for light in zip(*np.nonzero(signals.light_at >= 0)):
+        light = (int(light[0]), int(light[1]))
+        for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1)):
+            pos = (light[0] - dx, light[1] - dy)
+            if (not (0 <= pos[0] < model.width and 0 <= pos[1] < model.height) or not model.layers.road_mask[pos]
+                    or model.is_occupied(pos) or signals.is_red(light)
+                    or not (signals.phase_blocked[:, signals.light_at[light]] & MOVE_BITS[(dx, dy)]).any()):
+                continue
+            car = model.spawn_car(pos)
+            if car.has_path() and model.search_kernel.position(car.path[car.path_cursor]) == light:
+                cars.append(car)
+                break
+            model.remove_agent(car)
+
+    # Run the lights on until at least two of the cars face a red one and drop the others
+    for _ in range(100):
+        if sum(stopped(car) for car in cars) >= 2:
+            break
+        model.signal_controller.step()
+    for car in cars:
+        if not stopped(car):
+            model.remove_agent(car)
+    return model
+
+
+@pytest.mark.parametrize("engine", ["agents", "vector"])
+def test_skipping_matches_stepping(engine):
+    stepped = build(engine)
+    expected = []
+    for steps in CHUNKS:
+        for _ in range(steps):
+            stepped.step()
+        expected.append(state(stepped))
+
+    skipping = build(engine, event_driven=True)
+    for done, (steps, step_state) in enumerate(zip(CHUNKS, expected)):
+        skipping.advance(steps)
+        assert state(skipping) == step_state, f"chunk {done}"
+    assert skipping.time_skipper.steps_skipped > 100
+
+
+def test_skipping_replays_the_schedule_shuffles():
+    chunks = [1, 7, 13, 39]
+    stepped = held_at_lights()
+    expected = []
+    for steps in chunks:
+        for _ in range(steps):
+            stepped.step()
+        expected.append(state(stepped))
+
+    skipping = held_at_lights(event_driven=True)
+    assert len(skipping.schedule) >= 2
+    for done, (steps, step_state) in enumerate(zip(chunks, expected)):
+        skipping.advance(steps)
+        assert state(skipping) == step_state, f"chunk {done}"
+    assert skipping.time_skipper.steps_skipped > 0
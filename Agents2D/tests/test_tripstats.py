@@ -0,0 +1,82 @@
+# test_tripstats.py
+import math
+
+import numpy as np
+import pytest
+
+from benchmark import build_model
+from tripstats import SampleStats
+
+
+def assert_matches(stats, samples):
+    """stats holds the exact sums of samples, and their quantiles within its accuracy"""
+    samples = np.sort(np.asarray(samples, dtype=np.int64))
+    assert (stats.count, stats.total, stats.squares) == (samples.size, int(samples.sum()),
+                                                         int((samples * samples).sum()))
+    if not samples.size:
+        return
+    assert (stats.minimum, stats.maximum) == (int(samples[0]), int(samples[-1]))
+    for q in (0.01, 0.1, 0.5, 0.9, 0.99):
+        exact = int(samples[math.floor(q * (samples.size - 1))])
+        assert abs(stats.quantile(q) - exact) <= stats.accuracy * exact + 1e-9, q
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_sample_stats_in_any_order(seed):
+    rng = np.random.default_rng(seed)
+    samples = np.floor(rng.lognormal(2, 1.5, size=5000)).astype(np.int64)
+    whole = SampleStats()
+    whole.add(samples)
+    assert_matches(whole, samples)
+
+    merged = SampleStats()
+    parts = np.array_split(samples, 7)
+    for index in rng.permutation(len(parts)):
+        stats = SampleStats()
+        stats.add(parts[index])
+        merged.merge(stats)
+    assert merged.state() == whole.state()
+
+
+def trips_by_hand(model, steps):
+    """(stops, trip times, stops per trip) of steps steps, worked out from where the cars are after each one"""
+    spawned = {}
+    spawn_car = model.spawn_car
+
+    def spawn(pos):
+        spawned[model.cars_created] = (model.step_count, pos)
+        return spawn_car(pos)
+
+    model.spawn_car = spawn
+    # number -> [step of the last move, position, stops, spawn step]
+    cars = {}
+    waits, trips, stops = [], [], []
+    for _ in range(steps):
+        model.step()
+        step = model.step_count
+        now = {int(unique_id.split("_")[1]): pos for unique_id, pos, _ in model.iter_cars()}
+        for number, (spawn_step, pos) in spawned.items():
+            cars[number] = [spawn_step, pos, 0, spawn_step]
+        spawned.clear()
+        for number, car in list(cars.items()):
+            if number not in now:
+                trips.append(car[0] - car[3])
+                stops.append(car[2])
+                del cars[number]
+            elif now[number] != car[1]:
+                if step - car[0] > 1:
+                    waits.append(step - car[0] - 1)
+                    car[2] += 1
+                car[0], car[1] = step, now[number]
+    return waits, trips, stops
+
+
+@pytest.mark.parametrize("engine", ["agents", "vector"])
+def test_model_stats_match_the_cars(engine):
+    model = build_model("public/2021_base.txt", seed=5, engine=engine)
+    model.spawn_frequency = 3
+    waits, trips, stops = trips_by_hand(model, 300)
+    assert len(trips) > 50 and waits
+    assert_matches(model.stats.wait, waits)
+    assert_matches(model.stats.trip_time, trips)
+    assert_matches(model.stats.stops, stops)
@@ -0,0 +1,55 @@
+# test_vectorcars.py
+import numpy as np
+import pytest
+
+from benchmark import build_model, populate
+from roadgraph import DIRECTION_DELTAS
+
+BITS = {delta: bit for bit, delta in DIRECTION_DELTAS.items()}
+
+
+def fleet(cars):
+    """{number: (cell, destination cell)} of every car on the map"""
+    alive = cars.cars()
+    return {number: (pos, dest) for number, pos, dest in
+            zip(cars.number[alive].tolist(), cars.pos[alive].tolist(), cars.dest[alive].tolist())}
+
+
+@pytest.mark.parametrize("map_file", ["public/2021_base.txt", "public/2024_base.txt"])
+def test_every_step_keeps_the_rules(map_file):
+    model = build_model(map_file, seed=2, engine="vector", static_layers=True)
+    populate(model, 120)
+    model.spawn_frequency = 2
+    cars, height = model.vector_cars, model.height
+    moves = np.asarray(model.road_graph.moves).ravel()
+    road = np.asarray(model.road_graph.road_mask).ravel() != 0
+
+    moved = 0
+    before = fleet(cars)
+    for step in range(300):
+        model.step()
+        after = fleet(cars)
+        # The lights switch before the cars move, so these are the ones the moves saw
+        blocked = model.signals.blocked.ravel()
+
+        # One car per road cell, and the occupancy array agrees; cars may share their destination
+        on_road = [pos for pos, dest in after.values() if pos != dest]
+        assert len(on_road) == len(set(on_road)), f"step {step}"
+        assert all(road[pos] for pos in on_road)
+        occupancy = model.occupancy.ravel()
+        assert sorted(occupancy[occupancy != -1].tolist()) == sorted(
+            number for number, (pos, dest) in after.items() if pos != dest or occupancy[pos] == number)
+
+        for number, (pos, dest) in after.items():
+            if number not in before or before[number][0] == pos:
+                continue
+            start = before[number][0]
+            bit = BITS[(pos // height - start // height, pos % height - start % height)]
+            # A legal move of the road graph, or into the destination from any adjacent cell
+            assert pos == dest or moves[start] & bit, f"step {step}, car {number}"
+            # and never across a red light along its orientation
+            assert not blocked[pos] & bit, f"step {step}, car {number}"
+            moved += 1
+        before = after
+
+    assert moved > 1000 and model.failed_moves > 0
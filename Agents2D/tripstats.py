@@ -0,0 +1,154 @@
+# tripstats.py
+import math
+
+import numpy as np
+
+# Part of the keys of cached results (signaltuning.py, ensemble.py), bump when a statistic changes meaning
+STATS_VERSION = 1
+
+
+class SampleStats:
+    """Count, mean, variance and quantiles of a stream of whole numbers, in bounded memory.
+
+    The mean and variance come from exact integer sums, so adding or merging
+    samples in any order gives the same result. Quantiles come from a log
+    bucketed sketch (DDSketch): a value v > 0 counts in bucket
+    ceil(log_gamma(v)) with gamma = (1 + accuracy) / (1 - accuracy), so a
+    quantile is off by at most accuracy relative to the true value and the
+    buckets grow with the log of the largest sample, not with their count.
+    A bucket narrow enough to hold a single whole number gives it exactly,
+    which covers every value below about 1 / (2 * accuracy).
+    """
+    def __init__(self, accuracy=0.01):
+        self.accuracy = accuracy
+        self.log_gamma = math.log((1 + accuracy) / (1 - accuracy))
+        self.count = 0
+        self.total = 0
+        self.squares = 0
+        self.minimum = None
+        self.maximum = None
+        self.zeros = 0
+        # Samples per bucket index
+        self.buckets = {}
+
+    def add(self, values):
+        """Add a sequence of whole numbers >= 0"""
+        values = np.asarray(values, dtype=np.int64)
+        if not values.size:
+            return
+        self.count += int(values.size)
+        self.total += int(values.sum())
+        self.squares += int((values * values).sum())
+        low, high = int(values.min()), int(values.max())
+        self.minimum = low if self.minimum is None else min(self.minimum, low)
+        self.maximum = high if self.maximum is None else max(self.maximum, high)
+
+        positive = values[values > 0]
+        self.zeros += int(values.size - positive.size)
+        indexes, counts = np.unique(np.ceil(np.log(positive) / self.log_gamma).astype(np.int64), return_counts=True)
+        for index, count in zip(indexes.tolist(), counts.tolist()):
+            self.buckets[index] = self.buckets.get(index, 0) + count
+
+    def merge(self, other):
+        """Add every sample of other, a SampleStats with the same accuracy"""
+        self.count += other.count
+        self.total += other.total
+        self.squares += other.squares
+        for name, pick in (("minimum", min), ("maximum", max)):
+            values = [value for value in (getattr(self, name), getattr(other, name)) if value is not None]
+            setattr(self, name, pick(values) if values else None)
+        self.zeros += other.zeros
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    @property
+    def variance(self):
+        """Sample variance, 0 with fewer than two samples"""
+        if self.count < 2:
+            return 0.0
+        return (self.squares - self.total * self.total / self.count) / (self.count - 1)
+
+    def quantile(self, q):
+        """Approximate q-quantile, 0 <= q <= 1, of the samples so far"""
+        if not self.count:
+            return 0.0
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if seen > rank:
+            return 0.0
+        gamma = math.exp(self.log_gamma)
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                low, high = math.floor(gamma ** (index - 1)) + 1, math.floor(gamma ** index)
+                if low == high:
+                    return float(low)
+                # The middle of the bucket (gamma^(i-1), gamma^i] in relative terms
+                value = 2 * gamma ** index / (gamma + 1)
+                return min(max(value, self.minimum), self.maximum)
+        return float(self.maximum)
+
+    def summary(self, quantiles=(0.5, 0.9, 0.99)):
+        """JSON ready dict of count, mean, standard deviation, min, max and quantiles"""
+        summary = {"count": self.count, "mean": round(self.mean, 3), "std": round(math.sqrt(self.variance), 3),
+                   "min": self.minimum, "max": self.maximum}
+        for q in quantiles:
+            summary[f"p{round(q * 100):g}"] = round(self.quantile(q), 2)
+        return summary
+
+    def state(self):
+        """JSON ready dict that set_state restores"""
+        return {"accuracy": self.accuracy, "count": self.count, "total": self.total, "squares": self.squares,
+                "minimum": self.minimum, "maximum": self.maximum, "zeros": self.zeros,
+                "buckets": [[index, count] for index, count in sorted(self.buckets.items())]}
+
+    def set_state(self, state):
+        self.__init__(state["accuracy"])
+        for name in ("count", "total", "squares", "minimum", "maximum", "zeros"):
+            setattr(self, name, state[name])
+        self.buckets = {index: count for index, count in state["buckets"]}
+
+
+class TripStats:
+    """Streaming statistics of the cars' trips, fed by their moves and arrivals.
+
+    Every car keeps the step it spawned after, the step of its last move
+    and its stops so far. A stop is a run of steps in which the car did not
+    move, and it is counted when the car moves again. When a car arrives
+    its trip time and number of stops are counted. Nothing here looks at
+    the cars that only wait, so the cost of a step follows its moves and
+    arrivals, not the number of cars.
+    """
+    METRICS = ("wait", "trip_time", "stops")
+
+    def __init__(self):
+        # Steps of every stop
+        self.wait = SampleStats()
+        # Steps from spawn to arrival, and stops, of every trip
+        self.trip_time = SampleStats()
+        self.stops = SampleStats()
+
+    def record_stops(self, steps):
+        self.wait.add(steps)
+
+    def record_trips(self, trip_times, stops):
+        self.trip_time.add(trip_times)
+        self.stops.add(stops)
+
+    def merge(self, other):
+        for name in self.METRICS:
+            getattr(self, name).merge(getattr(other, name))
+
+    def summary(self):
+        return {name: getattr(self, name).summary() for name in self.METRICS}
+
+    def state(self):
+        return {name: getattr(self, name).state() for name in self.METRICS}
+
+    def set_state(self, state):
+        for name in self.METRICS:
+            getattr(self, name).set_state(state[name])
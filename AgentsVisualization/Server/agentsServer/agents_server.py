@@ -2,14 +2,37 @@
 # Python flask server to interact with webGL.
 # Octavio Navarro. 2024
 
+import os
+import re
 from flask import Flask, request, jsonify
 from flask_cors import CORS, cross_origin
 from randomAgents.model import TrafficModel
-from randomAgents.agent import CarAgent, TrafficLightAgent, RoadAgent, BuildingAgent, DestinationAgent
+from randomAgents.checkpoint import save_checkpoint, load_checkpoint
+from randomAgents.profiler import StepProfiler
 
 trafficModel = None
 currentStep = 0
 
+# Los mapas compilados se guardan aquí para que los /init siguientes solo los carguen
+MAP_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".mapcache")
+# Los checkpoints de /saveCheckpoint se guardan aquí, uno .npz por nombre
+CHECKPOINT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".checkpoints")
+# Los volcados de cProfile de /debug/profile se guardan aquí, se abren con pstats o snakeviz
+PROFILE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".profiles")
+
+# Parámetros de /init que se pueden cambiar al iniciar desde un checkpoint
+CHECKPOINT_OVERRIDES = {
+    'routeWorkers': ('route_workers', int),
+    'congestionRefresh': ('congestion_refresh', int),
+    'signalTiming': ('signal_timing', dict),
+    'eventDriven': ('event_driven', bool),
+}
+
+def checkpoint_path(name):
+    """Archivo del checkpoint name, sin caracteres que salgan de CHECKPOINT_DIR"""
+    name = re.sub(r'[^A-Za-z0-9_-]', '_', str(name))
+    return os.path.join(CHECKPOINT_DIR, f"{name}.npz")
+
 # This application will be used to interact with WebGL
 app = Flask("Traffic example")
 cors = CORS(app, origins=['http://localhost'])
@@ -19,7 +42,7 @@ cors = CORS(app, origins=['http://localhost'])
 @app.route('/init', methods=['POST'])
 @cross_origin()
 def initModel():
-    global trafficModel
+    global trafficModel, currentStep
 
     if request.method == 'POST':
         try:
@@ -31,8 +54,55 @@ def initModel():
             if not map_file or not map_dict:
                 raise ValueError("Missing mapFile or mapDict in request.")
 
-            # Inicializa el modelo
-            trafficModel = TrafficModel(map_file, map_dict)
+            # Con staticLayers las calles, edificios y destinos no se crean como agentes
+            static_layers = bool(request.json.get('staticLayers', False))
+
+            # "astar" (por defecto), "alt" para A* con landmarks, "fields" para campos de distancia
+            # o "dstar" para replanificación incremental con D* Lite
+            routing = request.json.get('routing', 'astar')
+
+            # Con routeWorkers > 0 las rutas de los carros nuevos se calculan por lotes
+            route_workers = int(request.json.get('routeWorkers', 0))
+
+            # Con congestionRefresh > 0 el A* evita las celdas congestionadas,
+            # midiendo la congestión cada congestionRefresh pasos
+            congestion_refresh = int(request.json.get('congestionRefresh', 0))
+
+            # "agents" (por defecto) o "vector" para mover todos los carros con arreglos de NumPy
+            engine = request.json.get('engine', 'agents')
+
+            # "map" (por defecto) cambia todos los semáforos juntos, "intersection"
+            # le da a cada intersección su propio temporizador
+            signal_groups = request.json.get('signalGroups', 'map')
+
+            # Celdas antes de cada semáforo que cuentan para su fila (3 por defecto)
+            approach_length = int(request.json.get('approachLength', 3))
+
+            # Tiempos de los semáforos, por ejemplo el "signal_timing" que escribe signaltuning.py
+            signal_timing = request.json.get('signalTiming')
+
+            # Con eventDriven, /update?steps=N salta de golpe los pasos en los que ningún carro se mueve
+            event_driven = bool(request.json.get('eventDriven', False))
+
+            # Con tiles > 0 y engine "vector" ese número de procesos mueve los carros, uno por mosaico del mapa
+            tiles = int(request.json.get('tiles', 0))
+
+            # Puntos que guarda cada buffer del historial de /getStats (2048 por defecto)
+            history_capacity = int(request.json.get('historyCapacity', 2048))
+
+            # Inicializa el modelo. Si falla, el anterior sigue abierto y en uso
+            model = TrafficModel(map_file, map_dict, static_layers=static_layers,
+                                 map_cache_dir=MAP_CACHE_DIR, routing=routing,
+                                 route_workers=route_workers,
+                                 congestion_refresh=congestion_refresh, engine=engine,
+                                 signal_groups=signal_groups, approach_length=approach_length,
+                                 signal_timing=signal_timing, event_driven=event_driven, tiles=tiles,
+                                 history_capacity=history_capacity)
+
+            # Libera los procesos de rutas y mosaicos del modelo anterior
+            if trafficModel is not None:
+                trafficModel.close()
+            trafficModel = model
             currentStep = 0
             print(f"Current step reset to: {currentStep}")
 
@@ -50,6 +120,61 @@ def initModel():
 
 
 
+# Guarda el estado dinámico del modelo (carros, rutas, semáforos, random, contadores)
+# en un checkpoint. El mapa no se guarda, se vuelve a leer del caché de mapas.
+@app.route('/saveCheckpoint', methods=['POST'])
+@cross_origin()
+def saveCheckpoint():
+    global trafficModel
+
+    if request.method == 'POST':
+        try:
+            if trafficModel is None:
+                raise ValueError("There is no model to save, call /init first.")
+            name = (request.get_json(silent=True) or {}).get('name') or f"step_{trafficModel.step_count}"
+            data = save_checkpoint(trafficModel)
+
+            os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+            path = checkpoint_path(name)
+            with open(path, 'wb') as f:
+                f.write(data)
+            return jsonify({"message": "Checkpoint saved", "name": os.path.basename(path)[:-4],
+                            "bytes": len(data), "currentStep": currentStep})
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
+# Inicia una sesión nueva desde un checkpoint guardado. Acepta los mismos
+# parámetros que /init en CHECKPOINT_OVERRIDES, para probar variantes desde el mismo estado.
+@app.route('/initFromCheckpoint', methods=['POST'])
+@cross_origin()
+def initFromCheckpoint():
+    global trafficModel, currentStep
+
+    if request.method == 'POST':
+        try:
+            name = request.json.get('name')
+            if not name:
+                raise ValueError("Missing name in request.")
+            path = checkpoint_path(name)
+            if not os.path.exists(path):
+                raise ValueError(f"There is no checkpoint named {name}.")
+
+            overrides = {argument: convert(request.json[key])
+                         for key, (argument, convert) in CHECKPOINT_OVERRIDES.items() if key in request.json}
+            with open(path, 'rb') as f:
+                model = load_checkpoint(f.read(), map_cache_dir=MAP_CACHE_DIR, **overrides)
+
+            # Libera los procesos de rutas y mosaicos del modelo anterior
+            if trafficModel is not None:
+                trafficModel.close()
+            trafficModel = model
+            currentStep = trafficModel.step_count
+
+            return jsonify({"message": "Model restored", "width": trafficModel.width, "height": trafficModel.height,
+                            "currentStep": currentStep})
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
 # This route will be used to get the positions of the agents
 @app.route('/getAgents', methods=['GET'])
 @cross_origin()
@@ -62,17 +187,15 @@ def getAgents():
             agentPositions = []
             lightPositions = []
 
+            # Los carros vienen del modelo, sean agentes o filas del motor vectorial
             agentPositions = [
-                {"id": str(a.unique_id), "x": x, "y":1, "z":z, "orientation": a.orientation}
-                for agents, (x, z) in trafficModel.grid.coord_iter()
-                for a in agents
-                if isinstance(a, CarAgent)
+                {"id": str(unique_id), "x": x, "y":1, "z":z, "orientation": orientation}
+                for unique_id, (x, z), orientation in trafficModel.iter_cars()
             ]
+            # Los estados de los semáforos salen del índice de señales del modelo
             lightPositions = [
-                {"id": str(a.unique_id), "x": x, "y":1, "z":z, "orientation": a.orientation, "state": a.state}
-                for agents, (x, z) in trafficModel.grid.coord_iter()
-                for a in agents
-                if isinstance(a, TrafficLightAgent)
+                {"id": str(unique_id), "x": x, "y":1, "z":z, "orientation": orientation, "state": state}
+                for unique_id, (x, z), orientation, state in trafficModel.iter_lights()
             ]
 
             return jsonify({'agentPositions':agentPositions, 'lightPositions':lightPositions, 'currentStep': currentStep})
@@ -94,14 +217,12 @@ def getEnvironment():
                 'destination': [],
             }
 
-            for agents, (x, z) in trafficModel.grid.coord_iter():
-                for a in agents:  # Iterar sobre cada agente en la celda MULTIGRID
-                    if isinstance(a, RoadAgent):
-                        environmentPosition['road'].append({"id": str(a.unique_id), "x": x, "y":1, "z":z, "direction": a.direction})
-                    elif isinstance(a, BuildingAgent):
-                        environmentPosition['building'].append({"id": str(a.unique_id), "x": x, "y":1, "z":z})
-                    elif isinstance(a, DestinationAgent):
-                        environmentPosition['destination'].append({"id": str(a.unique_id), "x": x, "y":1, "z":z})
+            # Las capas estáticas sirven igual con o sin agentes de calle en el grid
+            for unique_id, kind, (x, z), direction in trafficModel.iter_static_cells():
+                position = {"id": unique_id, "x": x, "y":1, "z":z}
+                if kind == 'road':
+                    position["direction"] = direction
+                environmentPosition[kind].append(position)
                         
             return jsonify({'positions':environmentPosition})
         except Exception as e:
@@ -116,14 +237,20 @@ def updateModel():
     if request.method == 'GET':
         try:
         # Update the model and return a message to WebGL saying that the model was updated successfully
-            trafficModel.step()
-            currentStep += 1
+            # Con ?steps=N avanza N pasos de una vez
+            steps = int(request.args.get('steps', 1))
+            # Sin pasos el modelo no avanza y el contador del cliente se desfasaría
+            if steps < 1:
+                return jsonify({"message": f"steps must be at least 1, not {steps}."}), 400
+            trafficModel.advance(steps)
+            currentStep += steps
             return jsonify({'message':f'Model updated to step {currentStep}.', 'currentStep':currentStep})
         except Exception as e:
             print(e)
             return jsonify({"message":"Error during step."}), 500
 
-# Ruta para obtener estadísticas del modelo
+# Ruta para obtener estadísticas del modelo. Con ?since=N el historial solo trae
+# los pasos después de N, para que cada consulta cueste lo mismo aunque la corrida crezca
 @app.route('/getStats', methods=['GET'])
 @cross_origin()
 def getStats():
@@ -132,10 +259,17 @@ def getStats():
     if request.method == 'GET':
         try:
             # Calcular estadísticas actuales
-            active_cars = len(trafficModel.active_cars)
+            active_cars = trafficModel.active_car_count()
             cars_finished = trafficModel.cars_finished
-            active_cars_history = trafficModel.active_cars_per_step
+            # Pasos y coches activos después de since: exactos los recientes, promedios los más viejos.
+            # Cada punto cubre los pasos desde el anterior; el primero empieza en firstStep, que
+            # queda antes de since + 1 cuando since cae dentro de un promedio
+            since = int(request.args.get('since', 0))
+            history = trafficModel.active_cars_per_step
+            history_steps, active_cars_history = history.points(since)
             traffic_density = trafficModel.get_traffic_density()
+            # Media, desviación, mínimo, máximo y percentiles de las paradas y los viajes terminados
+            trip_stats = trafficModel.stats.summary()
             
             return jsonify({
                 'currentStats': {
@@ -144,14 +278,59 @@ def getStats():
                     'trafficDensity': round(traffic_density, 2),
                     'currentStep': currentStep
                 },
+                'tripStats': {
+                    'waitTime': trip_stats['wait'],
+                    'tripTime': trip_stats['trip_time'],
+                    'stopsPerTrip': trip_stats['stops']
+                },
                 'historicalStats': {
-                    'activeCarsPerStep': active_cars_history
+                    'steps': history_steps,
+                    'activeCarsPerStep': active_cars_history,
+                    'firstStep': history.first_step(since),
+                    'lastStep': len(history)
                 }
             })
         except Exception as e:
             print(e)
             return jsonify({"error": "Error getting statistics"}), 500
 
+# Con POST {"enabled": true} empieza a medir cuánto tarda cada fase de step() y cuánto
+# crecen los contadores (búsquedas A*, nodos expandidos, replanificaciones, movimientos
+# fallidos); con "cprofileSteps": N además corre los siguientes N pasos bajo cProfile.
+# POST {"enabled": false} deja de medir. GET devuelve lo medido desde el último POST.
+@app.route('/debug/profile', methods=['GET', 'POST'])
+@cross_origin()
+def debugProfile():
+    global trafficModel
+
+    try:
+        if trafficModel is None:
+            raise ValueError("There is no model to profile, call /init first.")
+
+        if request.method == 'POST':
+            params = request.get_json(silent=True) or {}
+            if not params.get('enabled', True):
+                trafficModel.profiler = None
+                return jsonify({"message": "Profiler stopped"})
+
+            cprofile_steps = int(params.get('cprofileSteps', 0))
+            cprofile_path = None
+            if cprofile_steps:
+                os.makedirs(PROFILE_DIR, exist_ok=True)
+                cprofile_path = os.path.join(PROFILE_DIR, f"step_{trafficModel.step_count}.prof")
+            trafficModel.profiler = StepProfiler(trafficModel, cprofile_steps, cprofile_path)
+            return jsonify({"message": "Profiler started", "currentStep": currentStep})
+
+        if trafficModel.profiler is None:
+            return jsonify({"enabled": False})
+        report = trafficModel.profiler.report()
+        report["enabled"] = True
+        # Las funciones más costosas que vio cProfile, como las imprime pstats
+        report["cprofileTop"] = trafficModel.profiler.cprofile_text(int(request.args.get('top', 25)))
+        return jsonify(report)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 if __name__=='__main__':
     # Run the flask server in port 8585
     app.run(host="localhost", port=8585, debug=True)
@@ -1,7 +1,8 @@
 from mesa import Agent
+from array import array
 from enum import Enum, auto
-import random
-import heapq
+from .routing import UNREACHABLE
+from .dstarlite import DStarLite
 
 class AgentType(Enum):
     CAR = auto()
@@ -17,17 +18,22 @@ class TrafficAgent(Agent):
         self.agent_type = agent_type
         
 class CarAgent(TrafficAgent):
-    def __init__(self, unique_id, model):
+    def __init__(self, unique_id, model, number):
         super().__init__(unique_id, model, AgentType.CAR)
+        # Marks the car's cell in model.occupancy
+        self.number = number
         self.steps_taken = 0
         self.destination = None
         self.orientation = None
         self.waiting_time = 0
+        # Ids de celda de la ruta, se leen desde path_cursor
         self.path = None
-
-    def heuristic(self, pos1, pos2):
-        """Manhattan distance heuristic for A*"""
-        return abs(pos1[0] - pos2[0]) + abs(pos1[1] - pos2[1])
+        self.path_cursor = 0
+        # Estado de búsqueda de D* Lite que se conserva entre replanificaciones
+        self.planner = None
+        # Datos del viaje para model.stats: el paso tras el que apareció, su último movimiento y sus paradas
+        self.spawn_step = self.last_move = model.step_count
+        self.stops = 0
 
     def get_direction(self, pos, next_pos):
         """
@@ -46,65 +52,95 @@ class CarAgent(TrafficAgent):
             return "left"
         return None
 
-    def get_valid_neighbors(self, pos):
-        """Get valid neighboring positions"""
-        neighbors = []
-        x, y = pos
-        
-        for dx, dy in [(0, 1), (0, -1), (1, 0), (-1, 0)]:
-            next_pos = (x + dx, y + dy)
-            
-            if not (0 <= next_pos[0] < self.model.grid.width and 
-                   0 <= next_pos[1] < self.model.grid.height):
-                continue
-            
-            if self.is_valid_move(pos, next_pos):
-                neighbors.append(next_pos)
-        
-        return neighbors
-
     def find_path_astar(self):
-        """A* pathfinding implementation"""
+        """A* pathfinding on the model's shared search kernel"""
+        if not self.destination:
+            return None
+        kernel = self.model.search_kernel
+        blocked = self.model.blocked_ids([self.pos])
+        return kernel.route_ids(kernel.cell_id(self.pos), kernel.cell_id(self.destination), blocked,
+                                self.model.landmarks, self.model.congestion)
+
+    def plan_route(self):
+        """Compute the path to the destination with the model's routing strategy, as cell ids"""
+        if self.model.routing == "fields":
+            path = self.follow_distance_field()
+        elif self.model.routing == "dstar":
+            path = self.replan_incremental()
+        else:
+            return self.find_path_astar()
+        if path is None:
+            return None
+        cell_id = self.model.search_kernel.cell_id
+        return array('i', [cell_id(pos) for pos in path])
+
+    def set_path(self, path):
+        """Follow path, an array of cell ids or None, from its first cell"""
+        self.path = path
+        self.path_cursor = 0
+
+    def has_path(self):
+        """True while the path has cells left to move to"""
+        return self.path is not None and self.path_cursor < len(self.path)
+
+    def sense_blocked_cells(self):
+        """Road cells around the car that a car or a red light blocks right now"""
+        radius = self.model.sense_radius
+        x, y = self.pos
+        blocked = []
+        for cx in range(max(0, x - radius), min(self.model.width, x + radius + 1)):
+            for cy in range(max(0, y - radius), min(self.model.height, y + radius + 1)):
+                pos = (cx, cy)
+                if pos == self.pos or not self.model.road_graph.is_road(pos):
+                    continue
+                if self.model.is_occupied(pos):
+                    blocked.append(pos)
+                elif self.model.signals.is_red(pos):
+                    blocked.append(pos)
+        return blocked
+
+    def replan_incremental(self):
+        """D* Lite route that repairs the car's previous search instead of starting over.
+
+        The car only sees the cells within model.sense_radius, so only the
+        blockages there are part of the search and the rest of the map is
+        assumed free.
+        """
         if not self.destination:
             return None
 
-        start = self.pos
-        goal = self.destination
-
-        open_set = [(0, start)]
-        came_from = {}
-        g_score = {start: 0}
-        f_score = {start: self.heuristic(start, goal)}
-        closed_set = set()
-
-        while open_set:
-            current = heapq.heappop(open_set)[1]
-
-            if current == goal:
-                path = []
-                while current in came_from:
-                    path.append(current)
-                    current = came_from[current]
-                path.append(start)
-                path.reverse()
-                return path[1:] if len(path) > 1 else []
+        blocked = self.sense_blocked_cells()
+        if self.planner is None or self.planner.goal != self.destination:
+            self.planner = DStarLite(self.model.road_graph, self.pos, self.destination, blocked)
+        else:
+            self.planner.move_start(self.pos)
+            # Las celdas fuera de vista se suponen libres, los carros ahí ya se movieron
+            self.planner.update_cells(blocked, self.planner.blocked.difference(blocked))
+        return self.planner.plan(horizon=self.model.sense_radius)
 
-            closed_set.add(current)
+    def follow_distance_field(self):
+        """Pick the next hop by looking at the neighbors' distance to the destination.
 
-            for neighbor in self.get_valid_neighbors(current):
-                if neighbor in closed_set:
-                    continue
+        Returns a one cell path, so the car asks again after every move. A
+        free neighbor closer to the destination is preferred; when they are
+        all blocked the car keeps the best one and waits for it to clear.
+        """
+        if not self.destination:
+            return None
 
-                tentative_g_score = g_score[current] + 1
+        field = self.model.distance_fields.field(self.destination)
+        candidates = self.model.road_graph.successors(self.pos)
+        if abs(self.destination[0] - self.pos[0]) + abs(self.destination[1] - self.pos[1]) == 1:
+            candidates.append(self.destination)
 
-                if neighbor not in g_score or tentative_g_score < g_score[neighbor]:
-                    came_from[neighbor] = current
-                    g_score[neighbor] = tentative_g_score
-                    f = tentative_g_score + self.heuristic(neighbor, goal)
-                    f_score[neighbor] = f
-                    heapq.heappush(open_set, (f, neighbor))
+        reachable = sorted((field[pos], pos) for pos in candidates if field[pos] != UNREACHABLE)
+        if not reachable:
+            return None
 
-        return None
+        for distance, next_pos in reachable:
+            if distance < field[self.pos] and self.is_valid_move(self.pos, next_pos):
+                return [next_pos]
+        return [reachable[0][1]]
 
     def step(self):
         """Execute one step of the car's behavior"""
@@ -116,44 +152,68 @@ class CarAgent(TrafficAgent):
             self.model.remove_agent(self)
             return
 
-        if not self.path:
-            self.path = self.find_path_astar()
-            if not self.path:
+        if not self.has_path():
+            # Una ruta seguida hasta el final solo necesita el siguiente tramo, como cada salto de
+            # routing="fields"; es una replanificación si la última búsqueda falló o cambió el destino
+            if self.path is None:
+                self.model.replans += 1
+            self.set_path(self.plan_route())
+            if not self.has_path():
                 self.waiting_time += 1
                 if self.waiting_time > 5:
                     self.find_destination()
                     self.waiting_time = 0
                 return
 
-        next_pos = self.path[0]
+        next_pos = self.model.search_kernel.position(self.path[self.path_cursor])
         self.orientation = self.get_direction(self.pos, next_pos)
         
-        # Verificar semáforos
-        cell_contents = self.model.grid.get_cell_list_contents(next_pos)
-        traffic_lights = [agent for agent in cell_contents 
-                        if isinstance(agent, TrafficLightAgent)]
-        
-        if traffic_lights:
-            traffic_light = traffic_lights[0]
-            dx = next_pos[0] - self.pos[0]
-            dy = next_pos[1] - self.pos[1]
-            
-            if traffic_light.state == "red":
-                if (traffic_light.orientation == "horizontal" and abs(dx) > 0) or \
-                   (traffic_light.orientation == "vertical" and abs(dy) > 0):
-                    self.waiting_time += 1
-                    return
+        # Verificar semáforos: esperar si uno en rojo detiene los movimientos en esta dirección
+        if self.model.signals.stops(self.pos, next_pos):
+            self.waiting_time += 1
+            return
         
         if self.is_valid_move(self.pos, next_pos):
-            self.model.grid.move_agent(self, next_pos)
-            self.path.pop(0)
+            self.model.move_car(self, next_pos)
+            self.path_cursor += 1
             self.waiting_time = 0
         else:
+            self.model.failed_moves += 1
             self.waiting_time += 1
             if self.waiting_time > 3:
-                self.path = self.find_path_astar()
+                self.model.replans += 1
+                self.set_path(self.plan_route())
                 self.waiting_time = 0
 
+    def idle_wait(self):
+        """How the next steps leave the car waiting in place, None when it would act.
+
+        Returns (increment, steps, light_cell): waiting_time grows by
+        increment on each step, steps is how many steps the car waits before
+        it replans (-1 while only a red light holds it) and light_cell is
+        the signal cell it waits to enter, None if there is no light there.
+        """
+        if not self.destination or self.pos == self.destination or not self.has_path():
+            return None
+        signals = self.model.signals
+        next_pos = self.model.search_kernel.position(self.path[self.path_cursor])
+        light_cell = next_pos if signals.light_at[next_pos] >= 0 else None
+        if signals.stops(self.pos, next_pos):
+            return 1, -1, light_cell
+
+        # Las mismas reglas de is_valid_move
+        if next_pos == self.destination or (not self.model.is_occupied(next_pos) and not signals.is_red(next_pos)
+                                            and self.model.road_graph.can_move(self.pos, next_pos)):
+            return None
+        if self.waiting_time >= 3:
+            return None
+        return 1, 3 - self.waiting_time, light_cell
+
+    def wait(self, steps, increment):
+        """Apply steps idle steps, see idle_wait"""
+        self.waiting_time += steps * increment
+        self.orientation = self.get_direction(self.pos, self.model.search_kernel.position(self.path[self.path_cursor]))
+
     def is_valid_move(self, current_pos, next_pos):
         """Check if the move is valid considering all constraints"""
         # Verificar límites del grid
@@ -165,44 +225,23 @@ class CarAgent(TrafficAgent):
         if next_pos == self.destination:
             return True
 
-        cell_contents = self.model.grid.get_cell_list_contents(next_pos)
-
-        # Verificar colisiones con otros carros o edificios
-        if any(isinstance(agent, (CarAgent, BuildingAgent, DestinationAgent)) for agent in cell_contents):
+        # Verificar colisiones con otros carros
+        if self.model.is_occupied(next_pos):
             return False
 
-        # Verificar semáforos
-        for agent in cell_contents:
-            if isinstance(agent, TrafficLightAgent):
-                # Si hay un semáforo en rojo, no se puede avanzar
-                if agent.state == "red":
-                    return False
-                  
-        # Verificar dirección válida de la calle
-        roads = [agent for agent in cell_contents if isinstance(agent, RoadAgent)]
-        if not roads:
+        # Si hay un semáforo en rojo, no se puede avanzar
+        if self.model.signals.is_red(next_pos):
             return False
 
-        # Obtener la dirección del movimiento
-        movement_dir = self.get_direction(current_pos, next_pos)
-        
-        # Verificar que la dirección del movimiento coincida con la dirección de la calle
-        road_directions = {road.direction for road in roads}
-        
-        valid_moves = {
-            'right': {'right', 'up', 'down'},
-            'left': {'left', 'up', 'down'},
-            'up': {'up', 'left', 'right'},
-            'down': {'down', 'left', 'right'}
-        }
-
-        return any(movement_dir in valid_moves[road_dir] for road_dir in road_directions)
+        # Edificios, destinos y dirección de la calle los resuelve el grafo compilado
+        return self.model.road_graph.can_move(current_pos, next_pos)
 
     def find_destination(self):
         """Find a random destination from available destinations"""
         if self.model.available_destinations:
-            self.destination = random.choice(self.model.available_destinations)
-            self.path = None
+            # El random del modelo, así un checkpoint guarda todos los sorteos de los carros
+            self.destination = self.model.random.choice(self.model.available_destinations)
+            self.set_path(None)
             return True
         return False
 
@@ -210,49 +249,15 @@ class TrafficLightAgent(TrafficAgent):
     def __init__(self, unique_id, model, orientation):
         super().__init__(unique_id, model, AgentType.TRAFFIC_LIGHT)
         self.orientation = orientation
-        self.state = "green" if orientation == "horizontal" else "red"
-        self.timer = 10
-        self.base_timer = 10
-        self.min_timer = 5
-        self.max_timer = 20
+
+    @property
+    def state(self):
+        """"red" or "green", read from the model's signal index"""
+        return self.model.signals.state(self.pos)
 
     def step(self):
-        if self.is_group_leader():
-            cars_waiting = self.count_waiting_cars()
-            
-            if cars_waiting > 0:
-                self.timer -= 2
-            else:
-                self.timer -= 1
-                
-            if self.timer <= 0:
-                self.switch_all_traffic_lights()
-                self.timer = max(self.min_timer, 
-                               min(self.max_timer, 
-                                   self.base_timer + (cars_waiting * 2)))
-
-    def is_group_leader(self):
-        horizontal_lights = [agent for agent in self.model.traffic_lights 
-                           if agent.orientation == "horizontal"]
-        return self == horizontal_lights[0] if horizontal_lights else False
-
-    def switch_all_traffic_lights(self):
-        for light in self.model.traffic_lights:
-            if light.orientation == "horizontal":
-                light.state = "green" if light.state == "red" else "red"
-            else:
-                light.state = "red" if light.state == "green" else "green"
-            light.timer = self.timer
-
-    def count_waiting_cars(self):
-        waiting = 0
-        neighbors = self.model.grid.get_neighbors(
-            self.pos, moore=False, include_center=True, radius=1
-        )
-        for neighbor in neighbors:
-            if isinstance(neighbor, CarAgent):
-                waiting += 1
-        return waiting
+        # El SignalController del modelo cambia los semáforos
+        pass
 
 class RoadAgent(TrafficAgent):
     def __init__(self, unique_id, model, direction):
@@ -0,0 +1,198 @@
+# checkpoint.py
+import io
+import json
+from array import array
+
+import numpy as np
+
+from .agent import CarAgent
+from .compiledmap import map_cache_key
+from .model import TrafficModel
+from .roadgraph import BIT_DIRECTIONS, DIRECTION_BITS
+
+# Bump when the snapshot layout changes
+CHECKPOINT_VERSION = 3
+
+# TrafficModel arguments a snapshot rebuilds its model with
+SETTINGS = ("static_layers", "routing", "route_workers", "congestion_refresh", "engine", "signal_groups",
+            "approach_length", "signal_timing", "history_capacity")
+COUNTERS = ("step_count", "cars_created", "spawn_frequency", "cars_moved", "cars_finished", "failed_moves",
+            "replans")
+# CarAgent attribute with the direction of the car's last move
+DIRECTION_ATTRIBUTE = "orientation"
+# Trip bookkeeping of every car, the same name on CarAgent and VectorCars
+TRIP_FIELDS = ("spawn_step", "last_move", "stops")
+
+
+def pack_paths(paths):
+    """Lengths and concatenated cells of a list of cell id sequences"""
+    lengths = np.array([len(path) for path in paths], dtype=np.int32)
+    cells = np.concatenate(paths).astype(np.int32) if paths else np.zeros(0, dtype=np.int32)
+    return lengths, cells
+
+
+def unpack_paths(lengths, cells):
+    ends = np.cumsum(lengths)
+    return [cells[end - length:end] for length, end in zip(lengths.tolist(), ends.tolist())]
+
+
+def save_checkpoint(model):
+    """Dynamic state of a model as a compact binary snapshot.
+
+    Holds the cars with the unread part of their paths, the signal phases
+    and timers, occupancy, queue counters, congestion levels, counters and
+    the model's random state, as typed arrays in one uncompressed .npz.
+    The map itself is referenced by path and content hash: its static
+    layers come back from the compiled map when the snapshot is loaded.
+    D* Lite searches are not kept, cars routed with "dstar" search afresh.
+    """
+    if model.tiles:
+        raise ValueError("The paths of a model stepped in tiles are in its worker processes")
+    settings = {name: getattr(model, name) for name in SETTINGS}
+    settings["event_driven"] = model.time_skipper is not None
+    random_version, random_state, gauss = model.random.getstate()
+    header = {"version": CHECKPOINT_VERSION, "map_file": model.map_file_path, "map_dict": model.map_dict_path,
+              "map_key": map_cache_key(model.map_file_path, model.map_dict_path), "settings": settings,
+              "counters": {name: getattr(model, name) for name in COUNTERS},
+              "stats": model.stats.state(), "history": model.active_cars_per_step.state(),
+              "random": [random_version, gauss]}
+
+    occupied = np.flatnonzero(model.occupancy.ravel() != -1)
+    arrays = {
+        "random_state": np.array(random_state, dtype=np.uint32),
+        "signal_phase": model.signal_controller.phase,
+        "signal_timer": model.signal_controller.timer,
+        "queue_counts": model.queues.counts,
+        "occupied_cells": occupied.astype(np.int32),
+        "occupied_cars": model.occupancy.ravel()[occupied],
+        "history_recent": model.active_cars_per_step.recent,
+        "history_overview": model.active_cars_per_step.overview[:model.active_cars_per_step.count],
+    }
+    if model.congestion:
+        arrays["congestion_level"] = model.congestion.level
+
+    if model.vector_cars:
+        cars = model.vector_cars
+        slots = cars.cars()
+        arrays["slots"] = slots.astype(np.int32)
+        for name in ("number", "pos", "dest", "waiting", "direction") + TRIP_FIELDS:
+            arrays[f"car_{name}"] = getattr(cars, name)[slots]
+        arrays["free_slots"] = np.array(cars.free_slots, dtype=np.int32)
+        arrays["spawned"] = np.array(cars.spawned, dtype=np.int32)
+        header["capacity"] = int(cars.alive.size)
+        paths = [cars.pool[start + cursor:start + length] for start, cursor, length in
+                 zip(cars.path_start[slots].tolist(), cars.cursor[slots].tolist(), cars.path_len[slots].tolist())]
+    else:
+        # In the schedule's order, which its next shuffle starts from
+        cars = list(model.schedule)
+        kernel = model.search_kernel
+        arrays["car_number"] = np.array([car.number for car in cars], dtype=np.int64)
+        arrays["car_pos"] = np.array([kernel.cell_id(car.pos) for car in cars], dtype=np.int32)
+        arrays["car_dest"] = np.array([kernel.cell_id(car.destination) if car.destination else -1
+                                       for car in cars], dtype=np.int32)
+        arrays["car_waiting"] = np.array([car.waiting_time for car in cars], dtype=np.int32)
+        arrays["car_direction"] = np.array([DIRECTION_BITS.get(getattr(car, DIRECTION_ATTRIBUTE), 0)
+                                            for car in cars], dtype=np.uint8)
+        for name in TRIP_FIELDS:
+            arrays[f"car_{name}"] = np.array([getattr(car, name) for car in cars], dtype=np.int32)
+        arrays["pending_routes"] = np.array([car.number for car in model.pending_routes], dtype=np.int64)
+        paths = [car.path[car.path_cursor:] if car.has_path() else () for car in cars]
+    arrays["path_lengths"], arrays["path_cells"] = pack_paths([np.asarray(path, dtype=np.int32) for path in paths])
+
+    arrays["header"] = np.frombuffer(json.dumps(header).encode(), dtype=np.uint8)
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def load_checkpoint(data, map_cache_dir=None, compiled_map=None, **overrides):
+    """New model in the state saved by save_checkpoint.
+
+    The map file must still have the content it had when the snapshot was
+    taken. compiled_map shares an already loaded compiled map of it,
+    otherwise it is loaded from map_cache_dir or compiled. overrides
+    replace TrafficModel arguments, for what-if runs from the same state;
+    they must keep the signal groups of the snapshot.
+    """
+    with np.load(io.BytesIO(data), allow_pickle=False) as snapshot:
+        arrays = {name: snapshot[name] for name in snapshot.files}
+    header = json.loads(arrays.pop("header").tobytes())
+    if header["version"] != CHECKPOINT_VERSION:
+        raise ValueError(f"Checkpoint version {header['version']} is not {CHECKPOINT_VERSION}")
+    if compiled_map is None and map_cache_key(header["map_file"], header["map_dict"]) != header["map_key"]:
+        raise ValueError(f"{header['map_file']} changed since the checkpoint was saved")
+
+    model = TrafficModel(header["map_file"], header["map_dict"], map_cache_dir=map_cache_dir,
+                         compiled_map=compiled_map, **{**header["settings"], **overrides})
+    controller = model.signal_controller
+    if controller.phase.size != arrays["signal_phase"].size:
+        raise ValueError(f"The checkpoint has {arrays['signal_phase'].size} signal groups, "
+                         f"the model {controller.phase.size}")
+
+    for name, value in header["counters"].items():
+        setattr(model, name, value)
+    model.stats.set_state(header["stats"])
+    model.active_cars_per_step.set_state(header["history"], arrays["history_recent"], arrays["history_overview"])
+    random_version, gauss = header["random"]
+    model.random.setstate((random_version, tuple(arrays["random_state"].tolist()), gauss))
+
+    controller.phase[:] = arrays["signal_phase"]
+    controller.timer[:] = arrays["signal_timer"]
+    lights = np.arange(controller.light_group.size)
+    model.signals.set_phase(lights, controller.phase[controller.light_group])
+    if model.congestion and "congestion_level" in arrays:
+        model.congestion.set_level(arrays["congestion_level"])
+
+    paths = unpack_paths(arrays["path_lengths"], arrays["path_cells"])
+    if model.vector_cars:
+        restore_vector_cars(model.vector_cars, header["capacity"], arrays, paths)
+    else:
+        restore_car_agents(model, arrays, paths)
+
+    # Cars placed on shared destination cells may have overwritten each other
+    model.occupancy.fill(-1)
+    model.occupancy.ravel()[arrays["occupied_cells"]] = arrays["occupied_cars"]
+    model.queues.counts[:] = arrays["queue_counts"]
+    return model
+
+
+def restore_car_agents(model, arrays, paths):
+    position = model.search_kernel.position
+    cars = []
+    trips = zip(*(arrays[f"car_{name}"].tolist() for name in TRIP_FIELDS))
+    for number, pos, dest, waiting, direction, trip, path in zip(
+            arrays["car_number"].tolist(), arrays["car_pos"].tolist(), arrays["car_dest"].tolist(),
+            arrays["car_waiting"].tolist(), arrays["car_direction"].tolist(), trips, paths):
+        car = CarAgent(f"car_{number}", model, number)
+        car.destination = position(dest) if dest != -1 else None
+        car.waiting_time = waiting
+        setattr(car, DIRECTION_ATTRIBUTE, BIT_DIRECTIONS.get(direction))
+        car.spawn_step, car.last_move, car.stops = trip
+        if path.size:
+            car.set_path(array('i', path.tobytes()))
+        model.place_car(car, position(pos))
+        cars.append(car)
+
+    # active_cars keeps the cars in the order they were created
+    model.active_cars = {car.number: car for car in sorted(cars, key=lambda car: car.number)}
+    model.pending_routes = [model.active_cars[number] for number in arrays["pending_routes"].tolist()]
+
+
+def restore_vector_cars(cars, capacity, arrays, paths):
+    while cars.alive.size < capacity:
+        cars.grow()
+    slots = arrays["slots"]
+    cars.alive[:] = False
+    cars.alive[slots] = True
+    for name in ("number", "pos", "dest", "waiting", "direction") + TRIP_FIELDS:
+        getattr(cars, name)[slots] = arrays[f"car_{name}"]
+    for slot, path in zip(slots.tolist(), paths):
+        cars.set_path(slot, path)
+    cars.free_slots = arrays["free_slots"].tolist()
+    cars.spawned = arrays["spawned"].tolist()
+    cars.count = int(slots.size)
+
+
+def fork(model, **overrides):
+    """Independent copy of a running model that shares its compiled map, see load_checkpoint"""
+    return load_checkpoint(save_checkpoint(model), compiled_map=model.compiled_map, **overrides)
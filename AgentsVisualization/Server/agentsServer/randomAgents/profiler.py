@@ -0,0 +1,94 @@
+# profiler.py
+import cProfile
+import io
+import pstats
+import time
+
+
+class StepProfiler:
+    """Wall time of each phase of TrafficModel.step and the growth of its hot path counters.
+
+    Attached as model.profiler, it is told where a step begins and where
+    each phase ends; a model without one only checks the attribute once
+    per phase. The counters are the model's own, always kept: A* searches
+    and nodes expanded by the search kernels, replans, moves made and moves
+    a car tried but could not make. The profiler reports how much they grew
+    since it was attached. With cprofile_steps the first that many steps
+    also run under cProfile, dumped to cprofile_path once they are done.
+    """
+    COUNTERS = ("searches", "expanded", "replans", "failed_moves", "cars_moved")
+
+    def __init__(self, model, cprofile_steps=0, cprofile_path=None):
+        self.model = model
+        self.steps = 0
+        # Seconds per phase, in the order the phases first ended
+        self.seconds = {}
+        self.last = 0.0
+        self.started = self.counters()
+        self.cprofile_steps = cprofile_steps
+        self.cprofile_path = cprofile_path
+        self.cprofiled = 0
+        self.cprofile = cProfile.Profile() if cprofile_steps else None
+
+    def counters(self):
+        model = self.model
+        kernel = model.search_kernel
+        return {"searches": kernel.searches, "expanded": kernel.expanded, "replans": model.replans,
+                "failed_moves": model.failed_moves, "cars_moved": model.cars_moved}
+
+    def begin(self):
+        """A step, or a run of skipped ones, starts now"""
+        if self.cprofiled < self.cprofile_steps:
+            self.cprofile.enable()
+        self.last = time.perf_counter()
+
+    def lap(self, phase):
+        """The phase that began at the last lap or begin() ends now"""
+        now = time.perf_counter()
+        self.seconds[phase] = self.seconds.get(phase, 0.0) + now - self.last
+        self.last = now
+
+    def end(self, phase, steps=1):
+        """The last phase ends now, and with it steps steps"""
+        self.lap(phase)
+        self.steps += steps
+        if self.cprofiled < self.cprofile_steps:
+            self.cprofile.disable()
+            self.cprofiled += steps
+            if self.cprofiled >= self.cprofile_steps and self.cprofile_path:
+                self.cprofile.dump_stats(self.cprofile_path)
+
+    def report(self):
+        """JSON ready dict of the time per phase and the counters since the profiler was attached"""
+        total = sum(self.seconds.values())
+        steps = max(self.steps, 1)
+        phases = {phase: {"seconds": round(seconds, 6), "ms_per_step": round(1000 * seconds / steps, 4),
+                          "share": round(seconds / total, 4) if total else 0.0}
+                  for phase, seconds in self.seconds.items()}
+        now = self.counters()
+        counters = {name: now[name] - self.started[name] for name in self.COUNTERS}
+        report = {"steps": self.steps, "seconds": round(total, 6), "ms_per_step": round(1000 * total / steps, 4),
+                  "phases": phases, "counters": counters,
+                  "per_step": {name: round(count / steps, 3) for name, count in counters.items()}}
+        if self.cprofile:
+            report["cprofile"] = {"steps": min(self.cprofiled, self.cprofile_steps), "of": self.cprofile_steps,
+                                  "path": self.cprofile_path}
+        return report
+
+    def cprofile_text(self, limit=25, sort="cumulative"):
+        """The functions cProfile saw, as pstats prints them, '' without cprofile_steps"""
+        if not self.cprofile or not self.cprofiled:
+            return ""
+        out = io.StringIO()
+        pstats.Stats(self.cprofile, stream=out).sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+
+def format_report(report):
+    """report() as a table for a terminal"""
+    lines = [f"{report['steps']} steps, {report['ms_per_step']:.3f} ms/step"]
+    for phase, times in report["phases"].items():
+        lines.append(f"  {phase:<10}{times['ms_per_step']:>10.3f} ms/step {100 * times['share']:>6.1f}%")
+    for name, count in report["counters"].items():
+        lines.append(f"  {name:<14}{count:>10} {report['per_step'][name]:>10.2f}/step")
+    return "\n".join(lines)
@@ -0,0 +1,236 @@
+# routing.py
+from array import array
+
+import numpy as np
+
+from .roadgraph import DIRECTION_DELTAS
+
+UNREACHABLE = np.iinfo(np.int32).max
+
+
+def graph_distances(road_graph, source, reverse=False, enter_from_neighbors=False):
+    """Moves between source and every cell of the road graph, by BFS.
+
+    Forward distances count the moves from source to each cell; with
+    reverse they count the moves from each cell to source. With
+    enter_from_neighbors, source can be entered from any adjacent cell, the
+    way cars reach their destination. Unreachable cells hold UNREACHABLE.
+    """
+    width, height = road_graph.width, road_graph.height
+    moves = road_graph.moves
+    dist = np.full((width, height), UNREACHABLE, dtype=np.int32)
+    dist[source] = 0
+
+    frontier_x = np.array([source[0]], dtype=np.int64)
+    frontier_y = np.array([source[1]], dtype=np.int64)
+    level = 0
+
+    while frontier_x.size:
+        level += 1
+        next_x, next_y = [], []
+
+        for bit, (dx, dy) in DIRECTION_DELTAS.items():
+            if reverse:
+                # Cells that reach the frontier moving in this direction
+                nx = frontier_x - dx
+                ny = frontier_y - dy
+                inside = (nx >= 0) & (nx < width) & (ny >= 0) & (ny < height)
+                nx, ny = nx[inside], ny[inside]
+                if level > 1 or not enter_from_neighbors:
+                    legal = (moves[nx, ny] & bit) != 0
+                    nx, ny = nx[legal], ny[legal]
+            else:
+                # Cells the frontier reaches moving in this direction
+                legal = (moves[frontier_x, frontier_y] & bit) != 0
+                nx = frontier_x[legal] + dx
+                ny = frontier_y[legal] + dy
+
+            unseen = dist[nx, ny] == UNREACHABLE
+            nx, ny = nx[unseen], ny[unseen]
+
+            dist[nx, ny] = level
+            next_x.append(nx)
+            next_y.append(ny)
+
+        frontier_x = np.concatenate(next_x)
+        frontier_y = np.concatenate(next_y)
+
+    return dist
+
+
+def compute_distance_field(road_graph, destination):
+    """Moves needed to reach destination from every cell, by reverse BFS.
+
+    Cars enter a destination from any adjacent cell, and every other step
+    follows the legal moves of the compiled road graph.
+    """
+    return graph_distances(road_graph, destination, reverse=True, enter_from_neighbors=True)
+
+
+class DistanceFields:
+    """One distance field per destination over the static road graph.
+
+    ``fields[i]`` belongs to ``destinations[i]``; the stack is rebuilt only
+    when the road graph it was computed from is replaced.
+    """
+    def __init__(self, destinations, fields):
+        self.destinations = list(destinations)
+        self.fields = fields
+        self.index = {pos: i for i, pos in enumerate(self.destinations)}
+
+    @classmethod
+    def compute(cls, road_graph, destinations):
+        fields = np.empty((len(destinations), road_graph.width, road_graph.height), dtype=np.int32)
+        for i, destination in enumerate(destinations):
+            fields[i] = compute_distance_field(road_graph, destination)
+        fields.flags.writeable = False
+        return cls(destinations, fields)
+
+    def field(self, destination):
+        return self.fields[self.index[destination]]
+
+    def distance(self, pos, destination):
+        return int(self.field(destination)[pos])
+
+
+class Landmarks:
+    """ALT preprocessing: exact distances from and to a few landmarks.
+
+    ``forward[i]`` holds the moves from ``landmarks[i]`` to every cell and
+    ``backward[i]`` the moves from every cell to it, so the triangle
+    inequality gives A* a lower bound that respects one-way streets.
+    """
+    def __init__(self, landmarks, forward, backward, road_graph):
+        self.landmarks = list(landmarks)
+        self.forward = forward
+        self.backward = backward
+        self.road_graph = road_graph
+        # Bound tables per goal, destinations are few and reused by every car
+        self._tables = {}
+        self._flat = {}
+
+    @classmethod
+    def select(cls, road_graph, count=8):
+        """Pick landmarks by farthest-point selection on the road graph"""
+        roads = road_graph.road_mask != 0
+        if not roads.any():
+            return cls([], np.empty((0, road_graph.width, road_graph.height), dtype=np.int32),
+                       np.empty((0, road_graph.width, road_graph.height), dtype=np.int32), road_graph)
+
+        # Start from the road cell farthest away from the first one in the map
+        first = tuple(int(i) for i in np.argwhere(roads)[0])
+        reach = graph_distances(road_graph, first).astype(np.int64)
+        reach[(reach == UNREACHABLE) | ~roads] = -1
+        candidate = np.unravel_index(np.argmax(reach), reach.shape)
+
+        landmarks, forward, backward = [], [], []
+        spread = np.full(roads.shape, np.iinfo(np.int64).max)
+
+        for _ in range(count):
+            landmark = (int(candidate[0]), int(candidate[1]))
+            landmarks.append(landmark)
+            forward.append(graph_distances(road_graph, landmark))
+            backward.append(graph_distances(road_graph, landmark, reverse=True))
+
+            # Next landmark: the road cell with the longest round trip to the closest one
+            round_trip = forward[-1].astype(np.int64) + backward[-1]
+            round_trip[(forward[-1] == UNREACHABLE) | (backward[-1] == UNREACHABLE)] = -1
+            spread = np.minimum(spread, round_trip)
+            spread[~roads] = -1
+            if spread.max() <= 0:
+                break
+            candidate = np.unravel_index(np.argmax(spread), spread.shape)
+
+        forward = np.stack(forward)
+        backward = np.stack(backward)
+        forward.flags.writeable = False
+        backward.flags.writeable = False
+        return cls(landmarks, forward, backward, road_graph)
+
+    def bound_table(self, goal):
+        """Lower bound on the moves from every cell to goal, built on first use.
+
+        Cars enter a destination from its adjacent road cells, so the bound
+        is taken to the closest of them plus the final move.
+        """
+        if goal not in self._tables:
+            if self.road_graph.is_road(goal):
+                targets, offset = [goal], 0
+            else:
+                x, y = goal
+                targets = [(x + dx, y + dy) for dx, dy in DIRECTION_DELTAS.values()
+                           if self.road_graph.in_bounds((x + dx, y + dy))
+                           and self.road_graph.is_road((x + dx, y + dy))]
+                offset = 1
+
+            shape = (len(targets), self.road_graph.width, self.road_graph.height)
+            bounds = np.zeros(shape, dtype=np.int64)
+            for forward, backward in zip(self.forward, self.backward):
+                forward = forward.astype(np.int64)
+                backward = backward.astype(np.int64)
+                for bound, target in zip(bounds, targets):
+                    # d(L, t) - d(L, v) and d(v, L) - d(t, L); unreachable cells give huge or negative terms
+                    np.maximum(bound, forward[target] - forward, out=bound)
+                    np.maximum(bound, backward - backward[target], out=bound)
+
+            table = bounds.min(axis=0) if targets else np.zeros(shape[1:], dtype=np.int64)
+            table = np.clip(table, 0, UNREACHABLE - offset) + offset
+            table[goal] = 0
+            self._tables[goal] = table.astype(np.int32)
+        return self._tables[goal]
+
+    def lower_bound(self, pos, goal):
+        """Lower bound on the moves from pos to goal"""
+        return int(self.bound_table(goal)[pos])
+
+    def flat_bounds(self, goal):
+        """bound_table(goal) flattened to the cell ids of the search kernel"""
+        if goal not in self._flat:
+            self._flat[goal] = array('i', self.bound_table(goal).ravel().tolist())
+        return self._flat[goal]
+
+
+class CongestionCosts:
+    """Live cost of entering every cell, from smoothed occupancy and queues.
+
+    Each refresh samples which cells hold a car and which hold a car that
+    is waiting, and folds the sample into an exponential moving average
+    with weight alpha. Every move into a cell, from any side, costs scale
+    plus scale * weight times that average, kept in integers for the search
+    kernel, whose heuristics stay admissible because no move costs less
+    than scale.
+    """
+    scale = 10
+
+    def __init__(self, width, height, alpha=0.3, weight=2.0):
+        self.width = width
+        self.height = height
+        self.alpha = alpha
+        self.weight = weight
+        self.level = np.zeros((width, height))
+        # Flat by kernel cell id, x * height + y
+        self.costs = array('i', [self.scale]) * (width * height)
+
+    def refresh(self, occupied, queued):
+        """Fold in one sample, given the positions with a car and with a waiting car"""
+        sample = np.zeros((self.width, self.height))
+        for cells in (occupied, queued):
+            if cells:
+                xs, ys = zip(*cells)
+                np.add.at(sample, (np.array(xs), np.array(ys)), 1)
+
+        self.level *= 1 - self.alpha
+        self.level += self.alpha * sample
+        self.update_costs()
+
+    def set_level(self, level):
+        """Replace the moving averages, as when restoring a checkpoint"""
+        self.level[:] = level
+        self.update_costs()
+
+    def update_costs(self):
+        costs = self.scale + np.rint(self.scale * self.weight * self.level).astype(np.int32)
+        self.costs = array('i', costs.ravel().tobytes())
+
+    def cost(self, pos):
+        return self.costs[pos[0] * self.height + pos[1]]
@@ -0,0 +1,392 @@
+# tilecars.py
+import multiprocessing
+import traceback
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .routebatch import load_routing, routing_initargs
+from .tripstats import TripStats
+from .vectorcars import VectorCars
+
+# Per car arrays of VectorCars that live in shared memory, indexed by slot
+SHARED = ("alive", "number", "pos", "dest", "waiting", "direction", "spawn_step", "last_move", "stops")
+# Private path arrays each worker keeps for the cars of its tile
+PRIVATE = ("path_start", "path_len", "cursor")
+# A tile's entry in the claims table for a cell none of its cars is trying
+NO_CLAIM = np.iinfo(np.int64).min
+
+
+def tile_owners(width, height, tiles):
+    """Tile of every cell, for tiles cut as columns x rows with the shortest borders"""
+    columns = min((c for c in range(1, tiles + 1) if tiles % c == 0),
+                  key=lambda c: (c - 1) * height + (tiles // c - 1) * width)
+    rows = tiles // columns
+    owners = np.zeros((width, height), dtype=np.int32)
+    for i, xs in enumerate(np.array_split(np.arange(width), columns)):
+        for j, ys in enumerate(np.array_split(np.arange(height), rows)):
+            if xs.size and ys.size:
+                owners[xs[0]:xs[-1] + 1, ys[0]:ys[-1] + 1] = i * rows + j
+    return owners
+
+
+class SharedArray:
+    """NumPy array in a shared memory block, which other processes attach to by spec()"""
+    def __init__(self, shape, dtype, name=None):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        size = max(1, int(np.prod(self.shape)) * self.dtype.itemsize)
+        self.block = shared_memory.SharedMemory(name=name, create=name is None, size=size)
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self.block.buf)
+
+    @classmethod
+    def copy_of(cls, array):
+        shared = cls(array.shape, array.dtype)
+        shared.array[...] = array
+        return shared
+
+    @classmethod
+    def attach(cls, spec):
+        name, shape, dtype = spec
+        return cls(shape, dtype, name)
+
+    def spec(self):
+        return self.block.name, self.shape, self.dtype.str
+
+    def close(self, unlink=False):
+        """Detach from the block, every view of array must be gone by now"""
+        self.array = None
+        self.block.close()
+        if unlink:
+            self.block.unlink()
+
+
+class TileCars(VectorCars):
+    """VectorCars stepped by worker processes that each own one tile of the map.
+
+    The occupancy grid and the per car arrays live in shared memory, in the
+    slots VectorCars would use, so the model reads the cars as usual. What
+    has to stay sequential stays here: the model's random draws, the slot
+    allocation, spawns and the signal controller. Each step sends every
+    worker the cars it adopts and the light states, and the workers resolve
+    the moves together in passes (see Tile.resolve). A car that crosses into
+    another tile is handed to that tile's worker with the rest of its path.
+    The results are the same as VectorCars.step for the same seed.
+    """
+    def __init__(self, model, tiles, capacity=1024):
+        super().__init__(model, capacity)
+        self.tiles = tiles
+        self.owners = tile_owners(model.width, model.height, tiles).ravel()
+        self.shared = {}
+        for name in SHARED:
+            self.share(name)
+        self.occupancy = SharedArray.copy_of(model.occupancy)
+        model.occupancy = self.occupancy.array
+        # Best claim of every tile on every cell in the current pass
+        self.claims = SharedArray((tiles, model.width * model.height), np.int64)
+        self.claims.array.fill(NO_CLAIM)
+        # Cars each tile has trying to move in the current pass
+        self.trying = SharedArray((tiles,), np.int64)
+        # Set when the workers have not attached to the shared blocks of the car arrays yet;
+        # they do on their next step, since the blocks may be replaced while they start up
+        self.resized = True
+        # Cars handed to each tile, adopted at the start of its next step
+        self.handoffs = [[] for _ in range(tiles)]
+
+        context = multiprocessing.get_context()
+        # Kept here, the workers only unpickle it once they have started
+        self.barrier = context.Barrier(tiles)
+        setup = (routing_initargs(model.compiled_map, model.landmarks), model.signals.detached(), self.owners,
+                 self.occupancy.spec(), self.claims.spec(), self.trying.spec())
+        self.connections = []
+        self.workers = []
+        for index in range(tiles):
+            connection, worker_connection = context.Pipe()
+            worker = context.Process(target=run_tile, args=(index, worker_connection, self.barrier, setup), daemon=True)
+            worker.start()
+            self.connections.append(connection)
+            self.workers.append(worker)
+
+    def share(self, name):
+        """Move the array name to a new shared memory block"""
+        self.shared[name] = SharedArray.copy_of(getattr(self, name))
+        setattr(self, name, self.shared[name].array)
+
+    def specs(self):
+        return {name: shared.spec() for name, shared in self.shared.items()}
+
+    def grow(self):
+        """Double the capacity, the workers attach to the new shared blocks on their next step"""
+        super().grow()
+        for name in SHARED:
+            old = self.shared[name]
+            self.share(name)
+            old.close(unlink=True)
+        self.resized = True
+
+    def route_spawned(self):
+        # The workers route the new cars at the start of the step, under the lights they spawned with
+        pass
+
+    def step(self):
+        """Step the cars of every tile in its worker, returns how many reached their destination"""
+        spawned = np.array(self.spawned, dtype=np.int64)
+        self.spawned = []
+        spawned_owners = self.owners[self.pos[spawned]]
+        specs = self.specs() if self.resized else None
+        self.resized = False
+        signals = self.model.signals
+        lights = signals.blocked.ravel()[signals.cells]
+
+        for index, connection in enumerate(self.connections):
+            connection.send(("step", specs, self.model.step_count, spawned[spawned_owners == index],
+                             self.handoffs[index], lights))
+        replies = [connection.recv() for connection in self.connections]
+        for reply in replies:
+            if reply[0] == "error":
+                raise RuntimeError(f"Tile worker failed:\n{reply[1]}")
+
+        # Slots go back to the free list in the order VectorCars.remove returns them
+        removed = np.sort(np.concatenate([reply[1] for reply in replies]))
+        self.free_slots.extend(removed.tolist())
+        self.count -= removed.size
+        self.handoffs = [[] for _ in range(self.tiles)]
+        kernel = self.model.search_kernel
+        for _, _, _, handoffs, counts, stats in replies:
+            for owner, parcel in handoffs.items():
+                self.handoffs[owner].append(parcel)
+            moved, failed_moves, replans, searches, expanded = counts
+            self.model.cars_moved += moved
+            self.model.failed_moves += failed_moves
+            self.model.replans += replans
+            kernel.searches += searches
+            kernel.expanded += expanded
+            self.model.stats.merge(stats)
+
+        # The random draws happen here, in slot order, as in VectorCars.step
+        retarget = np.sort(np.concatenate([reply[2] for reply in replies]))
+        self.choose_destinations(retarget.tolist())
+        # The workers moved the cars without the model's queues seeing it
+        self.model.queues.recount(self.model.occupancy)
+        return int(removed.size)
+
+    def close(self):
+        """Stop the workers and release the shared memory, the model keeps copies of the arrays"""
+        if not self.workers:
+            return
+        for connection in self.connections:
+            connection.send(("close",))
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+
+        for name in SHARED:
+            setattr(self, name, getattr(self, name).copy())
+            self.shared[name].close(unlink=True)
+        self.model.occupancy = self.model.occupancy.copy()
+        for shared in (self.occupancy, self.claims, self.trying):
+            shared.close(unlink=True)
+
+
+def run_tile(index, connection, barrier, setup):
+    """Worker process: step one Tile on every command until "close" """
+    tile = Tile(index, barrier, *setup)
+    while True:
+        command = connection.recv()
+        if command[0] == "close":
+            tile.close()
+            return
+        try:
+            connection.send(("ok",) + tile.step(*command[1:]))
+        except Exception:
+            # The other tiles would wait for this one at the barrier forever
+            barrier.abort()
+            connection.send(("error", traceback.format_exc()))
+
+
+class Tile:
+    """The cars of one tile, stepped in a worker process on the shared arrays of TileCars.
+
+    It stands in for the model of its VectorCars, which holds the paths of
+    the cars on the tile and steps them with the rules of VectorCars.step.
+    """
+    def __init__(self, index, barrier, routing, signals, owners, occupancy, claims, trying):
+        self.index = index
+        self.barrier = barrier
+        self.road_graph, self.search_kernel, self.landmarks = load_routing(*routing)
+        self.height = self.road_graph.height
+        self.signals = signals
+        self.owners = owners
+        self.congestion = None
+        self.route_batcher = None
+        self.cars_moved = 0
+        self.failed_moves = 0
+        self.replans = 0
+        self.step_count = 0
+        # What the tile's cars did in the current step, TileCars merges it into the model's
+        self.stats = TripStats()
+
+        self.occupancy_block = SharedArray.attach(occupancy)
+        self.occupancy = self.occupancy_block.array
+        self.claims = SharedArray.attach(claims)
+        self.trying = SharedArray.attach(trying)
+        # The car arrays come with the first step
+        self.shared = {}
+        self.cars = VectorCars(self, 0)
+        self.owned = np.zeros(0, dtype=bool)
+
+    def attach(self, specs):
+        """Use the shared blocks in specs, growing the private arrays to their capacity"""
+        cars = self.cars
+        capacity = specs["alive"][1][0]
+        for name in PRIVATE:
+            old = getattr(cars, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:old.size] = old
+            setattr(cars, name, new)
+        owned = np.zeros(capacity, dtype=bool)
+        owned[:self.owned.size] = self.owned
+        self.owned = owned
+
+        for name, spec in specs.items():
+            shared = SharedArray.attach(spec)
+            setattr(cars, name, shared.array)
+            old = self.shared.get(name)
+            self.shared[name] = shared
+            if old:
+                old.close()
+
+    def blocked_ids(self, near=None):
+        """TrafficModel.blocked_ids without congestion costs, on the shared occupancy"""
+        blocked = set(np.flatnonzero(self.occupancy != -1).tolist())
+        blocked.update(self.signals.red_ids().tolist())
+        return blocked
+
+    def step(self, specs, step_count, spawned, handoffs, lights):
+        """One step of the tile, returns (removed, retarget, handoffs, counts, stats) for TileCars.step"""
+        cars = self.cars
+        occupancy = self.occupancy.ravel()
+        counts = self.counts()
+        if specs:
+            self.attach(specs)
+        self.step_count = step_count
+        self.stats = TripStats()
+        for slots, lengths, cells in handoffs:
+            self.owned[slots] = True
+            cars.set_paths(slots, lengths, cells)
+
+        # New cars get their routes under the lights they spawned with
+        self.owned[spawned] = True
+        cars.plan(spawned)
+        self.signals.blocked.ravel()[self.signals.cells] = lights
+
+        # Cars that got to their destination last step leave the map
+        mine = np.flatnonzero(self.owned)
+        arrived = cars.pos[mine] == cars.dest[mine]
+        removed = mine[arrived]
+        cars.record_trips(removed)
+        cells = cars.pos[removed]
+        occupancy[cells[occupancy[cells] == cars.number[removed]]] = -1
+        cars.alive[removed] = False
+        self.release(removed)
+        mine = mine[~arrived & (cars.dest[mine] >= 0)]
+
+        # TileCars draws their new destinations once every tile is done
+        retarget = cars.plan_missing(mine)
+        cars.waiting[retarget] = 0
+
+        movers, start, target, at_goal, pending = cars.propose(mine)
+        moved = self.resolve(movers, start, target, at_goal, pending)
+        cars.hold(movers[~moved])
+
+        # Cars that crossed into another tile go to its worker with the rest of their path
+        mine = np.flatnonzero(self.owned)
+        owners = self.owners[cars.pos[mine]]
+        leaving = {}
+        for owner in np.unique(owners[owners != self.index]).tolist():
+            slots = mine[owners == owner]
+            leaving[owner] = (slots,) + cars.remaining(slots)
+            self.release(slots)
+        return removed, retarget, leaving, tuple(now - before for now, before in zip(self.counts(), counts)), self.stats
+
+    def counts(self):
+        """Moves made and failed, replans, searches and nodes expanded so far"""
+        kernel = self.search_kernel
+        return self.cars_moved, self.failed_moves, self.replans, kernel.searches, kernel.expanded
+
+    def release(self, slots):
+        self.owned[slots] = False
+        self.cars.path_len[slots] = self.cars.cursor[slots] = 0
+
+    def resolve(self, movers, start, target, at_goal, pending):
+        """The passes of VectorCars.step, in lockstep with the other tiles.
+
+        In every pass each tile posts the best claim of its cars on every
+        cell they try, waits at the barrier for the others and moves the cars
+        whose claim is the best of all the tiles. Cars arriving at their
+        destination always move; the destination cell gets the number of
+        the one VectorCars would write last, posted as the lowest claim,
+        once the passes are over. Returns which movers moved.
+        """
+        cars = self.cars
+        occupancy = self.occupancy.ravel()
+        claims = self.claims.array
+        row = claims[self.index]
+        trying_counts = self.trying.array
+        moved = np.zeros(movers.size, dtype=bool)
+        posted = np.zeros(0, dtype=np.int64)
+        arrivals = []
+        while True:
+            row[posted] = NO_CLAIM
+            trying = np.flatnonzero(pending & (at_goal | (occupancy[target] == -1)))
+            pending[trying] = False
+            trying, first = cars.rank(movers, trying, target)
+            cells = target[trying]
+            numbers = cars.number[movers[trying]]
+            keys = cars.waiting[movers[trying]].astype(np.int64) << 31 | (2 ** 31 - 1 - numbers)
+            goal = at_goal[trying]
+            last = np.ones(trying.size, dtype=bool)
+            last[:-1] = cells[1:] != cells[:-1]
+            claim = first & ~goal
+            arrive = last & goal
+            row[cells[claim]] = keys[claim]
+            row[cells[arrive]] = -keys[arrive] - 1
+            posted = cells[claim | arrive]
+            trying_counts[self.index] = trying.size
+
+            self.barrier.wait()
+            if not trying_counts.any():
+                break
+            won = goal.copy()
+            won[claim] = claims[:, cells[claim]].max(axis=0) == keys[claim]
+            writes = arrive.copy()
+            writes[arrive] = claims[:, cells[arrive]].max(axis=0) == -keys[arrive] - 1
+            arrivals.append((cells[writes], numbers[writes]))
+
+            # Commit: the cells left are this tile's, the cells taken were free
+            winners = trying[won]
+            cars_moving = movers[winners]
+            left = start[winners]
+            occupancy[left[occupancy[left] == cars.number[cars_moving]]] = -1
+            road = ~at_goal[winners]
+            occupancy[target[winners[road]]] = cars.number[cars_moving[road]]
+            self.cars_moved += int(winners.size)
+            cars.pos[cars_moving] = target[winners]
+            cars.cursor[cars_moving] += 1
+            cars.waiting[cars_moving] = 0
+            cars.record_moves(cars_moving)
+            moved[winners] = True
+            self.barrier.wait()
+
+        row[posted] = NO_CLAIM
+        for cells, numbers in arrivals:
+            occupancy[cells] = numbers
+        # Every move is in the occupancy grid before any tile replans
+        self.barrier.wait()
+        return moved
+
+    def close(self):
+        self.cars = None
+        self.occupancy = None
+        for shared in (self.occupancy_block, self.claims, self.trying, *self.shared.values()):
+            shared.close()
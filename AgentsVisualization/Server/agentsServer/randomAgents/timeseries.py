@@ -0,0 +1,118 @@
+# timeseries.py
+import numpy as np
+
+
+class StepSeries:
+    """One value per step, kept in two buffers of capacity points whatever the length of the run.
+
+    The recent buffer is a ring with the value of each of the last capacity
+    steps. The overview covers the whole run in buckets of stride steps,
+    each the mean of its values; when it fills, neighbouring buckets are
+    merged into one and the stride doubles. points(since) reads the
+    overview only for the steps the ring no longer holds, so a client that
+    keeps asking for the points after the last step it has gets the exact
+    values, at a cost that follows the new points and not the run.
+    """
+    def __init__(self, capacity=2048):
+        if capacity < 2 or capacity % 2:
+            raise ValueError(f"capacity must be an even number of at least 2, not {capacity}")
+        self.capacity = capacity
+        # Steps recorded so far, the value of step s is at recent[(s - 1) % capacity]
+        self.steps = 0
+        self.recent = np.zeros(capacity, dtype=np.int64)
+        # Full buckets of the overview, bucket i covers steps (i * stride, (i + 1) * stride]
+        self.overview = np.zeros(capacity, dtype=np.float64)
+        self.count = 0
+        self.stride = 1
+        # Sum and steps of the bucket being filled
+        self.partial_sum = 0
+        self.partial_steps = 0
+
+    def __len__(self):
+        return self.steps
+
+    def append(self, value, steps=1):
+        """Record value for each of the next steps steps"""
+        if steps == 1:
+            self.recent[self.steps % self.capacity] = value
+        else:
+            written = min(steps, self.capacity)
+            first = self.steps + steps - written
+            self.recent[np.arange(first, first + written) % self.capacity] = value
+        self.steps += steps
+
+        while steps:
+            taken = min(steps, self.stride - self.partial_steps)
+            self.partial_sum += value * taken
+            self.partial_steps += taken
+            steps -= taken
+            if self.partial_steps == self.stride:
+                self.overview[self.count] = self.partial_sum / self.stride
+                self.count += 1
+                self.partial_sum = self.partial_steps = 0
+                if self.count == self.capacity:
+                    half = self.capacity // 2
+                    self.overview[:half] = (self.overview[0::2] + self.overview[1::2]) / 2
+                    self.count = half
+                    self.stride *= 2
+
+    def points(self, since=0):
+        """(steps, values) of the points after step since, in step order.
+
+        Each point stands for the steps after the one before it up to its
+        own. Steps still in the recent buffer come one by one with their
+        exact value. Older ones come as the overview buckets, each at its
+        last step with its mean rounded to 2 decimals, and the steps between
+        the last of those and the recent buffer as one more point, whose mean
+        is its bucket's sum less the part the buffer still holds. When since
+        falls inside a bucket the first point is that bucket's, so its mean
+        also covers steps up to since; first_step(since) says where it starts.
+        """
+        first_recent = max(self.steps - self.capacity, 0) + 1
+        since = max(since, 0)
+        steps, values = [], []
+        if since + 1 < first_recent:
+            start = since // self.stride
+            stop = min(self.count, (first_recent - 1) // self.stride)
+            if start < stop:
+                steps = (np.arange(start + 1, stop + 1) * self.stride).tolist()
+                values = np.round(self.overview[start:stop], 2).tolist()
+
+            gap = first_recent - 1 - stop * self.stride
+            if gap > 0:
+                if stop < self.count:
+                    total, end = self.overview[stop] * self.stride, (stop + 1) * self.stride
+                else:
+                    total, end = self.partial_sum, self.steps
+                held = np.arange(first_recent, end + 1)
+                total -= self.recent[(held - 1) % self.capacity].sum()
+                steps.append(first_recent - 1)
+                values.append(round(float(total) / gap, 2))
+
+        first = max(since + 1, first_recent)
+        if first <= self.steps:
+            recent = np.arange(first, self.steps + 1)
+            steps += recent.tolist()
+            values += self.recent[(recent - 1) % self.capacity].tolist()
+        return steps, values
+
+    def first_step(self, since=0):
+        """First step the points after since stand for, before since + 1 when since falls inside a bucket"""
+        first_recent = max(self.steps - self.capacity, 0) + 1
+        since = max(since, 0)
+        if since + 1 >= first_recent:
+            return since + 1
+        stop = min(self.count, (first_recent - 1) // self.stride)
+        return min(since // self.stride, stop) * self.stride + 1
+
+    def state(self):
+        """JSON ready dict that set_state restores along with recent and overview"""
+        return {"capacity": self.capacity, "steps": self.steps, "count": self.count, "stride": self.stride,
+                "partial_sum": self.partial_sum, "partial_steps": self.partial_steps}
+
+    def set_state(self, state, recent, overview):
+        self.__init__(state["capacity"])
+        for name in ("steps", "count", "stride", "partial_sum", "partial_steps"):
+            setattr(self, name, state[name])
+        self.recent[:] = recent
+        self.overview[:self.count] = overview
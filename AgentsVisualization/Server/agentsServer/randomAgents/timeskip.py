@@ -0,0 +1,109 @@
+# timeskip.py
+import heapq
+
+import numpy as np
+
+
+class TimeSkipper:
+    """Jumps a TrafficModel over the steps in which no car can act.
+
+    When every car would only wait, behind a red light or another car, the
+    coming steps just run the light timers down and add up waiting times
+    until the first timed event wakes something: a spawn, a congestion
+    refresh, a car that gives up and replans, or the switch of a light a
+    car waits at. Those wakeups go into a priority queue and the model
+    jumps straight to the earliest one. The skipped steps are applied in
+    bulk, including the schedule's shuffles of model.random, so the run
+    and every step indexed statistic match running them one by one.
+    """
+    def __init__(self, model):
+        self.model = model
+        self.steps_skipped = 0
+        self.cars_moved = -1
+
+    def idle_cars(self):
+        """(increment, steps, light_cells) of every car, None when a car would act"""
+        model = self.model
+        if model.vector_cars:
+            idle = model.vector_cars.idle_wait()
+            if idle is None:
+                return None
+            return idle[1:]
+
+        increments, steps, light_cells = [], [], []
+        for car in model.active_cars.values():
+            idle = car.idle_wait()
+            if idle is None:
+                return None
+            increments.append(idle[0])
+            steps.append(idle[1])
+            if idle[2] is not None:
+                light_cells.append(idle[2][0] * model.height + idle[2][1])
+        return (np.array(increments, dtype=np.int64), np.array(steps, dtype=np.int64),
+                np.array(light_cells, dtype=np.int64))
+
+    def wakeups(self, limit):
+        """Priority queue of the coming events as (steps from now, event), None when the next step is busy"""
+        model = self.model
+        if model.step_count == 0 or model.pending_routes or (model.vector_cars and model.vector_cars.spawned):
+            return None
+
+        events = [(limit + 1, "limit"),
+                  (model.spawn_frequency - model.step_count % model.spawn_frequency, "spawn")]
+        if model.congestion:
+            events.append((model.congestion_refresh - model.step_count % model.congestion_refresh, "congestion"))
+        heapq.heapify(events)
+        if events[0][0] <= 1:
+            return None
+        return events
+
+    def skip(self, limit):
+        """Jump over the idle steps before the next event, at most limit of them; returns how many"""
+        # A step in which cars moved is rarely followed by an idle one, so only still steps look further
+        moved = self.model.cars_moved != self.cars_moved
+        self.cars_moved = self.model.cars_moved
+        if moved:
+            return 0
+        events = self.wakeups(limit)
+        if events is None:
+            return 0
+        idle = self.idle_cars()
+        if idle is None:
+            return 0
+        increment, steps, light_cells = idle
+
+        # Cars that run out of patience replan on the step after their last idle one
+        patient = steps[steps >= 0]
+        if patient.size:
+            heapq.heappush(events, (int(patient.min()) + 1, "replan"))
+        # A light switching on a car's way could let it through
+        controller = self.model.signal_controller
+        lights = self.model.signals.light_at.ravel()[light_cells]
+        switches = controller.steps_to_switch()
+        for group in np.unique(controller.light_group[lights]):
+            heapq.heappush(events, (int(switches[group]), "switch"))
+
+        skipped = events[0][0] - 1
+        if skipped > 0:
+            # Cars held by another car or a light across their way fail a move every step,
+            # the ones a red light stops in their direction just wait
+            self.apply(skipped, increment, int((steps >= 0).sum()))
+        return skipped
+
+    def apply(self, steps, increment, blocked):
+        """Run steps idle steps in bulk, with blocked cars failing a move on each of them"""
+        model = self.model
+        model.signal_controller.advance(steps)
+        # Every step reshuffles the scheduled agents with the model's random
+        model.shuffle_schedule(steps)
+        # Trip statistics need no update, they only count moves and arrivals
+        model.step_count += steps
+        model.failed_moves += steps * blocked
+
+        if model.vector_cars:
+            cars = np.flatnonzero(model.vector_cars.alive)
+            model.vector_cars.wait(cars, increment, steps)
+        else:
+            for car, car_increment in zip(model.active_cars.values(), increment.tolist()):
+                car.wait(steps, car_increment)
+        self.steps_skipped += steps
@@ -0,0 +1,334 @@
+# vectorcars.py
+import numpy as np
+
+from .roadgraph import DIRECTION_DELTAS
+
+
+class VectorCars:
+    """Every car of a TrafficModel as parallel NumPy arrays, stepped at once.
+
+    Slot i holds one car: its cell id, destination cell id, waiting time,
+    last direction and where its path lives in a shared pool of cell ids,
+    read through a cursor. Cell ids are the search kernel's, x * height + y.
+    Each step proposes every car's next cell, resolves the conflicts and
+    commits the moves in vectorized passes, with the rules of CarAgent.step:
+    red lights, the compiled road directions and one car per road cell.
+    Light states are read from the model's signal index every step.
+    """
+    def __init__(self, model, capacity=1024):
+        self.model = model
+        self.kernel = model.search_kernel
+        self.height = model.height
+        self.moves = np.asarray(model.road_graph.moves).ravel()
+
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.number = np.zeros(capacity, dtype=np.int64)
+        self.pos = np.zeros(capacity, dtype=np.int32)
+        self.dest = np.full(capacity, -1, dtype=np.int32)
+        self.waiting = np.zeros(capacity, dtype=np.int32)
+        self.direction = np.zeros(capacity, dtype=np.uint8)
+        self.path_start = np.zeros(capacity, dtype=np.int32)
+        self.path_len = np.zeros(capacity, dtype=np.int32)
+        self.cursor = np.zeros(capacity, dtype=np.int32)
+        # Trip bookkeeping for model.stats, as in CarAgent
+        self.spawn_step = np.zeros(capacity, dtype=np.int32)
+        self.last_move = np.zeros(capacity, dtype=np.int32)
+        self.stops = np.zeros(capacity, dtype=np.int32)
+        self.free_slots = list(range(capacity - 1, -1, -1))
+        self.count = 0
+        # Slots spawned since the last route_spawned()
+        self.spawned = []
+
+        # Paths of every car, back to back; compacted when it fills up
+        self.pool = np.zeros(4 * capacity, dtype=np.int32)
+        self.pool_used = 0
+
+        # Direction bit of a move, by (dx + 1) * 3 + dy + 1
+        self.step_bits = np.zeros(9, dtype=np.uint8)
+        for bit, (dx, dy) in DIRECTION_DELTAS.items():
+            self.step_bits[(dx + 1) * 3 + dy + 1] = bit
+
+    def grow(self):
+        """Double the capacity of every per-car array"""
+        capacity = self.alive.size
+        for name in ("alive", "number", "pos", "dest", "waiting", "direction",
+                     "path_start", "path_len", "cursor", "spawn_step", "last_move", "stops"):
+            old = getattr(self, name)
+            new = np.zeros(2 * capacity, dtype=old.dtype)
+            new[:capacity] = old
+            setattr(self, name, new)
+        self.dest[capacity:] = -1
+        self.free_slots.extend(range(2 * capacity - 1, capacity - 1, -1))
+
+    def spawn(self, pos, number):
+        """Add a car at pos with a random destination, route_spawned() finds its route"""
+        if not self.free_slots:
+            self.grow()
+        car = self.free_slots.pop()
+        self.alive[car] = True
+        self.number[car] = number
+        self.pos[car] = self.kernel.cell_id(pos)
+        self.waiting[car] = 0
+        self.direction[car] = 0
+        self.path_len[car] = self.cursor[car] = 0
+        self.spawn_step[car] = self.last_move[car] = self.model.step_count
+        self.stops[car] = 0
+        self.choose_destinations([car])
+        self.model.occupancy[pos] = number
+        self.model.queues.enter(pos)
+        self.count += 1
+        self.spawned.append(car)
+        return car
+
+    def route_spawned(self):
+        """Plan the routes of the cars spawned since the last call"""
+        cars = np.array(self.spawned, dtype=np.int64)
+        self.spawned = []
+        self.plan(cars)
+
+    def choose_destinations(self, cars):
+        destinations = self.model.available_destinations
+        for car in cars:
+            if destinations:
+                self.dest[car] = self.kernel.cell_id(self.model.random.choice(destinations))
+            self.path_len[car] = self.cursor[car] = 0
+
+    def remove(self, cars):
+        occupancy = self.model.occupancy.ravel()
+        cells = self.pos[cars]
+        mine = occupancy[cells] == self.number[cars]
+        occupancy[cells[mine]] = -1
+        self.model.queues.leave_ids(cells[mine])
+        self.alive[cars] = False
+        self.path_len[cars] = self.cursor[cars] = 0
+        self.free_slots.extend(cars.tolist())
+        self.count -= cars.size
+
+    def set_path(self, car, cells):
+        size = len(cells)
+        self.path_len[car] = self.cursor[car] = 0
+        if self.pool_used + size > self.pool.size:
+            self.compact(size)
+        self.pool[self.pool_used:self.pool_used + size] = cells
+        self.path_start[car] = self.pool_used
+        self.path_len[car] = size
+        self.pool_used += size
+
+    def set_paths(self, cars, lengths, cells):
+        """set_path for many cars at once, their paths given as lengths and concatenated cells"""
+        if self.pool_used + cells.size > self.pool.size:
+            self.compact(cells.size)
+        self.pool[self.pool_used:self.pool_used + cells.size] = cells
+        self.path_start[cars] = self.pool_used + np.cumsum(lengths) - lengths
+        self.path_len[cars] = lengths
+        self.cursor[cars] = 0
+        self.pool_used += cells.size
+
+    def remaining(self, cars):
+        """Lengths and concatenated cells of the unread part of the cars' paths"""
+        lengths = self.path_len[cars] - self.cursor[cars]
+        offsets = np.zeros(cars.size, dtype=np.int64)
+        np.cumsum(lengths[:-1], out=offsets[1:])
+        reads = np.repeat(self.path_start[cars] + self.cursor[cars] - offsets, lengths) + np.arange(int(lengths.sum()))
+        return lengths, self.pool[reads]
+
+    def compact(self, extra):
+        """Move the unread part of every path to the front of a pool with room for extra"""
+        cars = np.flatnonzero(self.alive & (self.cursor < self.path_len))
+        remaining, cells = self.remaining(cars)
+        used = cells.size
+
+        pool = np.zeros(max(self.pool.size, 2 * (used + extra)), dtype=np.int32)
+        pool[:used] = cells
+        self.pool = pool
+        self.pool_used = used
+        self.path_start[cars] = np.cumsum(remaining) - remaining
+        self.path_len[cars] = remaining
+        self.cursor[cars] = 0
+
+    def plan(self, cars):
+        """Search a route for every car in cars; those without one keep an empty path"""
+        model = self.model
+        if not cars.size:
+            return
+
+        if model.route_batcher:
+            requests = list(zip(self.pos[cars].tolist(), self.dest[cars].tolist()))
+            paths = model.route_batcher.solve(requests, model.blocked_ids(self.positions(cars)),
+                                              model.congestion)
+            for car, path in zip(cars.tolist(), paths):
+                self.set_path(car, np.frombuffer(path, dtype=np.int32) if path is not None else ())
+            return
+
+        # Without congestion costs every car sees the same blocked cells
+        shared = None if model.congestion else model.blocked_ids()
+        for car, start, goal in zip(cars.tolist(), self.pos[cars].tolist(), self.dest[cars].tolist()):
+            blocked = shared if shared is not None else model.blocked_ids([divmod(start, self.height)])
+            path = self.kernel.route_ids(start, goal, blocked, model.landmarks, model.congestion)
+            self.set_path(car, np.frombuffer(path, dtype=np.int32) if path is not None else ())
+
+    def heading(self, cars):
+        """Cell, next cell of the path and direction bit of the move for routed cars"""
+        start = self.pos[cars]
+        target = self.pool[self.path_start[cars] + self.cursor[cars]]
+        dx = target // self.height - start // self.height
+        dy = target % self.height - start % self.height
+        return start, target, self.step_bits[(dx + 1) * 3 + dy + 1]
+
+    def idle_wait(self):
+        """How the next steps leave the cars waiting in place, None when one of them would act.
+
+        Returns (cars, increment, steps, light_cells) for every car on the
+        map, like CarAgent.idle_wait: waiting grows by increment (0 for cars
+        without a destination) on each step, steps is how many steps a car
+        waits before it replans, -1 while only a red light holds it, and
+        light_cells are the signal cells the cars wait to enter.
+        """
+        cars = np.flatnonzero(self.alive)
+        movers = cars[self.dest[cars] >= 0]
+        if (self.pos[movers] == self.dest[movers]).any() or (self.cursor[movers] >= self.path_len[movers]).any():
+            return None
+
+        start, target, bits = self.heading(movers)
+        blocked = self.model.signals.blocked.ravel()
+        stopped = (blocked[target] & bits) != 0
+        free = (target == self.dest[movers]) | ((blocked[target] == 0) & ((self.moves[start] & bits) != 0)
+                                                & (self.model.occupancy.ravel()[target] == -1))
+        # A car held by another car or a light across its way replans once its waiting passes 3
+        steps = np.where(stopped, -1, 3 - self.waiting[movers])
+        if (~stopped & (free | (steps <= 0))).any():
+            return None
+
+        increment = (self.dest[cars] >= 0).astype(np.int64)
+        all_steps = np.full(cars.size, -1, dtype=np.int64)
+        all_steps[increment == 1] = steps
+        light_cells = target[self.model.signals.light_at.ravel()[target] >= 0]
+        return cars, increment, all_steps, light_cells
+
+    def wait(self, cars, increment, steps):
+        """Apply steps idle steps to cars, see idle_wait"""
+        self.waiting[cars] += (increment * steps).astype(np.int32)
+        movers = cars[increment > 0]
+        self.direction[movers] = self.heading(movers)[2]
+
+    def step(self):
+        """Advance every car one step, returns how many reached their destination"""
+        occupancy = self.model.occupancy.ravel()
+        queues = self.model.queues
+        cars = np.flatnonzero(self.alive)
+
+        # Cars that got to their destination last step leave the map
+        arrived = self.pos[cars] == self.dest[cars]
+        self.record_trips(cars[arrived])
+        self.remove(cars[arrived])
+        cars = cars[~arrived & (self.dest[cars] >= 0)]
+
+        retarget = self.plan_missing(cars)
+        self.choose_destinations(retarget.tolist())
+        self.waiting[retarget] = 0
+
+        movers, start, target, at_goal, pending = self.propose(cars)
+        moved = np.zeros(movers.size, dtype=bool)
+        while True:
+            trying = np.flatnonzero(pending & (at_goal | (occupancy[target] == -1)))
+            if not trying.size:
+                break
+            pending[trying] = False
+
+            # One car per road cell: the longest waiting car wins, then the lowest number
+            trying, first = self.rank(movers, trying, target)
+            winners = trying[first | at_goal[trying]]
+
+            # Commit
+            cars_moving = movers[winners]
+            left = start[winners]
+            mine = occupancy[left] == self.number[cars_moving]
+            occupancy[left[mine]] = -1
+            occupancy[target[winners]] = self.number[cars_moving]
+            queues.leave_ids(left[mine])
+            queues.enter_ids(target[winners])
+            self.model.cars_moved += int(winners.size)
+            self.pos[cars_moving] = target[winners]
+            self.cursor[cars_moving] += 1
+            self.waiting[cars_moving] = 0
+            self.record_moves(cars_moving)
+            moved[winners] = True
+
+        self.hold(movers[~moved])
+        return int(arrived.sum())
+
+    def record_moves(self, cars):
+        """The steps since each car's last move, if any, were a stop"""
+        step = self.model.step_count
+        stopped = step - self.last_move[cars] - 1
+        self.model.stats.record_stops(stopped[stopped > 0])
+        self.stops[cars] += stopped > 0
+        self.last_move[cars] = step
+
+    def record_trips(self, cars):
+        self.model.stats.record_trips(self.last_move[cars] - self.spawn_step[cars], self.stops[cars])
+
+    def plan_missing(self, cars):
+        """Plan the cars without a path, returns the ones that should try another destination.
+
+        Cars left without a route wait, and after more than 5 steps give up
+        on their destination.
+        """
+        unrouted = cars[self.cursor[cars] >= self.path_len[cars]]
+        self.model.replans += int(unrouted.size)
+        self.plan(unrouted)
+        failed = unrouted[self.cursor[unrouted] >= self.path_len[unrouted]]
+        self.waiting[failed] += 1
+        return failed[self.waiting[failed] > 5]
+
+    def propose(self, cars):
+        """Every routed car heads for the next cell of its path.
+
+        Cars stopped by a red light wait. Returns (movers, start, target,
+        at_goal, pending) for the rest: the destination is always open,
+        other cells need a legal move and no red light, and a car in them
+        is checked when resolving.
+        """
+        movers = cars[self.cursor[cars] < self.path_len[cars]]
+        start, target, bits = self.heading(movers)
+        self.direction[movers] = bits
+
+        # A red light stops the cars that would cross it along its orientation
+        blocked = self.model.signals.blocked.ravel()
+        stopped = (blocked[target] & bits) != 0
+        self.waiting[movers[stopped]] += 1
+        movers, start, target, bits = movers[~stopped], start[~stopped], target[~stopped], bits[~stopped]
+
+        # Occupancy is checked in passes, so a car can take a cell another
+        # one left earlier in the same step
+        at_goal = target == self.dest[movers]
+        pending = at_goal | ((blocked[target] == 0) & ((self.moves[start] & bits) != 0))
+        return movers, start, target, at_goal, pending
+
+    def rank(self, movers, trying, target):
+        """trying sorted by target cell and priority, with a mask of the first car for each cell"""
+        cars_trying = movers[trying]
+        order = np.lexsort((self.number[cars_trying], -self.waiting[cars_trying], target[trying]))
+        trying = trying[order]
+        first = np.ones(trying.size, dtype=bool)
+        first[1:] = target[trying][1:] != target[trying][:-1]
+        return trying, first
+
+    def hold(self, cars):
+        """Cars that could not move wait, and replan after more than 3 steps"""
+        self.model.failed_moves += int(cars.size)
+        self.waiting[cars] += 1
+        replan = cars[self.waiting[cars] > 3]
+        self.model.replans += int(replan.size)
+        self.path_len[replan] = self.cursor[replan] = 0
+        self.plan(replan)
+        self.waiting[replan] = 0
+
+    def cars(self):
+        """Slots of the cars on the map"""
+        return np.flatnonzero(self.alive)
+
+    def positions(self, cars=None):
+        """(x, y) of the cars in cars, every car by default"""
+        cars = self.cars() if cars is None else cars
+        return [divmod(int(cell), self.height) for cell in self.pos[cars]]
@@ -0,0 +1,34 @@
+# conftest.py
+import contextlib
+import io
+import os
+import random
+import sys
+
+import pytest
+
+SERVER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PUBLIC = os.path.join(SERVER, "..", "..", "public")
+sys.path.insert(0, SERVER)
+
+
+@pytest.fixture(autouse=True)
+def in_server(monkeypatch):
+    """Run every test from agentsServer, where the server's paths start"""
+    monkeypatch.chdir(SERVER)
+
+
+@pytest.fixture
+def build():
+    """Build a seeded TrafficModel on one of the public maps, without its console output"""
+    from randomAgents.model import TrafficModel
+
+    def build(map_name="2021", seed=0, **model_kwargs):
+        random.seed(seed)
+        with contextlib.redirect_stdout(io.StringIO()):
+            model = TrafficModel(os.path.join(PUBLIC, f"{map_name}_base.txt"),
+                                 os.path.join(PUBLIC, "mapDictionary.json"), **model_kwargs)
+        model.reset_randomizer(seed)
+        return model
+
+    return build
@@ -0,0 +1,96 @@
+# test_agents_server.py
+import os
+
+import pytest
+
+import agents_server
+
+MAP = {"mapFile": "../../public/2021_base.txt", "mapDict": "../../public/mapDictionary.json"}
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """Flask test client with its own map cache, checkpoints and profiles and no model yet"""
+    monkeypatch.setattr(agents_server, "MAP_CACHE_DIR", str(tmp_path / "mapcache"))
+    monkeypatch.setattr(agents_server, "CHECKPOINT_DIR", str(tmp_path / "checkpoints"))
+    monkeypatch.setattr(agents_server, "PROFILE_DIR", str(tmp_path / "profiles"))
+    monkeypatch.setattr(agents_server, "trafficModel", None)
+    monkeypatch.setattr(agents_server, "currentStep", 0)
+    yield agents_server.app.test_client()
+    if agents_server.trafficModel is not None:
+        agents_server.trafficModel.close()
+
+
+def test_init_resets_the_step(client):
+    assert client.post("/init", json=MAP).status_code == 200
+    assert client.get("/update?steps=5").json["currentStep"] == 5
+    assert client.post("/init", json=MAP).json["currentStep"] == 0
+    assert client.get("/update").json["currentStep"] == 1
+
+
+def test_update_needs_a_step(client):
+    client.post("/init", json=MAP)
+    for steps in (0, -5):
+        assert client.get(f"/update?steps={steps}").status_code == 400
+    assert client.get("/update?steps=2").json["currentStep"] == 2
+    assert agents_server.trafficModel.step_count == 2
+
+
+def test_failed_init_keeps_the_model(client):
+    client.post("/init", json={**MAP, "engine": "vector", "tiles": 2})
+    client.get("/update?steps=5")
+    assert client.post("/init", json={**MAP, "engine": "vector", "routing": "fields"}).status_code == 500
+    # The tile workers of the running model are still there to step it
+    assert len(agents_server.trafficModel.vector_cars.workers) == 2
+    assert client.get("/update?steps=5").json["currentStep"] == 10
+
+
+def test_checkpoint_restores_the_run(client):
+    client.post("/init", json=MAP)
+    client.get("/update?steps=40")
+    assert client.post("/saveCheckpoint", json={"name": "warm"}).json["currentStep"] == 40
+    client.get("/update?steps=30")
+    expected = client.get("/getStats").json
+
+    assert client.post("/initFromCheckpoint", json={"name": "warm"}).json["currentStep"] == 40
+    client.get("/update?steps=30")
+    assert client.get("/getStats").json == expected
+
+
+@pytest.mark.parametrize("engine, event_driven", [("agents", False), ("vector", True)])
+def test_stats_since_the_last_poll(client, engine, event_driven):
+    client.post("/init", json={**MAP, "engine": engine, "eventDriven": event_driven, "historyCapacity": 64})
+    seen, history = 0, []
+    for steps in [7] * 30 + [200, 7, 90, 3]:
+        client.get(f"/update?steps={steps}")
+        stats = client.get(f"/getStats?since={seen}").json["historicalStats"]
+        assert stats["lastStep"] == seen + steps
+        if steps <= 64:
+            # Still in the recent buffer, every step comes with its exact value
+            assert stats["steps"] == list(range(seen + 1, seen + steps + 1))
+            assert stats["firstStep"] == seen + 1
+        else:
+            assert seen < stats["steps"][0] and stats["steps"][-1] == stats["lastStep"]
+            assert stats["firstStep"] <= seen + 1
+        history += stats["activeCarsPerStep"]
+        seen = stats["lastStep"]
+
+    full = client.get("/getStats").json["historicalStats"]
+    assert full["firstStep"] == 1 and full["lastStep"] == seen
+    assert history[-64:] == full["activeCarsPerStep"][-64:]
+
+
+def test_debug_profile(client):
+    client.post("/init", json=MAP)
+    client.get("/update?steps=5")
+    assert client.get("/debug/profile").json == {"enabled": False}
+    client.post("/debug/profile", json={"cprofileSteps": 5})
+    client.get("/update?steps=20")
+
+    report = client.get("/debug/profile?top=5").json
+    assert report["enabled"] and report["steps"] == 20
+    assert set(report["phases"]) == {"spawn", "routes", "stats", "signals", "cars"}
+    assert report["counters"]["cars_moved"] > 0 and report["cprofile"]["steps"] == 5
+    assert "function calls" in report["cprofileTop"] and os.path.exists(report["cprofile"]["path"])
+    client.post("/debug/profile", json={"enabled": False})
+    assert client.get("/debug/profile").json == {"enabled": False}
@@ -0,0 +1,64 @@
+# test_timeseries.py
+import random
+
+import numpy as np
+import pytest
+
+from randomAgents.timeseries import StepSeries
+
+
+def fill(series, rng, steps):
+    """Append random values in runs of random length, returns the value of every step from step 1"""
+    truth = []
+    while len(truth) < steps:
+        run = min(rng.choice([1, 1, 1, 2, 5, 17]), steps - len(truth))
+        value = rng.randrange(50)
+        series.append(value, run)
+        truth += [value] * run
+    return truth
+
+
+def assert_points(series, truth, since):
+    """The points after since cover every step up to the last without a hole, each with the mean of its steps"""
+    steps, values = series.points(since)
+    first = series.first_step(since)
+    assert series.first_step(since) <= since + 1
+    if since >= len(truth):
+        assert steps == []
+        return
+    assert steps[-1] == len(truth)
+    assert steps[0] > since
+    for step, value in zip(steps, values):
+        assert value == pytest.approx(np.mean(truth[first - 1:step]), abs=0.0051), (since, first, step)
+        first = step + 1
+
+
+@pytest.mark.parametrize("capacity", [2, 4, 8, 16])
+def test_points_cover_every_step(capacity):
+    rng = random.Random(capacity)
+    for _ in range(20):
+        series = StepSeries(capacity)
+        truth = fill(series, rng, rng.randrange(1, 40 * capacity))
+        for since in range(len(truth) + 2):
+            assert_points(series, truth, since)
+        # Steps still in the ring come one by one, exactly
+        recent = max(len(truth) - capacity, 0)
+        assert series.points(recent) == (list(range(recent + 1, len(truth) + 1)), truth[recent:])
+        assert series.first_step(recent) == recent + 1
+
+
+def test_polling_across_the_ring():
+    rng = random.Random(0)
+    series = StepSeries(8)
+    truth, seen, got = [], 0, []
+    for _ in range(400):
+        # Mostly within the ring, sometimes further behind than it reaches
+        truth += fill(series, rng, rng.choice([1, 3, 7, 8, 9, 30]))
+        assert_points(series, truth, seen)
+        steps, values = series.points(seen)
+        if len(truth) - seen <= series.capacity:
+            assert (steps, values) == (list(range(seen + 1, len(truth) + 1)), truth[seen:])
+        got += steps
+        seen = steps[-1]
+    assert series.stride > 1
+    assert got == sorted(set(got))
@@ -0,0 +1,75 @@
+# test_trip_stats.py
+import math
+
+import numpy as np
+import pytest
+
+
+def assert_matches(stats, samples):
+    """stats holds the exact sums of samples, and their quantiles within its accuracy"""
+    samples = np.sort(np.asarray(samples, dtype=np.int64))
+    assert (stats.count, stats.total, stats.squares) == (samples.size, int(samples.sum()),
+                                                         int((samples * samples).sum()))
+    if not samples.size:
+        return
+    assert (stats.minimum, stats.maximum) == (int(samples[0]), int(samples[-1]))
+    for q in (0.01, 0.1, 0.5, 0.9, 0.99):
+        exact = int(samples[math.floor(q * (samples.size - 1))])
+        assert abs(stats.quantile(q) - exact) <= stats.accuracy * exact + 1e-9, q
+
+
+def trips_by_hand(model, steps):
+    """(stops, trip times, stops per trip) of steps steps, worked out from where the cars are after each one"""
+    spawned = {}
+    if model.vector_cars:
+        spawn = model.vector_cars.spawn
+
+        def vector_spawn(pos, number):
+            spawned[number] = (model.step_count, pos)
+            return spawn(pos, number)
+
+        model.vector_cars.spawn = vector_spawn
+    else:
+        place_car = model.place_car
+
+        def place(car, pos):
+            spawned[car.number] = (model.step_count, pos)
+            return place_car(car, pos)
+
+        model.place_car = place
+
+    # number -> [step of the last move, position, stops, spawn step]
+    cars = {}
+    waits, trips, stops = [], [], []
+    for _ in range(steps):
+        model.step()
+        step = model.step_count
+        now = {int(unique_id.split("_")[1]): pos for unique_id, pos, _ in model.iter_cars()}
+        # A car that found no destination never joins the active cars
+        for number, (spawn_step, pos) in spawned.items():
+            if number in now:
+                cars[number] = [spawn_step, pos, 0, spawn_step]
+        spawned.clear()
+        for number, car in list(cars.items()):
+            if number not in now:
+                trips.append(car[0] - car[3])
+                stops.append(car[2])
+                del cars[number]
+            elif now[number] != car[1]:
+                if step - car[0] > 1:
+                    waits.append(step - car[0] - 1)
+                    car[2] += 1
+                car[0], car[1] = step, now[number]
+    return waits, trips, stops
+
+
+@pytest.mark.parametrize("engine", ["agents", "vector"])
+def test_model_stats_match_the_cars(build, engine):
+    model = build(seed=5, engine=engine)
+    model.spawn_frequency = 3
+    waits, trips, stops = trips_by_hand(model, 300)
+    assert len(trips) > 50 and waits
+    assert_matches(model.stats.wait, waits)
+    assert_matches(model.stats.trip_time, trips)
+    assert_matches(model.stats.stops, stops)
+    assert model.cars_finished == len(trips)
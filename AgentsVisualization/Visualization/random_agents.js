@@ -171,10 +171,16 @@ let statistics = {
       currentStep: 0
   },
   historicalStats: {
+      steps: [],
       activeCarsPerStep: []
   }
 };
 
+// Último paso del historial que ya llegó, /getStats solo manda los siguientes
+let statsSince = 0;
+// Puntos del historial que se guardan en el navegador
+const maxHistoryPoints = 2048;
+
 let width = 0;
 let height = 0;
 
@@ -444,7 +450,7 @@ async function update() {
  */
 async function getStats() {
   try {
-      const response = await fetch(agent_server_uri + "getStats");
+      const response = await fetch(agent_server_uri + `getStats?since=${statsSince}`);
       if (!response.ok) {
           throw new Error(`Error fetching stats: ${response.statusText}`);
       }
@@ -455,6 +461,17 @@ async function getStats() {
       document.getElementById('carsFinished').textContent = data.currentStats.carsFinished;
       document.getElementById('trafficDensity').textContent = `${data.currentStats.trafficDensity.toFixed(2)}%`;
       document.getElementById('currentStep').textContent = data.currentStats.currentStep;
+
+      // Agregar los puntos nuevos del historial y quitar los más viejos
+      const history = statistics.historicalStats;
+      history.steps.push(...data.historicalStats.steps);
+      history.activeCarsPerStep.push(...data.historicalStats.activeCarsPerStep);
+      const extra = history.steps.length - maxHistoryPoints;
+      if (extra > 0) {
+          history.steps.splice(0, extra);
+          history.activeCarsPerStep.splice(0, extra);
+      }
+      statsSince = data.historicalStats.lastStep;
   } catch (error) {
       console.error("Error occurred while fetching stats:", error);
   }
@@ -466,6 +483,9 @@ function clearStats() {
   document.getElementById('carsFinished').textContent = '0';
   document.getElementById('trafficDensity').textContent = '0%';
   document.getElementById('currentStep').textContent = '0';
+  statistics.historicalStats.steps = [];
+  statistics.historicalStats.activeCarsPerStep = [];
+  statsSince = 0;
 }
 
 /*